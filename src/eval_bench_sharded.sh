@@ -0,0 +1,17 @@
+#!/bin/bash
+# Data-parallel evaluation: one engine per GPU, each on its own shard of every benchmark, then a merge of the shards.
+
+model_path="Model Path"
+file_name="FileName"
+num_shards=$(nvidia-smi -L | wc -l)
+
+export DECORD_EOF_RETRY_MAX=20480
+
+
+for shard_id in $(seq 0 $((num_shards - 1))); do
+    CUDA_VISIBLE_DEVICES=$shard_id python ./src/eval_bench.py --model_path "$model_path" --file_name "$file_name" \
+        --shard_id $shard_id --num_shards $num_shards &
+done
+wait
+
+python ./src/eval_bench.py --file_name "$file_name" --num_shards $num_shards --merge
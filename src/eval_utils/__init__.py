@@ -0,0 +1,18 @@
+from .backends import Backend, GenerationOutput, get_backend
+from .benchmarks import Benchmark, get_benchmarks
+from .merge import merge_shards
+from .pipeline import run_pipelined
+from .results import ResultsLog, write_summary
+
+
+__all__ = [
+    "Backend",
+    "Benchmark",
+    "GenerationOutput",
+    "ResultsLog",
+    "get_backend",
+    "get_benchmarks",
+    "merge_shards",
+    "run_pipelined",
+    "write_summary",
+]
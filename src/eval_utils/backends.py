@@ -0,0 +1,214 @@
+import hashlib
+import time
+from dataclasses import dataclass
+
+from .streaming import stream_generate
+
+
+@dataclass
+class GenerationOutput:
+    text: str
+    num_prompt_tokens: int
+    num_generated_tokens: int
+
+
+class Backend:
+    """
+    Inference engine behind evaluation and CoT generation: `generate(requests) -> outputs`.
+
+    A request is a `vllm.LLM.generate` input, `{"prompt", "multi_modal_data", "mm_processor_kwargs"}`, with the chat
+    template already applied and the media already decoded. `generate` returns one [`GenerationOutput`] per request, in
+    order, and raises if the batch as a whole fails. Sampling settings are fixed when the backend is built.
+    """
+
+    def generate(self, requests):
+        raise NotImplementedError
+
+    def stream(self, requests, max_num_pending):
+        """
+        Generation of `(key, Future)` requests yielding `(key, output, stats)` as they finish, see
+        [`stream_generate`]. Without an incremental engine API, this falls back to `generate` calls over the requests
+        ready so far, at most `max_num_pending` at a time.
+        """
+        requests = iter(requests)
+        for head in requests:
+            batch = [head]
+            while len(batch) < max_num_pending:
+                item = next(requests, None)
+                if item is None:
+                    break
+                batch.append(item)
+                if not item[1].done():
+                    break
+            ready = []
+            for key, future in batch:
+                try:
+                    ready.append((key, future.result()))
+                except Exception as e:
+                    yield key, e, None
+            if not ready:
+                continue
+            submitted = time.perf_counter()
+            try:
+                outputs = self.generate([llm_input for _, llm_input in ready])
+            except Exception as e:
+                outputs = [e] * len(ready)
+            stats = {"queue_seconds": None, "latency_seconds": time.perf_counter() - submitted}
+            for (key, _), output in zip(ready, outputs):
+                yield key, output, None if isinstance(output, Exception) else stats
+
+
+class VLLMBackend(Backend):
+    def __init__(self, model_path, temperature, top_p, max_tokens, tensor_parallel_size=None, max_model_len=8192,
+                 gpu_memory_utilization=0.8, limit_mm_per_prompt=None):
+        import torch
+        from vllm import LLM, SamplingParams
+
+        self.llm = LLM(
+            model=model_path,
+            tensor_parallel_size=tensor_parallel_size or torch.cuda.device_count(),
+            max_model_len=max_model_len,
+            gpu_memory_utilization=gpu_memory_utilization,
+            limit_mm_per_prompt=limit_mm_per_prompt or {"image": 1, "video": 1},
+        )
+        self.sampling_params = SamplingParams(
+            temperature=temperature,
+            top_p=top_p,
+            max_tokens=max_tokens,
+            stop_token_ids=[],
+        )
+
+    @staticmethod
+    def _output(out):
+        return GenerationOutput(out.outputs[0].text, len(out.prompt_token_ids), len(out.outputs[0].token_ids))
+
+    def generate(self, requests):
+        outputs = self.llm.generate(requests, sampling_params=self.sampling_params, use_tqdm=False)
+        return [self._output(out) for out in outputs]
+
+    def stream(self, requests, max_num_pending):
+        for key, output, stats in stream_generate(self.llm, requests, self.sampling_params, max_num_pending):
+            yield key, output if isinstance(output, Exception) else self._output(output), stats
+
+
+class HFBackend(Backend):
+    """
+    transformers `generate`, one request at a time. A reference for checking the vLLM outputs and a fallback where vLLM
+    is not available, not a fast path.
+    """
+
+    def __init__(self, model_path, temperature, top_p, max_tokens, processor=None, device=None):
+        import torch
+        from transformers import (
+            AutoModelForVision2Seq,
+            AutoProcessor,
+            Qwen2VLForConditionalGeneration,
+            Qwen2_5_VLForConditionalGeneration,
+        )
+
+        self.torch = torch
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        model_kwargs = dict(torch_dtype=torch.bfloat16 if self.device != "cpu" else torch.float32)
+        if "Qwen2-VL" in model_path:
+            model = Qwen2VLForConditionalGeneration.from_pretrained(model_path, **model_kwargs)
+        elif "Qwen2.5-VL" in model_path:
+            model = Qwen2_5_VLForConditionalGeneration.from_pretrained(model_path, **model_kwargs)
+        else:
+            model = AutoModelForVision2Seq.from_pretrained(model_path, **model_kwargs)
+        self.model = model.to(self.device).eval()
+        self.processor = processor or AutoProcessor.from_pretrained(model_path)
+        self.generation_kwargs = dict(
+            do_sample=temperature > 0,
+            temperature=temperature if temperature > 0 else None,
+            top_p=top_p if temperature > 0 else None,
+            max_new_tokens=max_tokens,
+        )
+
+    def generate(self, requests):
+        outputs = []
+        for request in requests:
+            mm_data = request["multi_modal_data"]
+            inputs = self.processor(
+                text=[request["prompt"]],
+                images=[mm_data["image"]] if "image" in mm_data else None,
+                videos=[mm_data["video"]] if "video" in mm_data else None,
+                padding=True,
+                return_tensors="pt",
+                **request.get("mm_processor_kwargs", {}),
+            ).to(self.device)
+            with self.torch.inference_mode():
+                generated = self.model.generate(**inputs, **self.generation_kwargs)
+            num_prompt_tokens = inputs["input_ids"].shape[1]
+            completion_ids = generated[0, num_prompt_tokens:]
+            text = self.processor.decode(completion_ids, skip_special_tokens=True)
+            outputs.append(GenerationOutput(text, num_prompt_tokens, len(completion_ids)))
+        return outputs
+
+
+class MockBackend(Backend):
+    """
+    Deterministic CPU stand-in: the output of a request only depends on its prompt, and generation can be made to take
+    `seconds_per_token` per generated token, so the decoding, scheduling, scoring and writing around the engine can be
+    run and benchmarked without a GPU. The answer is a digit or an option letter derived from the prompt's hash.
+    """
+
+    def __init__(self, num_tokens=64, seconds_per_token=0.0):
+        self.num_tokens = num_tokens
+        self.seconds_per_token = seconds_per_token
+
+    def generate(self, requests):
+        outputs = []
+        for request in requests:
+            digest = int(hashlib.sha256(request["prompt"].encode("utf-8")).hexdigest(), 16)
+            answer = "ABCD"[digest % 4] if "option letter" in request["prompt"] else str(digest % 10)
+            text = f"<think>{' '.join(['mock'] * (self.num_tokens - 2))}</think><answer>{answer}</answer>"
+            outputs.append(GenerationOutput(text, len(request["prompt"].split()), self.num_tokens))
+        time.sleep(self.seconds_per_token * self.num_tokens * len(requests))
+        return outputs
+
+
+class PlainChatTemplate:
+    """Stand-in for a processor's chat template, for the mock backend when no model files are available."""
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True):
+        prompt = ""
+        for message in messages:
+            content = message["content"]
+            if not isinstance(content, str):
+                content = "".join(
+                    "<|vision_start|><|video_pad|><|vision_end|>" if part["type"] == "video"
+                    else "<|vision_start|><|image_pad|><|vision_end|>" if part["type"] == "image"
+                    else part["text"]
+                    for part in content
+                )
+            prompt += f"<|im_start|>{message['role']}\n{content}<|im_end|>\n"
+        if add_generation_prompt:
+            prompt += "<|im_start|>assistant\n"
+        return prompt
+
+
+BACKENDS = ("vllm", "hf", "mock")
+
+
+def get_backend(name, model_path, temperature, top_p, max_tokens, mock_seconds_per_token=0.0, **kwargs):
+    """Backend `name` with the given sampling settings. `kwargs` go to the vLLM engine."""
+    if name == "vllm":
+        return VLLMBackend(model_path, temperature, top_p, max_tokens, **kwargs)
+    elif name == "hf":
+        return HFBackend(model_path, temperature, top_p, max_tokens)
+    elif name == "mock":
+        return MockBackend(num_tokens=min(max_tokens, 64), seconds_per_token=mock_seconds_per_token)
+    raise ValueError(f"Unknown backend {name}, expected one of {BACKENDS}")
+
+
+def load_processor(model_path):
+    """The model's processor with left padding, or a plain chat template when there is no model (mock backend)."""
+    if model_path is None:
+        return PlainChatTemplate()
+    from transformers import AutoProcessor, AutoTokenizer
+
+    processor = AutoProcessor.from_pretrained(model_path)
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    tokenizer.padding_side = "left"
+    processor.tokenizer = tokenizer
+    return processor
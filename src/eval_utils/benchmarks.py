@@ -0,0 +1,163 @@
+import json
+import os
+from dataclasses import dataclass, replace
+from typing import Optional
+
+
+QUESTION_TEMPLATE = (
+    "{Question}\n"
+    "Please think about this question as if you were a human pondering deeply. "
+    "Engage in an internal dialogue using expressions such as 'let me think', 'wait', 'Hmm', 'oh, I see', 'let's break it down', etc, or other natural language thought expressions "
+    "It's encouraged to include self-reflection or verification in the reasoning process. "
+    "Provide your detailed reasoning between the <think> and </think> tags, and then give your final answer between the <answer> and </answer> tags."
+)
+
+TYPE_TEMPLATE = {
+    "multiple choice": " Please provide only the single option letter (e.g., A, B, C, D, etc.) within the <answer> </answer> tags.",
+    "numerical": " Please provide the numerical value (e.g., 42 or 3.14) within the <answer> </answer> tags.",
+    "OCR": " Please transcribe text from the image/video clearly and provide your text answer within the <answer> </answer> tags.",
+    "free-form": " Please provide your text answer within the <answer> </answer> tags.",
+    "regression": " Please provide the numerical value (e.g., 42 or 3.14) within the <answer> </answer> tags."
+}
+
+
+def load_samples(path):
+    if path.endswith('.jsonl'):
+        data = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                data.append(json.loads(line))
+    elif path.endswith('.json'):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    else:
+        raise ValueError("Input file must be .json or .jsonl")
+    return data
+
+
+@dataclass
+class Benchmark:
+    """
+    One evaluation set: where its samples are, where its media live and where its results go.
+
+    Args:
+        name (`str`):
+            Name used in the output file names and in the reports.
+        prompt_path (`str`):
+            `.json` or `.jsonl` file of samples with `problem`, `problem_type`, `data_type`, `path` and `solution`.
+        output_path (`str`):
+            Summary file; the per-sample results log is the same path with a `.jsonl` extension. Shards insert their
+            shard suffix before the extension.
+        media_root (`str`, *optional*):
+            Directory the sample `path`s are relative to. Defaults to the VIDEO_BASE_PATH environment variable.
+        shard_id (`int`, *optional*, defaults to `0`):
+            Shard evaluated by this process, see `num_shards`.
+        num_shards (`int`, *optional*, defaults to `1`):
+            Number of shards the samples are split into by index, sample `idx` going to shard `idx % num_shards`. Each
+            shard writes its own `.shard<k>-of-<n>` results and summary, merged afterwards by [`merge_shards`].
+    """
+
+    name: str
+    prompt_path: str
+    output_path: str
+    media_root: Optional[str] = None
+    shard_id: int = 0
+    num_shards: int = 1
+
+    def __post_init__(self):
+        if not 0 <= self.shard_id < self.num_shards:
+            raise ValueError(f"shard_id must be in [0, {self.num_shards}), got {self.shard_id}")
+
+    def _shard_path(self, extension):
+        path = self.output_path[: -len(".json")]
+        if self.num_shards > 1:
+            path += f".shard{self.shard_id}-of-{self.num_shards}"
+        return path + extension
+
+    @property
+    def results_path(self):
+        return self._shard_path(".jsonl")
+
+    @property
+    def summary_path(self):
+        return self._shard_path(".json")
+
+    @property
+    def profile_path(self):
+        return self._shard_path("_profile.json")
+
+    def owns(self, idx):
+        return idx % self.num_shards == self.shard_id
+
+    def shards(self):
+        return [replace(self, shard_id=shard_id) for shard_id in range(self.num_shards)]
+
+    def unsharded(self):
+        return replace(self, shard_id=0, num_shards=1)
+
+    def media_path(self, path):
+        media_root = self.media_root if self.media_root is not None else os.environ.get('VIDEO_BASE_PATH', '')
+        if path.startswith('/'):
+            path = path[1:]  # Remove leading slash if exists
+        return os.path.join(media_root, path)
+
+    def load_samples(self):
+        return load_samples(self.prompt_path)
+
+    def build_messages(self, x):
+        if x["problem_type"] == 'multiple choice':
+            question = x['problem'] + "Options:\n"
+            for op in x["options"]:
+                question += op + "\n"
+        else:
+            question = x['problem']
+
+        return [{
+            "role": "user",
+            "content": [
+                {
+                    "type": x['data_type'],
+                    x['data_type']: self.media_path(x['path'])
+                },
+                {
+                    "type": "text",
+                    "text": QUESTION_TEMPLATE.format(Question=question) + TYPE_TEMPLATE[x['problem_type']]
+                }
+            ]
+        }]
+
+
+def video_r1_benchmark(name, file_name):
+    """Public video benchmarks of `src/r1-v/Evaluation`, whose sample paths are relative to `src/r1-v`."""
+    return Benchmark(
+        name=name,
+        prompt_path=f"./src/r1-v/Evaluation/eval_{name}.json",
+        output_path=f"./src/r1-v/eval_results/eval_{name}_{file_name}_greedy_output.json",
+        media_root=os.getcwd() + "/src/r1-v",
+    )
+
+
+def robot_benchmark(name, file_name):
+    """Robot planning benchmarks, whose sample paths are relative to VIDEO_BASE_PATH."""
+    return Benchmark(
+        name=name,
+        prompt_path=f"./src/r1-v/Evaluation/eval_{name}.json",
+        output_path=f"./src/r1-v/eval_results/eval_{name}_{file_name}_greedy_output.json",
+    )
+
+
+BENCHMARK_SUITES = {
+    "video-r1": (video_r1_benchmark, ['mvbench', 'tempcompass', 'videomme', 'videommmu', 'vsibench', 'mmvu']),
+    "robot": (robot_benchmark, ['planning_with_context_task']),  # 'planning_task',
+}
+
+
+def get_benchmarks(suite, file_name, names=None, shard_id=0, num_shards=1):
+    """Shard `shard_id` of the benchmarks of `suite`, all of them or only `names`."""
+    if suite not in BENCHMARK_SUITES:
+        raise ValueError(f"Unknown benchmark suite {suite}, expected one of {list(BENCHMARK_SUITES)}")
+    factory, default_names = BENCHMARK_SUITES[suite]
+    return [
+        replace(factory(name, file_name), shard_id=shard_id, num_shards=num_shards)
+        for name in (names or default_names)
+    ]
@@ -0,0 +1,67 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from qwen_vl_utils import fetch_image, fetch_video
+
+
+def media_key(vision_info):
+    return json.dumps(vision_info, sort_keys=True, default=str)
+
+
+class MediaCache:
+    """
+    Thread-safe cache of decoded images and videos, shared by every benchmark of a run.
+
+    Entries are keyed by the whole vision element (path and size/frame settings), so the same media used by several
+    benchmarks is decoded once while it stays among the last `max_entries` items. Concurrent requests for an item being
+    decoded wait for that decode instead of starting another one. `decode_seconds` and `decoded_frames` add up the
+    decodes that actually ran (an image counts as one frame).
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.decode_seconds = 0.0
+        self.decoded_frames = 0
+
+    def get(self, vision_info):
+        """Returns `(media, sample_fps)`; `sample_fps` is `None` for images."""
+        key = media_key(vision_info)
+        owner = False
+        with self._lock:
+            future = self._entries.get(key)
+            if future is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            else:
+                self.misses += 1
+                future = self._entries[key] = Future()
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                future.set_running_or_notify_cancel()
+                owner = True
+        if not owner:
+            return future.result()
+
+        start = time.perf_counter()
+        try:
+            if "video" in vision_info:
+                result = fetch_video(vision_info, return_video_sample_fps=True)
+            else:
+                result = (fetch_image(vision_info), None)
+        except Exception as e:
+            with self._lock:
+                self._entries.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self.decode_seconds += time.perf_counter() - start
+            self.decoded_frames += len(result[0]) if "video" in vision_info else 1
+        future.set_result(result)
+        return result
@@ -0,0 +1,49 @@
+import json
+import os
+
+from .results import ResultsLog, write_summary
+from .scoring import final_accuracy
+
+
+THROUGHPUT_TOTALS = ("samples", "generated_tokens", "samples_per_second", "tokens_per_second")
+
+
+def merge_shards(benchmark):
+    """
+    Merges the per-shard results of `benchmark` into its unsharded results log and summary, which then match a
+    single-process run: the same results by sample index, hence the same `final_acc`.
+
+    Shards hold disjoint indices; a shard without a results log, or samples no shard has a result for, are reported
+    as `missing_samples`. The throughput totals of the shard summaries are added up, since the shards run in parallel.
+    """
+    merged = benchmark.unsharded()
+    results = {}
+    throughput = dict.fromkeys(THROUGHPUT_TOTALS, 0)
+    for shard in benchmark.shards():
+        if not os.path.exists(shard.results_path):
+            print(f"{benchmark.name}: no results for shard {shard.shard_id} at {shard.results_path}")
+            continue
+        results.update(ResultsLog(shard.results_path).load())
+        if os.path.exists(shard.summary_path):
+            with open(shard.summary_path, "r", encoding="utf-8") as f:
+                shard_throughput = json.load(f).get("throughput", {})
+            for key in THROUGHPUT_TOTALS:
+                throughput[key] += shard_throughput.get(key, 0)
+
+    results = [results[index] for index in sorted(results)]
+    results_log = ResultsLog(merged.results_path)
+    results_log.rewrite(results)
+
+    summary = {
+        "final_acc": [final_accuracy(results)],
+        "num_samples": len(results),
+        "num_errors": sum("error" in result for result in results),
+        "missing_samples": len(benchmark.load_samples()) - len(results),
+        "results_path": merged.results_path,
+        "num_shards": benchmark.num_shards,
+        "throughput": throughput,
+    }
+    write_summary(merged.summary_path, summary)
+    print(f"{benchmark.name}: merged {benchmark.num_shards} shards, {summary['final_acc'][0]}")
+    print(f"Results saved to {merged.summary_path}")
+    return summary
@@ -0,0 +1,87 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+
+_DONE = object()
+
+
+def run_pipelined(batches, prepare_fn, generate_fn, finish_fn, num_decode_workers=4, max_prepared_batches=2):
+    """
+    Runs an evaluation as three overlapping stages, so the GPU never waits on video decoding or on result writing.
+
+    - `prepare_fn(batch)` (chat template and image/video decoding) runs in a pool of `num_decode_workers` threads,
+      ahead of generation. At most `max_prepared_batches` prepared batches wait in the queue, which bounds the host
+      memory held by decoded frames.
+    - `generate_fn(prepared)` runs on the calling thread, one batch at a time, in the order of `batches`.
+    - `finish_fn(batch, outputs)` (scoring and writing) runs on a writer thread. If preparing or generating a batch
+      raised, `outputs` is the exception instead.
+
+    An exception raised by `finish_fn` stops the pipeline and is re-raised here.
+    """
+    prepared_queue = queue.Queue(maxsize=max_prepared_batches)
+    finish_queue = queue.Queue()
+    stop = threading.Event()
+    writer_errors = []
+
+    def produce(executor):
+        for batch in batches:
+            future = executor.submit(prepare_fn, batch)
+            while not stop.is_set():
+                try:
+                    prepared_queue.put((batch, future), timeout=1.0)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set():
+                return
+        prepared_queue.put(_DONE)
+
+    def write():
+        while True:
+            item = finish_queue.get()
+            if item is _DONE:
+                return
+            try:
+                finish_fn(*item)
+            except Exception as e:
+                writer_errors.append(e)
+                stop.set()
+                return
+
+    with ThreadPoolExecutor(max_workers=num_decode_workers) as executor:
+        producer = threading.Thread(target=produce, args=(executor,), daemon=True)
+        writer = threading.Thread(target=write, daemon=True)
+        producer.start()
+        writer.start()
+        try:
+            with tqdm(total=len(batches), desc="Processing batches") as progress:
+                while not stop.is_set():
+                    # The producer returns without `_DONE` once `stop` is set (e.g. by a failing writer), so the wait
+                    # re-checks `stop` instead of blocking for good
+                    try:
+                        item = prepared_queue.get(timeout=1.0)
+                    except queue.Empty:
+                        continue
+                    if item is _DONE:
+                        break
+                    batch, future = item
+                    try:
+                        outputs = generate_fn(future.result())
+                    except Exception as e:
+                        outputs = e
+                    finish_queue.put((batch, outputs))
+                    progress.update(1)
+        finally:
+            stop.set()
+            # Unblock the producer if it waits on a full queue, then let the writer drain what was generated
+            while not prepared_queue.empty():
+                prepared_queue.get_nowait()
+            finish_queue.put(_DONE)
+            producer.join()
+            writer.join()
+            executor.shutdown(wait=False, cancel_futures=True)
+    if writer_errors:
+        raise writer_errors[0]
@@ -0,0 +1,117 @@
+import math
+import threading
+
+import numpy as np
+
+
+# Qwen2/2.5-VL vision encoder: 14x14 patches, 2x2 patches merged into one token, video frames paired in time
+PATCH_SIZE = 14
+MERGE_SIZE = 2
+TEMPORAL_PATCH_SIZE = 2
+
+
+def visual_token_count(media, mm_type):
+    """Visual tokens the model sees for an image (PIL) or a video (`(T, C, H, W)` frames) resized by qwen_vl_utils."""
+    if mm_type == "video":
+        num_frames, _, height, width = media.shape
+        grid_t = math.ceil(num_frames / TEMPORAL_PATCH_SIZE)
+    else:
+        width, height = media.size
+        grid_t = 1
+    return grid_t * (height // PATCH_SIZE) * (width // PATCH_SIZE) // (MERGE_SIZE * MERGE_SIZE)
+
+
+def _percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "mean": None}
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "mean": float(values.mean()),
+    }
+
+
+class EvalProfiler:
+    """
+    Per-sample and per-batch timings and token counts of an evaluation run, split by phase.
+
+    Per sample: chat templating (`template_seconds`), media decoding or cache lookup (`media_seconds`), the time from
+    submission until its output came back (`generate_seconds`: the whole `generate` call in chunked mode, the request
+    latency in streaming mode), and the prompt, visual, text and completion token counts. Per batch (chunked mode):
+    the preparation, generation and scoring/writing time of the whole batch, which may mix benchmarks. Scoring and
+    writing are also added up per benchmark. Samples are recorded from the decoding threads, hence the lock.
+
+    [`~EvalProfiler.summary`] reduces them to p50/p95 latencies, phase totals and token throughputs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.batches = []
+        self.phase_seconds = {}
+
+    def record_sample(self, item, **values):
+        with self._lock:
+            self.samples.setdefault(item, {}).update(values)
+
+    def record_batch(self, **values):
+        with self._lock:
+            self.batches.append(values)
+
+    def add_phase_seconds(self, bench_id, phase, seconds):
+        with self._lock:
+            self.phase_seconds[(bench_id, phase)] = self.phase_seconds.get((bench_id, phase), 0.0) + seconds
+
+    def sample_records(self, bench_id):
+        return [{"index": idx, **sample} for (sample_bench_id, idx), sample in self.samples.items()
+                if sample_bench_id == bench_id]
+
+    def batch_records(self, bench_id):
+        return [batch for batch in self.batches if bench_id in batch["bench_ids"]]
+
+    def summary(self, bench_id, generate_seconds, media_cache=None):
+        """
+        Summary of the samples of `bench_id` that were generated. Token throughputs are over `generate_seconds`, the
+        benchmark's share of generation time; the decoding rate is over the whole run since media are shared.
+        """
+        samples = [
+            sample for (sample_bench_id, _), sample in self.samples.items()
+            if sample_bench_id == bench_id and "completion_tokens" in sample
+        ]
+        batches = self.batch_records(bench_id)
+
+        def total(key):
+            return sum(sample.get(key, 0) for sample in samples)
+
+        latencies = [
+            sample.get("template_seconds", 0.0) + sample.get("media_seconds", 0.0) + sample["generate_seconds"]
+            for sample in samples
+        ]
+        tokens = {key: total(f"{key}_tokens") for key in ("prompt", "visual", "text", "completion")}
+        summary = {
+            "num_samples": len(samples),
+            "latency_seconds": _percentiles(latencies),
+            "generate_latency_seconds": _percentiles([sample["generate_seconds"] for sample in samples]),
+            "batch_seconds": _percentiles([
+                batch["prepare_seconds"] + batch["generate_seconds"] + batch["finish_seconds"] for batch in batches
+            ]),
+            "phase_seconds": {
+                "template": total("template_seconds"),
+                "media": total("media_seconds"),
+                "generate": generate_seconds,
+                "score_and_write": self.phase_seconds.get((bench_id, "score_and_write"), 0.0),
+            },
+            "tokens": tokens,
+            "tokens_per_second": {
+                "completion": tokens["completion"] / generate_seconds if generate_seconds > 0 else 0.0,
+                "total": (tokens["prompt"] + tokens["completion"]) / generate_seconds if generate_seconds > 0 else 0.0,
+            },
+        }
+        if media_cache is not None:
+            summary["decode"] = {
+                "frames": media_cache.decoded_frames,
+                "seconds": media_cache.decode_seconds,
+                "fps": media_cache.decoded_frames / media_cache.decode_seconds if media_cache.decode_seconds > 0 else 0.0,
+            }
+        return summary
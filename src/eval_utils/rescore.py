@@ -0,0 +1,139 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from open_r1 import scoring
+
+from .results import write_summary
+from .scoring import score_outputs
+
+
+CHUNK_SIZE = 10000
+# "eval": model outputs of the eval runner, scored like evaluation. "cot": `answer`s of CoT generation, scored with the
+# CoT filtering settings (relative regression reward, OCR and free-form scored)
+MODES = ("eval", "cot")
+
+
+def load_records(path):
+    """
+    Saved results of `path`, as JSON lines (strings) or parsed dicts. Accepts the results log of the eval runner, its
+    summary (which points to the log), a `{"results": [...]}` file of the earlier eval scripts and CoT generation, or a
+    plain JSON list. CoT generation records hold the extracted `answer` instead of the `output`, see `mode` in
+    [`rescore`].
+    """
+    if path.endswith('.jsonl'):
+        with open(path, "r", encoding="utf-8") as f:
+            return f.readlines()
+    elif path.endswith('.json'):
+        with open(path, "r", encoding="utf-8") as f:
+            content = json.load(f)
+        if isinstance(content, list):
+            return content
+        if "results" in content:
+            return content["results"]
+        if "results_path" in content:
+            return load_records(content["results_path"])
+        raise ValueError(f"{path} has neither `results` nor `results_path`")
+    else:
+        raise ValueError("Input file must be .json or .jsonl")
+
+
+def _score_chunk(start, records, mode):
+    """
+    `(index, problem_type, reward)` of each record, in order. Records without `index` are indexed by position, lines
+    cut short by a crash are skipped and errors get a `None` reward.
+    """
+    parsed = []
+    for position, record in enumerate(records, start=start):
+        if isinstance(record, str):
+            try:
+                record = json.loads(record)
+            except json.JSONDecodeError:
+                continue
+        parsed.append((record.get("index", position), record))
+
+    scored = [(index, record) for index, record in parsed if "error" not in record]
+    field = "output" if mode == "eval" else "answer"
+    missing = [index for index, record in scored if field not in record]
+    if missing:
+        raise ValueError(f"Results {missing[:5]} have no `{field}` to re-score in {mode} mode")
+    solutions = [record.get("solution", "") for _, record in scored]
+    problem_types = [record.get("problem_type", "") for _, record in scored]
+    if mode == "eval":
+        _, rewards = score_outputs([record["output"] for _, record in scored], solutions, problem_types)
+    else:
+        rewards = scoring.score_answers(
+            [record["answer"] for _, record in scored],
+            scoring.extract_answers(solutions),
+            problem_types,
+            regression_metric="relative",
+        )
+    rewards = iter(rewards.tolist())
+    return [
+        (index, record.get("problem_type", ""), None if "error" in record else next(rewards))
+        for index, record in parsed
+    ]
+
+
+def rescore(path, num_workers=None, chunk_size=CHUNK_SIZE, mode="eval"):
+    """
+    Recomputes the `final_acc` block of saved results with the current answer parser and metrics, without
+    regenerating. Records are parsed and scored in chunks of `chunk_size` across `num_workers` processes (all CPUs by
+    default). When an index appears more than once, the last record wins, as in [`ResultsLog.load`].
+
+    In `"eval"` mode the `output` of each record is parsed and scored like evaluation. In `"cot"` mode the `answer` of
+    each CoT generation record is scored as CoT generation filters it: relative regression reward, OCR and free-form
+    answers scored with WER and ROUGE.
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}, got {mode}")
+    records = load_records(path)
+    chunks = [(start, records[start:start + chunk_size]) for start in range(0, len(records), chunk_size)]
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for chunk in executor.map(_score_chunk, *zip(*chunks), [mode] * len(chunks)) if chunks else []:
+            for index, problem_type, reward in chunk:
+                results[index] = (problem_type, reward)
+
+    scored = [(problem_type, reward) for problem_type, reward in results.values() if reward is not None]
+    problem_types = np.array([problem_type for problem_type, _ in scored], dtype=object)
+    rewards = np.array([reward for _, reward in scored], dtype=np.float64)
+    per_type = {}
+    for problem_type in sorted(set(problem_types.tolist())):
+        mask = problem_types == problem_type
+        per_type[problem_type] = {"num_samples": int(mask.sum()), "mean_reward": float(rewards[mask].mean())}
+
+    return {
+        "final_acc": [scoring.final_accuracy(rewards, problem_types)],
+        "num_samples": len(results),
+        "num_errors": len(results) - len(scored),
+        "per_type": per_type,
+        "results_path": path,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score saved evaluation results")
+    parser.add_argument('paths', type=str, nargs='+', help="Results files (.json or .jsonl)")
+    parser.add_argument('--num_workers', type=int, default=None, help="Scoring processes, all CPUs by default")
+    parser.add_argument('--mode', type=str, default="eval", choices=MODES,
+                        help="eval: re-score the `output` of eval results; cot: re-score the `answer` of CoT "
+                             "generation results with the CoT settings")
+    parser.add_argument('--write', action='store_true',
+                        help="Also write each summary next to its input, as <name>_rescored.json")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        summary = rescore(path, num_workers=args.num_workers, mode=args.mode)
+        print(f"{path}: {json.dumps(summary['final_acc'][0])} over {summary['num_samples']} samples "
+              f"({summary['num_errors']} errors)")
+        for problem_type, metrics in summary["per_type"].items():
+            print(f"  {problem_type}: {metrics['mean_reward']:.4f} ({metrics['num_samples']})")
+        if args.write:
+            output_path = os.path.splitext(path)[0] + "_rescored.json"
+            write_summary(output_path, summary)
+            print(f"Summary saved to {output_path}")
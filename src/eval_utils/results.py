@@ -0,0 +1,67 @@
+import json
+import os
+
+
+class ResultsLog:
+    """
+    Append-only JSONL log of per-sample evaluation results, keyed by the `index` of the sample in the benchmark.
+
+    Every call to [`~ResultsLog.append`] writes one line per result and fsyncs, so the cost of saving a batch does not
+    grow with the number of results already saved, and a crash loses at most the batch being written. Completion may
+    be partial or out of order: resuming only needs the set of indices already in the log.
+
+    A result with an `error` field records a sample that could not be decoded or generated. It is not scored and does
+    not count as completed, so a rerun retries it; the new result, appended later, replaces it on load.
+
+    Args:
+        path (`str`):
+            Path to the `.jsonl` log, created on the first append.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> dict[int, dict]:
+        """Results by sample index. A line cut short by a crash is skipped; a later line for an index wins."""
+        results = {}
+        if not os.path.exists(self.path):
+            return results
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                results[result["index"]] = result
+        return results
+
+    def completed_indices(self) -> set[int]:
+        return {index for index, result in self.load().items() if "error" not in result}
+
+    def append(self, results: list[dict]) -> None:
+        if not results:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(result, ensure_ascii=False) + "\n" for result in results))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def rewrite(self, results: list[dict]) -> None:
+        """Replaces the log with `results` atomically."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp.{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(result, ensure_ascii=False) + "\n" for result in results))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+def write_summary(path: str, summary: dict) -> None:
+    """Writes the final summary of a benchmark atomically, so readers never see a partial file."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
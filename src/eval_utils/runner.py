@@ -0,0 +1,315 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+from .backends import BACKENDS, get_backend, load_processor
+from .benchmarks import BENCHMARK_SUITES, get_benchmarks
+from .media import MediaCache, media_key
+from .merge import merge_shards
+from .pipeline import run_pipelined
+from .profiler import EvalProfiler, visual_token_count
+from .results import ResultsLog, write_summary
+from .scoring import final_accuracy, score_samples
+from .streaming import prefetch
+
+
+BSZ = 64
+DECODE_WORKERS = 4
+MEDIA_CACHE_SIZE = 64
+MAX_RETRIES = 1
+MAX_NUM_PENDING = 256
+
+
+def evaluate(benchmarks, backend, processor, batch_size=BSZ, decode_workers=DECODE_WORKERS,
+             media_cache_size=MEDIA_CACHE_SIZE, max_retries=MAX_RETRIES, streaming=False,
+             max_num_pending=MAX_NUM_PENDING):
+    """
+    Evaluates several benchmarks with one engine, a [`Backend`] whose sampling settings are already fixed.
+
+    The pending samples of all `benchmarks` are scheduled as one work list, ordered by media so samples sharing a video
+    or image are decoded once (through a [`MediaCache`]) and sit in the same or adjacent batches. A batch may mix
+    benchmarks; its outputs are routed back to each benchmark's results log, which makes a rerun resume each benchmark
+    where it stopped. Each benchmark's summary gets its accuracy and its throughput, where a batch's generation time is
+    split across its generated samples evenly. Only the samples of the benchmarks' shard are evaluated.
+
+    Samples are decoded and generated independently: a sample whose media fails to decode is not submitted, and if a
+    `generate` call fails its samples are resubmitted one by one. Failed samples are retried up to `max_retries` times
+    after the pass, then logged with an `error` field instead of a score, so they are left out of the accuracy and
+    redone by the next run.
+
+    With `streaming`, samples are not chunked into `generate` calls: they go through [`Backend.stream`], which for vLLM
+    feeds them to the engine one by one ([`stream_generate`]), keeps up to `max_num_pending` requests in flight and
+    returns each result as soon as it finishes. Media are decoded up to `batch_size` samples ahead, results are written
+    every `batch_size` samples, and the throughput also reports the mean time spent waiting for the scheduler and the
+    mean request latency.
+
+    Per-sample and per-batch timings and token counts are recorded by an [`EvalProfiler`] and written to each
+    benchmark's `profile_path`, with a summary of the latency percentiles, phase totals, token throughput and media
+    decoding rate.
+    """
+    media_cache = MediaCache(media_cache_size)
+    profiler = EvalProfiler()
+    states = []
+    work = []
+    for bench_id, benchmark in enumerate(benchmarks):
+        data = benchmark.load_samples()
+        messages = [benchmark.build_messages(x) for x in data]
+        results_log = ResultsLog(benchmark.results_path)
+        completed = results_log.completed_indices()
+        pending = [idx for idx in range(len(data)) if benchmark.owns(idx) and idx not in completed]
+        if completed:
+            print(f"{benchmark.name}: resuming, {len(completed)} samples already done, {len(pending)} left")
+        states.append({
+            "data": data,
+            "messages": messages,
+            "results_log": results_log,
+            "throughput": {"samples": 0, "generated_tokens": 0, "generate_seconds": 0.0},
+        })
+        work.extend((bench_id, idx) for idx in pending)
+
+    # Samples with the same media are adjacent, so a cached decode is reused before it is evicted
+    work.sort(key=lambda item: media_key(states[item[0]]["messages"][item[1]][0]["content"][0]))
+
+    def prepare_sample(item):
+        bench_id, idx = item
+        msg = states[bench_id]["messages"][idx]
+        vision_info = msg[0]["content"][0]
+        start = time.perf_counter()
+        media, sample_fps = media_cache.get(vision_info)
+        media_done = time.perf_counter()
+        prompt = processor.apply_chat_template(msg, tokenize=False, add_generation_prompt=True)
+        mm_type = vision_info["type"]
+        profiler.record_sample(
+            item,
+            media_seconds=media_done - start,
+            template_seconds=time.perf_counter() - media_done,
+            visual_tokens=visual_token_count(media, mm_type),
+        )
+        return {
+            "prompt": prompt,
+            "multi_modal_data": {mm_type: media},
+            "mm_processor_kwargs": {"fps": sample_fps} if mm_type == "video" else {},
+        }
+
+    def prepare_batch(batch):
+        # Each sample is decoded on its own, so a corrupt video only fails its own sample
+        start = time.perf_counter()
+        prepared = []
+        for item in batch:
+            try:
+                prepared.append(prepare_sample(item))
+            except Exception as e:
+                prepared.append(e)
+        return prepared, time.perf_counter() - start
+
+    def generate_batch(prepared_batch):
+        prepared, prepare_seconds = prepared_batch
+        # Only the samples that decoded are submitted
+        valid = [i for i, llm_input in enumerate(prepared) if not isinstance(llm_input, Exception)]
+        outputs = list(prepared)
+        if not valid:
+            return outputs, 0.0, prepare_seconds
+        start = time.perf_counter()
+        try:
+            generated = backend.generate([prepared[i] for i in valid])
+        except Exception:
+            # Find the offending samples by submitting them one at a time
+            generated = []
+            for i in valid:
+                try:
+                    generated.extend(backend.generate([prepared[i]]))
+                except Exception as e:
+                    generated.append(e)
+        elapsed = time.perf_counter() - start
+        for i, out in zip(valid, generated):
+            outputs[i] = out
+        return outputs, elapsed, prepare_seconds
+
+    def record(item, output, generate_seconds, latency_seconds, stats=None):
+        if isinstance(output, Exception):
+            failures[item] = output
+            return
+        visual_tokens = profiler.samples.get(item, {}).get("visual_tokens", 0)
+        profiler.record_sample(
+            item,
+            generate_seconds=latency_seconds,
+            prompt_tokens=output.num_prompt_tokens,
+            text_tokens=max(output.num_prompt_tokens - visual_tokens, 0),
+            completion_tokens=output.num_generated_tokens,
+            queue_seconds=stats["queue_seconds"] if stats is not None else None,
+        )
+        bench_id, idx = item
+        state = states[bench_id]
+        sample = state["data"][idx]
+        sample["index"] = idx
+        unwritten.setdefault(bench_id, []).append((sample, output.text))
+        throughput = state["throughput"]
+        throughput["samples"] += 1
+        throughput["generated_tokens"] += output.num_generated_tokens
+        throughput["generate_seconds"] += generate_seconds
+        if stats is not None:
+            throughput["latency_seconds"] = throughput.get("latency_seconds", 0.0) + stats["latency_seconds"]
+            if stats["queue_seconds"] is not None:
+                throughput["queue_seconds"] = throughput.get("queue_seconds", 0.0) + stats["queue_seconds"]
+
+    def flush():
+        for bench_id, scored in unwritten.items():
+            start = time.perf_counter()
+            samples, outputs = zip(*scored)
+            states[bench_id]["results_log"].append(score_samples(list(samples), list(outputs)))
+            profiler.add_phase_seconds(bench_id, "score_and_write", time.perf_counter() - start)
+        unwritten.clear()
+
+    def finish_batch(batch, outputs):
+        start = time.perf_counter()
+        if isinstance(outputs, Exception):
+            outputs = ([outputs] * len(batch), 0.0, 0.0)
+        batch_outputs, elapsed, prepare_seconds = outputs
+        num_generated = sum(not isinstance(output, Exception) for output in batch_outputs)
+        for item, output in zip(batch, batch_outputs):
+            record(item, output, elapsed / num_generated if num_generated else 0.0, elapsed)
+        flush()
+        profiler.record_batch(
+            bench_ids=sorted({bench_id for bench_id, _ in batch}),
+            num_samples=len(batch),
+            num_generated=num_generated,
+            prepare_seconds=prepare_seconds,
+            generate_seconds=elapsed,
+            finish_seconds=time.perf_counter() - start,
+        )
+
+    def run_streaming(work):
+        # Each sample is charged the time since the previous completion, so the shares add up to the wall time
+        last_finished = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=decode_workers) as executor:
+            requests = prefetch(executor, prepare_sample, work, depth=batch_size)
+            with tqdm(total=len(work), desc="Processing samples") as progress:
+                for item, output, stats in backend.stream(requests, max_num_pending):
+                    now = time.perf_counter()
+                    record(
+                        item,
+                        output,
+                        now - last_finished if stats is not None else 0.0,
+                        stats["latency_seconds"] if stats is not None else 0.0,
+                        stats,
+                    )
+                    if stats is not None:
+                        last_finished = now
+                    progress.update(1)
+                    if sum(len(results) for results in unwritten.values()) >= batch_size:
+                        flush()
+        flush()
+
+    # Failed samples go back into a retry queue, so transient decoding or engine errors do not cost any sample
+    unwritten = {}
+    failures = {}
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            print(f"Retrying {len(work)} failed samples (attempt {attempt}/{max_retries})")
+        failures = {}
+        if streaming:
+            run_streaming(work)
+        else:
+            batches = [work[i:i + batch_size] for i in range(0, len(work), batch_size)]
+            run_pipelined(batches, prepare_batch, generate_batch, finish_batch, num_decode_workers=decode_workers)
+        work = [item for item in work if item in failures]
+        if not work:
+            break
+    print(f"Media cache: {media_cache.hits} hits, {media_cache.misses} decodes")
+
+    # Samples that still fail are logged as errors rather than scored as incorrect, and are retried by the next run
+    errors = {}
+    for (bench_id, idx), error in failures.items():
+        sample = states[bench_id]["data"][idx]
+        print('error:', benchmarks[bench_id].name, sample.get('path'), repr(error))
+        errors.setdefault(bench_id, []).append({**sample, "index": idx, "error": repr(error)})
+    for bench_id, results in errors.items():
+        states[bench_id]["results_log"].append(results)
+
+    summaries = {}
+    for bench_id, (benchmark, state) in enumerate(zip(benchmarks, states)):
+        # Score every sample in the log, including the ones completed by earlier runs
+        results = state["results_log"].load()
+        throughput = state["throughput"]
+        seconds = throughput["generate_seconds"]
+        throughput["samples_per_second"] = throughput["samples"] / seconds if seconds > 0 else 0.0
+        throughput["tokens_per_second"] = throughput["generated_tokens"] / seconds if seconds > 0 else 0.0
+        for key in ("queue_seconds", "latency_seconds"):
+            if key in throughput:
+                throughput[f"mean_{key}"] = throughput.pop(key) / throughput["samples"]
+        summary = {
+            "final_acc": [final_accuracy(list(results.values()))],
+            "num_samples": len(results),
+            "num_errors": sum("error" in result for result in results.values()),
+            "results_path": benchmark.results_path,
+            "profile_path": benchmark.profile_path,
+            "throughput": throughput,
+        }
+        profile = profiler.summary(bench_id, seconds, media_cache)
+        try:
+            write_summary(benchmark.summary_path, summary)
+            write_summary(benchmark.profile_path, {
+                "summary": profile,
+                "batches": profiler.batch_records(bench_id),
+                "samples": profiler.sample_records(bench_id),
+            })
+            print(f"{benchmark.name}: {summary['final_acc'][0]}, {throughput['tokens_per_second']:.1f} tokens/s")
+            print(f"  latency p50 {profile['latency_seconds']['p50']}s, p95 {profile['latency_seconds']['p95']}s, "
+                  f"phases {profile['phase_seconds']}")
+            print(f"Results saved to {benchmark.summary_path}")
+        except Exception as e:
+            print(f"Error writing final accuracy to output file: {e}")
+        summaries[benchmark.name] = summary
+    return summaries
+
+
+def main(default_suite="video-r1"):
+    parser = argparse.ArgumentParser(description="Evaluation benchmark")
+    parser.add_argument('--model_path', type=str, default=None, help="Path to the model")
+    parser.add_argument('--file_name', type=str, required=True, help="Name of the file")
+    parser.add_argument('--suite', type=str, default=default_suite, choices=list(BENCHMARK_SUITES),
+                        help="Benchmark suite to evaluate")
+    parser.add_argument('--benchmarks', type=str, nargs='+', default=None,
+                        help="Benchmarks of the suite to evaluate, all of them by default")
+    parser.add_argument('--batch_size', type=int, default=BSZ, help="Samples per generate call")
+    parser.add_argument('--decode_workers', type=int, default=DECODE_WORKERS, help="Media decoding threads")
+    parser.add_argument('--max_retries', type=int, default=MAX_RETRIES, help="Retries of the samples that failed")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Submit samples to the engine continuously instead of in batch_size chunks")
+    parser.add_argument('--max_num_pending', type=int, default=MAX_NUM_PENDING,
+                        help="Requests in flight in streaming mode")
+    parser.add_argument('--shard_id', '--shard-id', type=int, default=0, help="Shard evaluated by this process")
+    parser.add_argument('--num_shards', '--num-shards', type=int, default=1,
+                        help="Number of data-parallel shards, sample idx going to shard idx %% num_shards")
+    parser.add_argument('--backend', type=str, default="vllm", choices=BACKENDS, help="Inference backend")
+    parser.add_argument('--mock_seconds_per_token', type=float, default=0.0,
+                        help="Simulated generation time of the mock backend")
+    parser.add_argument('--merge', action='store_true',
+                        help="Merge the results of all num_shards shards instead of evaluating")
+    args = parser.parse_args()
+
+    benchmarks = get_benchmarks(args.suite, args.file_name, args.benchmarks, args.shard_id, args.num_shards)
+
+    if args.merge:
+        for benchmark in benchmarks:
+            merge_shards(benchmark)
+        return
+    if args.model_path is None and args.backend != "mock":
+        parser.error("--model_path is required unless --merge is given or the backend is mock")
+
+    backend = get_backend(
+        args.backend,
+        args.model_path,
+        temperature=0.1,
+        top_p=0.001,
+        max_tokens=1024,
+        mock_seconds_per_token=args.mock_seconds_per_token,
+        limit_mm_per_prompt={"image": 1, "video": 1},
+    )
+    processor = load_processor(args.model_path)
+
+    evaluate(benchmarks, backend, processor, batch_size=args.batch_size,
+             decode_workers=args.decode_workers, max_retries=args.max_retries, streaming=args.streaming,
+             max_num_pending=args.max_num_pending)
@@ -0,0 +1,35 @@
+from open_r1 import scoring
+
+
+def score_outputs(outputs, solutions, problem_types):
+    """Predictions and rewards of evaluation outputs. Only multiple-choice, numerical and regression samples are scored."""
+    predictions = scoring.extract_answers(outputs, fallback_to_text=True)
+    gt_answers = scoring.extract_answers(solutions)
+    rewards = scoring.score_answers(predictions, gt_answers, problem_types, regression_metric="mra", text_metrics=False)
+    return predictions, rewards
+
+
+def score_samples(samples, outputs):
+    """Fills in the output, the extracted answer and reasoning, and the reward of evaluated samples, scored together."""
+    predictions, rewards = score_outputs(
+        outputs,
+        [sample.get("solution", "") for sample in samples],
+        [sample.get("problem_type", "") for sample in samples],
+    )
+
+    for sample, model_output, final_ans, reward in zip(samples, outputs, predictions, rewards.tolist()):
+        think_chain = scoring.extract_think(model_output)
+        sample["output"] = model_output
+        sample["prediction"] = final_ans
+        sample["reward"] = reward
+        sample['correct'] = True if sample["reward"]==1.0 else False
+        if think_chain:
+            sample["process"] = f"<think>{think_chain}</think>"
+    return samples
+
+
+def final_accuracy(results):
+    """`mean_acc` over the non-regression samples and `mean_mra` over the regression ones. Errors are left out."""
+    results = [result for result in results if "error" not in result]
+    return scoring.final_accuracy([result["reward"] for result in results],
+                                  [result['problem_type'] for result in results])
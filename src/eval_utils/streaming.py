@@ -0,0 +1,93 @@
+import itertools
+import time
+from collections import deque
+
+
+def prefetch(executor, fn, items, depth):
+    """Yields `(item, future)` for every item, with `fn(item)` submitted to `executor` up to `depth` items ahead."""
+    futures = deque()
+    items = iter(items)
+    for item in itertools.islice(items, depth):
+        futures.append((item, executor.submit(fn, item)))
+    while futures:
+        yield futures.popleft()
+        for item in itertools.islice(items, 1):
+            futures.append((item, executor.submit(fn, item)))
+
+
+def stream_generate(llm, requests, sampling_params, max_num_pending=256):
+    """
+    Generates `requests` with continuous batching, yielding each result as soon as it finishes.
+
+    `llm.generate` only returns once its whole batch is done, so with fixed chunks the engine drains to zero at every
+    chunk boundary while the next chunk is decoded. Here requests are added to the underlying `LLMEngine` one by one
+    and the engine is stepped in between, so the scheduler keeps up to `max_num_pending` sequences in flight across the
+    whole run and a finished sequence is replaced at the next step.
+
+    Args:
+        llm (`vllm.LLM`):
+            Engine to generate with.
+        requests (iterable of `(key, Future)`):
+            Futures resolving to the `generate` inputs, e.g. from [`prefetch`]. While requests are in flight, a
+            request whose input is not ready yet is left for a later step instead of blocking the engine.
+        sampling_params (`vllm.SamplingParams`):
+            Sampling parameters of every request.
+        max_num_pending (`int`, *optional*, defaults to `256`):
+            Maximum number of requests added to the engine and not finished yet.
+
+    Yields:
+        `(key, output, stats)`: `output` is the finished `vllm.RequestOutput`, or the exception raised while preparing
+        or generating the request, in which case `stats` is `None`. Otherwise `stats` has the `queue_seconds` spent
+        waiting for the scheduler and the `latency_seconds` from submission to completion.
+    """
+    engine = llm.llm_engine
+    requests = iter(requests)
+    request_ids = itertools.count()
+    pending = {}
+    head = None
+    exhausted = False
+
+    while True:
+        while not exhausted and len(pending) < max_num_pending:
+            if head is None:
+                head = next(requests, None)
+                if head is None:
+                    exhausted = True
+                    break
+            key, future = head
+            if pending and not future.done():
+                break
+            head = None
+            request_id = str(next(request_ids))
+            try:
+                engine.add_request(request_id, future.result(), sampling_params)
+            except Exception as e:
+                yield key, e, None
+                continue
+            pending[request_id] = (key, time.perf_counter())
+
+        if not pending:
+            if exhausted:
+                return
+            continue
+
+        try:
+            step_outputs = engine.step()
+        except Exception as e:
+            # The failing request cannot be told apart, so everything in flight fails and goes to the retry queue
+            engine.abort_request(list(pending))
+            for key, _ in pending.values():
+                yield key, e, None
+            pending.clear()
+            continue
+
+        for output in step_outputs:
+            if not output.finished:
+                continue
+            key, submitted = pending.pop(output.request_id)
+            metrics = output.metrics
+            queue_seconds = None
+            if metrics is not None and metrics.first_scheduled_time is not None:
+                queue_seconds = metrics.first_scheduled_time - metrics.arrival_time
+            stats = {"queue_seconds": queue_seconds, "latency_seconds": time.perf_counter() - submitted}
+            yield key, output, stats
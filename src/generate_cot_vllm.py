@@ -1,40 +1,35 @@
 import os
 import json
-import re
+import argparse
 from tqdm import tqdm
-from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
-from rouge_score import rouge_scorer
-import torch
 
-from transformers import AutoProcessor, AutoTokenizer
-from vllm import LLM, SamplingParams
 from qwen_vl_utils import process_vision_info
 
+from eval_utils.backends import BACKENDS, get_backend, load_processor
+from open_r1.scoring import extract_answers, extract_think, score_answers
+
 
 MODEL_PATH = "Qwen/Qwen2.5-VL-72B-Instruct"
 BSZ = 32
 
 
-llm = LLM(
-    model=MODEL_PATH,
-    tensor_parallel_size=torch.cuda.device_count(),
-    max_model_len = 8192,
-    gpu_memory_utilization=0.8,
-    limit_mm_per_prompt={"image": 10, "video": 10},
-)
+parser = argparse.ArgumentParser(description="CoT generation")
+parser.add_argument('--model_path', type=str, default=MODEL_PATH, help="Path to the model")
+parser.add_argument('--backend', type=str, default="vllm", choices=BACKENDS, help="Inference backend")
+args = parser.parse_args()
 
-sampling_params = SamplingParams(
+
+backend = get_backend(
+    args.backend,
+    args.model_path,
     temperature=1.0,
     top_p=0.95,
     max_tokens=512,
-    stop_token_ids=[],
+    limit_mm_per_prompt={"image": 10, "video": 10},
 )
 
-
-processor = AutoProcessor.from_pretrained(MODEL_PATH)
-tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
-tokenizer.padding_side = "left"
-processor.tokenizer = tokenizer
+# The mock backend runs without model files, with a plain chat template
+processor = load_processor(args.model_path if args.backend != "mock" else None)
 
 for dataset_name in ['your_data_name']:
 
@@ -107,101 +102,6 @@ for dataset_name in ['your_data_name']:
         except Exception as e:
             print(f"Error reading existing output file: {e}")
 
-    def extract_think(output_str):
-        pattern = r'<think>\s*(.*?)\s*</think>'
-        match = re.search(pattern, output_str, re.DOTALL)
-        if match:
-            return match.group(1).strip()
-        return ""
-
-    def extract_answer(text):
-        pattern = r'<answer>\s*(.*?)\s*</answer>'
-        match = re.search(pattern, text, re.DOTALL)
-        if match:
-            return match.group(1).strip()
-        return ""
-
-    def normalize_number(num_str):
-        try:
-            num_str = num_str.replace(',', '')
-            return float(num_str)
-        except Exception as e:
-            print(f"Error converting '{num_str}' to float: {e}")
-            return None
-
-    def wer(reference, hypothesis):
-        ref_words = reference.split()
-        hyp_words = hypothesis.split()
-        m = len(ref_words)
-        n = len(hyp_words)
-        d = [[0]*(n+1) for _ in range(m+1)]
-        for i in range(m+1):
-            d[i][0] = i
-        for j in range(n+1):
-            d[0][j] = j
-        for i in range(1, m+1):
-            for j in range(1, n+1):
-                if ref_words[i-1] == hyp_words[j-1]:
-                    d[i][j] = d[i-1][j-1]
-                else:
-                    d[i][j] = 1 + min(d[i-1][j], d[i][j-1], d[i-1][j-1])
-        return d[m][n] / max(1, m)
-
-    def compute_bleu_score(reference, hypothesis):
-        try:
-            smoothing = SmoothingFunction().method1
-            ref_tokens = reference.split()
-            hyp_tokens = hypothesis.split()
-            score = sentence_bleu([ref_tokens], hyp_tokens, smoothing_function=smoothing)
-            return score
-        except Exception as e:
-            print(f"Error computing BLEU score: {e}")
-            return 0.0
-
-    def compute_rouge_score(reference, hypothesis, use_stemmer=True):
-        scorer = rouge_scorer.RougeScorer(['rouge1', 'rouge2', 'rougeL'], use_stemmer=use_stemmer)
-        scores = scorer.score(reference, hypothesis)
-        average_fmeasure = (scores['rouge1'].fmeasure + scores['rouge2'].fmeasure + scores['rougeL'].fmeasure) / 3
-        return average_fmeasure
-
-    def reward_fn(sample, model_output, question_type):
-        try:
-            output_ans = extract_answer(model_output)
-            gt_ans = extract_answer(sample.get("solution", ""))
-            if question_type == "multiple choice":
-                return 1.0 if output_ans.strip() == gt_ans.strip() else 0.0
-            elif question_type == "numerical":
-                gt_has_decimal = ("." in gt_ans) or ("," in gt_ans)
-                out_has_decimal = ("." in output_ans) or ("," in output_ans)
-                if gt_has_decimal != out_has_decimal:
-                    return 0.0
-                gt_number = normalize_number(gt_ans)
-                out_number = normalize_number(output_ans)
-                if gt_number is None or out_number is None:
-                    return 0.0
-                return 1.0 if round(gt_number, 2) == round(out_number, 2) else 0.0
-            elif question_type == "OCR":
-                error_rate = wer(gt_ans, output_ans)
-                reward = 1 - error_rate
-                return max(0.0, min(1.0, reward))
-            elif question_type == "free-form":
-                score = compute_rouge_score(gt_ans, output_ans)
-                return max(0.0, min(1.0, score))
-            elif question_type == "regression":
-                gt_number = normalize_number(gt_ans)
-                out_number = normalize_number(output_ans)
-                if gt_number is None or out_number is None:
-                    return 0.0
-                rel_diff = (abs(out_number - gt_number) + 1e-9) / (abs(gt_number) + 1e-9)
-                rel_diff = min(1.0, max(0.0, rel_diff))
-                return 1 - rel_diff
-            else:
-                return 0.0
-        except Exception as e:
-            print(f"Error in reward_fn for question_type '{question_type}': {e}")
-            return 0.0
-
-
     for i in tqdm(range(start_idx, len(messages), BSZ), desc="Processing batches"):
         batch_messages = messages[i:i + BSZ]
 
@@ -237,20 +137,27 @@ for dataset_name in ['your_data_name']:
                 })
                 
 
-            outputs = llm.generate(llm_inputs, sampling_params=sampling_params)
-            batch_output_text = [out.outputs[0].text for out in outputs]
+            outputs = backend.generate(llm_inputs)
+            batch_output_text = [out.text for out in outputs]
             
         except Exception as e:
             print('error:', data[i]['path'])
             batch_output_text = ['<answer>error</answer>'] * BSZ
             
 
-        for j, (sample, model_output) in enumerate(zip(data[i:i+BSZ], batch_output_text), start=i):
+        batch_samples = data[i:i+BSZ]
+        batch_output_text = batch_output_text[:len(batch_samples)]
+        final_answers = extract_answers(batch_output_text)
+        rewards = score_answers(
+            final_answers,
+            extract_answers([sample.get("solution", "") for sample in batch_samples]),
+            [sample.get("problem_type", "") for sample in batch_samples],
+            regression_metric="relative",
+        ).tolist()
+        for sample, model_output, final_ans, reward in zip(batch_samples, batch_output_text, final_answers, rewards):
             think_chain = extract_think(model_output)
-            final_ans = extract_answer(model_output)
             sample["answer"] = final_ans
-            q_type = sample.get("problem_type", "")
-            sample["reward"] = reward_fn(sample, model_output, q_type)
+            sample["reward"] = reward
             sample['select'] = True if sample["reward"] > 0.6 else False
             if think_chain:
                 sample["process"] = f"<think>{think_chain}</think>"
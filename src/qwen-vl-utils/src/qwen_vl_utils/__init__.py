@@ -2,6 +2,7 @@ from .vision_process import (
     extract_vision_info,
     fetch_image,
     fetch_video,
+    plan_vision_token_budget,
     process_vision_info,
     smart_resize,
 )
@@ -333,6 +333,123 @@ def fetch_video(ele: dict, image_factor: int = IMAGE_FACTOR, return_video_sample
         return images
 
 
+def _image_pixel_demand(ele: dict) -> int:
+    """Number of pixels `fetch_image` would feed to the model for `ele` without any budget."""
+    min_pixels = ele.get("min_pixels", MIN_PIXELS)
+    max_pixels = ele.get("max_pixels", MAX_PIXELS)
+    image = ele["image"] if "image" in ele else ele["image_url"]
+    size = None
+    if isinstance(image, Image.Image):
+        size = image.size
+    elif isinstance(image, str) and not image.startswith(("http://", "https://", "data:image")):
+        # PIL only reads the header here, the pixels are decoded later by `fetch_image`
+        with Image.open(image[7:] if image.startswith("file://") else image) as image_obj:
+            size = image_obj.size
+    if size is None:
+        return max_pixels
+    return min(max_pixels, max(size[0] * size[1], min_pixels))
+
+
+def _video_max_frames(ele: dict) -> int:
+    """Upper bound of the number of frames `fetch_video` samples for `ele`."""
+    if isinstance(ele["video"], (list, tuple)):
+        return ceil_by_factor(len(ele["video"]), FRAME_FACTOR)
+    if "nframes" in ele:
+        return round_by_factor(ele["nframes"], FRAME_FACTOR)
+    return max(floor_by_factor(ele.get("max_frames", FPS_MAX_FRAMES), FRAME_FACTOR), FRAME_FACTOR)
+
+
+def _video_pixel_demand(ele: dict) -> int:
+    """Number of pixels `fetch_video` would feed to the model for `ele` without any budget (one temporal patch of
+    `FRAME_FACTOR` frames counts once, like in the visual token count)."""
+    num_patches = _video_max_frames(ele) // FRAME_FACTOR
+    if isinstance(ele["video"], (list, tuple)):
+        return num_patches * ele.get("max_pixels", MAX_PIXELS)
+    patch_pixels = min(ele.get("max_pixels", VIDEO_MAX_PIXELS), VIDEO_MAX_PIXELS)
+    return min(num_patches * patch_pixels, ele.get("total_pixels", VIDEO_TOTAL_PIXELS))
+
+
+def _fill_shares(demands: list[float], budget: float) -> list[float]:
+    """Max-min fair split of `budget`: items asking for less than an equal share get what they ask for, and what they
+    leave is split among the others."""
+    shares = [0.0] * len(demands)
+    pending = sorted(range(len(demands)), key=lambda i: demands[i])
+    while pending:
+        share = budget / len(pending)
+        if demands[pending[0]] > share:
+            for i in pending:
+                shares[i] = share
+            break
+        i = pending.pop(0)
+        shares[i] = demands[i]
+        budget -= demands[i]
+    return shares
+
+
+def plan_vision_token_budget(
+    vision_infos: list[dict], max_vision_tokens: int, image_factor: int = IMAGE_FACTOR
+) -> list[dict]:
+    """Fits all the images and videos of a batch into `max_vision_tokens` visual tokens.
+
+    Every item first gets what it would use without a budget; if the batch does not fit, the budget is split max-min
+    fairly, so small images keep their resolution and the largest videos shrink first. A video whose share cannot pay
+    for `min_pixels` per temporal patch samples fewer frames, and only at `FRAME_FACTOR` frames its resolution goes
+    below `min_pixels`.
+
+    Args:
+        vision_infos (list[dict]): the vision elements of the batch, as returned by `extract_vision_info`.
+        max_vision_tokens (int): the number of visual tokens the whole batch may use.
+        image_factor (int): the side of the pixel square that becomes one visual token after merging.
+
+    Returns:
+        list[dict]: copies of `vision_infos` whose `max_pixels`, `min_pixels`, `total_pixels` and frame limits make
+            `fetch_image` / `fetch_video` stay within their share of the budget.
+    """
+    token_pixels = image_factor * image_factor
+    demands = [
+        _video_pixel_demand(ele) if "video" in ele else _image_pixel_demand(ele)
+        for ele in vision_infos
+    ]
+    shares = _fill_shares(demands, max_vision_tokens * token_pixels)
+    if sum(demands) > max_vision_tokens * token_pixels:
+        logger.info(
+            f"plan_vision_token_budget: {sum(demands) // token_pixels} visual tokens requested, {max_vision_tokens} available"
+        )
+
+    planned = []
+    for ele, demand, share in zip(vision_infos, demands, shares):
+        ele = ele.copy()
+        planned.append(ele)
+        if share >= demand:
+            continue
+        share = max(int(share), token_pixels)
+        if "video" not in ele:
+            ele["max_pixels"] = share
+            ele["min_pixels"] = min(ele.get("min_pixels", MIN_PIXELS), share)
+            continue
+        if isinstance(ele["video"], (list, tuple)):
+            patch_pixels = max(share // (_video_max_frames(ele) // FRAME_FACTOR), token_pixels)
+            ele["max_pixels"] = patch_pixels
+            ele["min_pixels"] = min(ele.get("min_pixels", MIN_PIXELS), patch_pixels)
+            continue
+        # `fetch_video` never goes below `min_pixels * 1.05` per temporal patch, so drop frames before resolution
+        min_patch_pixels = ele.get("min_pixels", VIDEO_MIN_PIXELS) * 1.05
+        nframes = min(
+            _video_max_frames(ele),
+            max(floor_by_factor(share / min_patch_pixels * FRAME_FACTOR, FRAME_FACTOR), FRAME_FACTOR),
+        )
+        patch_pixels = share / (nframes // FRAME_FACTOR)
+        if patch_pixels < min_patch_pixels:
+            ele["min_pixels"] = max(int(patch_pixels / 1.05), token_pixels)
+        if "nframes" in ele:
+            ele["nframes"] = nframes
+        else:
+            ele["max_frames"] = nframes
+            ele["min_frames"] = min(ele.get("min_frames", FPS_MIN_FRAMES), nframes)
+        ele["total_pixels"] = share
+    return planned
+
+
 def extract_vision_info(conversations: list[dict] | list[list[dict]]) -> list[dict]:
     vision_infos = []
     if isinstance(conversations[0], dict):
@@ -354,9 +471,13 @@ def extract_vision_info(conversations: list[dict] | list[list[dict]]) -> list[di
 def process_vision_info(
     conversations: list[dict] | list[list[dict]],
     return_video_kwargs: bool = False,
+    max_vision_tokens: Optional[int] = None,
 ) -> tuple[list[Image.Image] | None, list[torch.Tensor | list[Image.Image]] | None, Optional[dict]]:
 
     vision_infos = extract_vision_info(conversations)
+    if max_vision_tokens is not None:
+        # Size all items together, instead of every video on its own against VIDEO_TOTAL_PIXELS
+        vision_infos = plan_vision_token_budget(vision_infos, max_vision_tokens)
     ## Read images or videos
     image_inputs = []
     video_inputs = []
@@ -0,0 +1,202 @@
+# Copyright 2025 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compile a GRPO or SFT dataset into pre-tokenized, pre-patchified shards (see `shards.py`), so that training skips the
+chat template, the video decoding and the processor. Runs on CPU only.
+
+Example usage:
+python src/open_r1/compile_dataset.py \
+    --task grpo \
+    --dataset_name ./Video-R1-data/Video-R1-260k.json \
+    --model_name_or_path Qwen/Qwen2.5-VL-7B-Instruct \
+    --max_prompt_length 16384 \
+    --output_dir ./Video-R1-data/compiled-grpo
+
+python src/open_r1/compile_dataset.py --output_dir ./Video-R1-data/compiled-grpo --verify_only
+
+The output directory is then passed as `--dataset_name` to `grpo.py` or `sft_video.py`.
+"""
+
+import copy
+import os
+from dataclasses import dataclass, field
+from typing import Optional
+
+from datasets import Dataset, load_dataset
+from transformers import AutoProcessor
+from trl import TrlParser
+from trl.data_utils import maybe_apply_chat_template
+
+from qwen_vl_utils import process_vision_info
+
+from shards import ShardWriter, verify_shards
+
+
+@dataclass
+class CompileDatasetArguments:
+    """
+    Arguments for compiling a dataset into shards.
+
+    Args:
+        task (`str`):
+            Which script the shards are for. Possible values: 'grpo', 'sft'.
+    """
+
+    output_dir: str = field(metadata={"help": "Directory the shards and the manifest are written to"})
+    dataset_name: Optional[str] = field(default=None, metadata={"help": "Dataset name or path to a .json/.jsonl file"})
+    dataset_config: Optional[str] = field(default=None, metadata={"help": "Dataset configuration name"})
+    dataset_train_split: str = field(default="train", metadata={"help": "Dataset split to compile"})
+    model_name_or_path: Optional[str] = field(default=None, metadata={"help": "Model whose processor is used"})
+    task: str = field(default="grpo", metadata={"help": "Which script the shards are for. Possible values: 'grpo', 'sft'"})
+    shard_size: int = field(default=1024, metadata={"help": "Number of records per shard"})
+    pixel_dtype: str = field(
+        default="bfloat16",
+        metadata={"help": "On-disk type of the vision patches. Possible values: 'bfloat16', 'uint8' (half the size)"},
+    )
+    max_pixels: Optional[int] = field(default=12845056, metadata={"help": "Maximum number of pixels for the image"})
+    min_pixels: Optional[int] = field(default=3136, metadata={"help": "Minimum number of pixels for the image"})
+    max_prompt_length: Optional[int] = field(
+        default=None,
+        metadata={"help": "GRPO max_prompt_length, used to fit the vision tokens of each prompt like the trainer does"},
+    )
+    verify_only: bool = field(default=False, metadata={"help": "Only check the shards already in output_dir"})
+
+
+def full_media_path(path: str) -> str:
+    """Resolves a dataset `path` against VIDEO_BASE_PATH, like the trainers do."""
+    if path.startswith('/'):
+        path = path[1:]  # Remove leading slash if exists
+    return os.path.join(os.environ.get('VIDEO_BASE_PATH', ''), path)
+
+
+def compile_grpo_example(example, processor, max_prompt_length=None):
+    """Tokenizes the GRPO prompt of `example` and patchifies its image or video, like `_prepare_prompt_inputs`."""
+    from grpo import make_conversation_image_and_video
+
+    example = {**example, **make_conversation_image_and_video(example)}
+    prompt_text = maybe_apply_chat_template(example, processor)["prompt"]
+    messages = copy.deepcopy(example["prompt"])
+    messages[0]['content'][0][example['data_type']] = full_media_path(example['path'])
+
+    max_vision_tokens = None
+    if max_prompt_length is not None:
+        text_length = len(processor.tokenizer(prompt_text, add_special_tokens=False)["input_ids"])
+        max_vision_tokens = max(max_prompt_length - text_length, 0)
+    image_inputs, video_inputs, video_kwargs = process_vision_info(
+        messages, return_video_kwargs=True, max_vision_tokens=max_vision_tokens
+    )
+    inputs = processor(
+        text=[prompt_text],
+        images=image_inputs,
+        videos=video_inputs,
+        return_tensors="pt",
+        add_special_tokens=False,
+    )
+    return inputs, example
+
+
+def compile_sft_example(example, processor):
+    """Tokenizes the full SFT conversation of `example` and patchifies its image or video, like `collate_fn`."""
+    from sft_video import prepare_dataset
+
+    prepared = prepare_dataset(example)
+    if prepared is None:
+        return None, None
+    text = processor.apply_chat_template(prepared["messages"], tokenize=False)
+    image_inputs, video_inputs, video_kwargs = process_vision_info(prepared["messages"], return_video_kwargs=True)
+    inputs = processor(text=[text], images=image_inputs, videos=video_inputs, return_tensors="pt")
+    return inputs, {**example, **prepared}
+
+
+def compile_dataset(args: CompileDatasetArguments):
+    if args.task not in ("grpo", "sft"):
+        raise ValueError(f"task must be 'grpo' or 'sft', got {args.task}")
+
+    if args.dataset_name.endswith('.json') or args.dataset_name.endswith('.jsonl'):
+        dataset = Dataset.from_json(args.dataset_name)
+    else:
+        dataset = load_dataset(args.dataset_name, name=args.dataset_config)[args.dataset_train_split]
+
+    processor = AutoProcessor.from_pretrained(args.model_name_or_path)
+    image_processor = processor.image_processor
+    if args.task == "grpo":
+        image_processor.max_pixels = args.max_pixels
+        image_processor.min_pixels = args.min_pixels
+    writer = ShardWriter(
+        args.output_dir,
+        {
+            "task": args.task,
+            "model_name_or_path": args.model_name_or_path,
+            "pixel_dtype": args.pixel_dtype,
+            "image_mean": list(image_processor.image_mean),
+            "image_std": list(image_processor.image_std),
+            "rescale_factor": image_processor.rescale_factor,
+            "patch_size": image_processor.patch_size,
+            "temporal_patch_size": image_processor.temporal_patch_size,
+            "merge_size": image_processor.merge_size,
+            "image_token_id": processor.tokenizer.convert_tokens_to_ids("<|image_pad|>"),
+            "video_token_id": processor.tokenizer.convert_tokens_to_ids("<|video_pad|>"),
+        },
+        shard_size=args.shard_size,
+    )
+
+    skipped_count = 0
+    for index, example in enumerate(dataset):
+        try:
+            if args.task == "grpo":
+                inputs, metadata = compile_grpo_example(example, processor, args.max_prompt_length)
+            else:
+                inputs, metadata = compile_sft_example(example, processor)
+        except Exception as e:
+            print(f"Failed to compile example {index}: {e}")
+            inputs = None
+        if inputs is None:
+            skipped_count += 1
+            continue
+
+        pixel_key = "pixel_values_videos" if "pixel_values_videos" in inputs else "pixel_values"
+        grid_key = "video_grid_thw" if pixel_key == "pixel_values_videos" else "image_grid_thw"
+        writer.write(
+            inputs["input_ids"][0],
+            pixel_key,
+            inputs[pixel_key],
+            inputs[grid_key],
+            metadata,
+            second_per_grid_ts=inputs.get("second_per_grid_ts"),
+        )
+        if (index + 1) % 1000 == 0:
+            print(f"Compiled {index + 1}/{len(dataset)} examples")
+    writer.close()
+
+    print(f"\nDataset compilation completed:")
+    print(f"Total examples: {len(dataset)}")
+    print(f"Compiled examples: {writer.manifest['num_records']}")
+    print(f"Skipped examples: {skipped_count}")
+
+
+def main(args: CompileDatasetArguments):
+    if not args.verify_only:
+        compile_dataset(args)
+    errors = verify_shards(args.output_dir)
+    for error in errors:
+        print(error)
+    print(f"Verified {args.output_dir}: {len(errors)} problems found")
+    if errors:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = TrlParser((CompileDatasetArguments,))
+    (args,) = parser.parse_args_and_config()
+    main(args)
@@ -22,13 +22,13 @@ from datasets import load_dataset, load_from_disk
 from transformers import Qwen2VLForConditionalGeneration
 
 from trainer import Qwen2VLGRPOTrainer, Qwen2VLGRPOVLLMTrainerModified
+from trainer.streaming import JsonlStream
+from shards import CompiledDataset, is_compiled_dataset
+import scoring
 from trl import GRPOConfig, GRPOTrainer, ModelConfig, ScriptArguments, TrlParser, get_peft_config
 
 from datasets import Dataset, DatasetDict
 
-from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
-from rouge_score import rouge_scorer
-
 
 @dataclass
 class GRPOScriptArguments(ScriptArguments):
@@ -60,104 +60,63 @@ class GRPOScriptArguments(ScriptArguments):
         default=True,
         metadata={"help": "whether using length reward"},
     )
+    dynamic_sampling: Optional[bool] = field(
+        default=False,
+        metadata={"help": "whether to generate rollouts in stages and replace prompts whose partial group is all-correct or all-wrong"},
+    )
+    dynamic_sampling_stages: list[int] = field(
+        default_factory=lambda: [2, 4],
+        metadata={"help": "Partial group sizes that are scored before generating the rest of the num_generations rollouts"},
+    )
+    dynamic_sampling_max_resample: Optional[int] = field(
+        default=4,
+        metadata={"help": "Maximum number of replacement prompts drawn from the prompt queue per step"},
+    )
+    difficulty_sampling: Optional[bool] = field(
+        default=False,
+        metadata={"help": "whether to down-weight prompts whose recent rollouts were always or never solved"},
+    )
+    difficulty_history_size: Optional[int] = field(
+        default=4,
+        metadata={"help": "Number of recent group accuracies kept per problem_id for difficulty-aware sampling"},
+    )
+    difficulty_saturated_weight: Optional[float] = field(
+        default=0.1,
+        metadata={"help": "Relative sampling weight of always-solved or never-solved prompts"},
+    )
+    rollout_buckets: Optional[int] = field(
+        default=1,
+        metadata={"help": "Number of completion-length buckets the policy and reference forwards are split into, each padded to its own longest completion"},
+    )
+    prefetch_vision_inputs: Optional[bool] = field(
+        default=False,
+        metadata={"help": "whether to load images/videos and run the processor in the DataLoader workers; only useful with dataloader_num_workers > 0. HF generation only, ignored by the vLLM trainer"},
+    )
+    streaming: Optional[bool] = field(
+        default=False,
+        metadata={"help": "whether to stream a .jsonl dataset, each rank reading its own part of the file (needs max_steps and dataloader_num_workers 0)"},
+    )
+    shuffle_buffer: Optional[int] = field(
+        default=1000,
+        metadata={"help": "Number of examples the streaming shuffle draws from"},
+    )
 
 
 
 def accuracy_reward(completions, solution, **kwargs):
-    
-    def extract_answer(text):
-        pattern = r'<answer>\s*(.*?)\s*</answer>'
-        match = re.search(pattern, text, re.DOTALL)
-        if match:
-            return match.group(1).strip()
-        return ""
-
-    def normalize_number(num_str):
-        try:
-            num_str = num_str.replace(',', '')
-            return float(num_str)
-        except Exception as e:
-            print(f"Error converting '{num_str}' to float: {e}")
-            return None
-
-    def wer(reference, hypothesis):
-        ref_words = reference.split()
-        hyp_words = hypothesis.split()
-        m = len(ref_words)
-        n = len(hyp_words)
-        d = [[0]*(n+1) for _ in range(m+1)]
-        for i in range(m+1):
-            d[i][0] = i
-        for j in range(n+1):
-            d[0][j] = j
-        for i in range(1, m+1):
-            for j in range(1, n+1):
-                if ref_words[i-1] == hyp_words[j-1]:
-                    d[i][j] = d[i-1][j-1]
-                else:
-                    d[i][j] = 1 + min(d[i-1][j], d[i][j-1], d[i-1][j-1])
-        return d[m][n] / max(1, m)
-
-
-    def compute_rouge_score(reference, hypothesis, use_stemmer=True):
-        scorer = rouge_scorer.RougeScorer(['rouge1', 'rouge2', 'rougeL'], use_stemmer=use_stemmer)
-        scores = scorer.score(reference, hypothesis)
-        average_fmeasure = (scores['rouge1'].fmeasure + scores['rouge2'].fmeasure + scores['rougeL'].fmeasure) / 3
-        return average_fmeasure
-    
 
     question_type = kwargs['problem_type'][0]
     
     contents = [completion[0]["content"] for completion in completions]
     current_time = datetime.now().strftime("%d-%H-%M-%S-%f")
-    rewards = []
-
-    for content, sol in zip(contents, solution):
-    
-        try:
-            output_ans = extract_answer(content)
-            gt_ans = extract_answer(sol)
-            if question_type == "multiple choice":
-                reward = 1.0 if output_ans.strip() == gt_ans.strip() else 0.0
-            elif question_type == "numerical":
-                gt_has_decimal = ("." in gt_ans) or ("," in gt_ans)
-                out_has_decimal = ("." in output_ans) or ("," in output_ans)
-                if gt_has_decimal != out_has_decimal:
-                    reward = 0.0
-                else:
-                    gt_number = normalize_number(gt_ans)
-                    out_number = normalize_number(output_ans)
-                    if gt_number is None or out_number is None:
-                        reward = 0.0
-                    else:
-                        reward = 1.0 if round(gt_number, 2) == round(out_number, 2) else 0.0
-            elif question_type == "OCR":
-                error_rate = wer(gt_ans, output_ans)
-                reward = 1 - error_rate
-                reward = max(0.0, min(1.0, reward))
-            elif question_type == "free-form":
-                score = compute_rouge_score(gt_ans, output_ans)
-                reward = max(0.0, min(1.0, score))
-            elif question_type == "regression":
-                gt_number = normalize_number(gt_ans)
-                out_number = normalize_number(output_ans)
-                if gt_number is None or out_number is None:
-                    reward = 0.0
-                rel_diff = (abs(out_number - gt_number) + 1e-9) / (abs(gt_number) + 1e-9)
-                rel_diff = min(1.0, max(0.0, rel_diff))
-                reward = 1 - rel_diff
-            else:
-                reward = 0.0
-        except Exception as e:
-            print(f"Error in reward_fn for question_type '{question_type}': {e}")
-            reward = 0.0
-    
-        rewards.append(reward)
-        
-        if os.getenv("DEBUG_MODE") == "true":
-            log_path = os.getenv("LOG_PATH")
-            # local_rank = int(os.getenv("LOCAL_RANK", 0))
-            with open(log_path, "a", encoding="utf-8") as f:
+    # The whole group is scored at once, see scoring.score
+    rewards = scoring.score(contents, solution, [question_type] * len(contents), regression_metric="relative").tolist()
+
+    if os.getenv("DEBUG_MODE") == "true":
+        log_path = os.getenv("LOG_PATH")
+        # local_rank = int(os.getenv("LOCAL_RANK", 0))
+        with open(log_path, "a", encoding="utf-8") as f:
+            for content, sol, reward in zip(contents, solution, rewards):
                 f.write(f"------------- {current_time} Accuracy reward: {reward} -------------\n")
                 f.write(f"Content: {content}\n")
                 f.write(f"Solution: {sol}\n")
@@ -186,11 +145,95 @@ SYSTEM_PROMPT = (
 )
 
 
+QUESTION_TEMPLATE = (
+    "{Question}\n"
+    "Please think about this question as if you were a human pondering deeply. "
+    "Engage in an internal dialogue using expressions such as 'let me think', 'wait', 'Hmm', 'oh, I see', 'let's break it down', etc, or other natural language thought expressions "
+    "It's encouraged to include self-reflection or verification in the reasoning process. "
+    "Provide your detailed reasoning between the <think> </think> tags, and then give your final answer between the <answer> </answer> tags."
+)
+
+TYPE_TEMPLATE = {
+    "multiple choice": " Please provide only the single option letter (e.g., A, B, C, D, etc.) within the <answer> </answer> tags.",
+    "numerical": " Please provide the numerical value (e.g., 42 or 3.14) within the <answer> </answer> tags.",
+    "OCR": " Please transcribe text from the image/video clearly and provide your text answer within the <answer> </answer> tags.",
+    "free-form": " Please provide your text answer within the <answer> </answer> tags.",
+    "regression": " Please provide the numerical value (e.g., 42 or 3.14) within the <answer> </answer> tags."
+}
+
+
+def make_conversation_image_and_video(example):
+    if example["problem_type"] == 'multiple choice':
+        question = example['problem'] + "Options:\n"
+        for op in example["options"]:
+            question += op + "\n"
+    else:
+        question = example['problem']
+
+    # video_base_path = os.environ.get('VIDEO_BASE_PATH', '')
+    # # print(f"video_base_path: {video_base_path}")
+    # video_path = example['path']
+    # # import pdb; pdb.set_trace()
+    # if video_path.startswith('/'):
+    #     video_path = video_path[1:]  # Remove leading slash if exists
+    # full_video_path = os.path.join(video_base_path, video_path)
+    msg ={
+        "prompt": 
+           [{
+                "role": "user",
+                "content": [
+                    {
+                        "type": example['data_type'],
+                        # example['data_type']: os.getcwd() + "/Video-R1-data" + example['path'][1:]
+                        # example['data_type']: full_video_path
+                    },
+                    {
+                        "type": "text",
+                        "text": QUESTION_TEMPLATE.format(Question=question) + TYPE_TEMPLATE[example['problem_type']]
+                    }
+                    ]
+            }]
+        }
+    
+    return msg
+
+
+def add_conversation(example):
+    return {**example, **make_conversation_image_and_video(example)}
+
+
 def main(script_args, training_args, model_args):
     # Get reward functions
     reward_funcs = [reward_funcs_registry[func] for func in script_args.reward_funcs]
 
-    if script_args.dataset_name.endswith('.json') or script_args.dataset_name.endswith('.jsonl'):
+    if is_compiled_dataset(script_args.dataset_name):
+        # Shards written by compile_dataset.py already hold the tokenized prompt and the vision patches
+        if training_args.use_vllm:
+            raise ValueError("Compiled datasets hold patchified vision inputs, which vLLM cannot take, please set --use_vllm False")
+        dataset = {script_args.dataset_train_split: CompiledDataset(script_args.dataset_name)}
+    elif script_args.streaming:
+        if not script_args.dataset_name.endswith('.jsonl'):
+            raise ValueError(f"streaming needs a .jsonl dataset, got {script_args.dataset_name}")
+        if script_args.dynamic_sampling or script_args.difficulty_sampling:
+            raise ValueError("dynamic_sampling and difficulty_sampling index the dataset, which a stream cannot do")
+        if training_args.max_steps <= 0:
+            raise ValueError("A stream has no length, please set --max_steps")
+        if training_args.dataloader_num_workers > 0:
+            raise ValueError("A stream is resumed by offset, which only holds when it is read by the main process, "
+                             "please set --dataloader_num_workers 0")
+        # The stream skips the consumed examples by offset on resume, instead of the Trainer collating and dropping them
+        training_args.ignore_data_skip = True
+        dataset = {
+            script_args.dataset_train_split: JsonlStream(
+                script_args.dataset_name,
+                rank=training_args.process_index,
+                world_size=training_args.world_size,
+                shuffle_buffer=script_args.shuffle_buffer,
+                seed=training_args.seed,
+                transform=add_conversation,
+            )
+        }
+    elif script_args.dataset_name.endswith('.json') or script_args.dataset_name.endswith('.jsonl'):
         dataset =  DatasetDict({"train": Dataset.from_json(script_args.dataset_name)})
     else:
         # Load the dataset
@@ -207,22 +250,6 @@ def main(script_args, training_args, model_args):
         }
 
     
-    QUESTION_TEMPLATE = (
-        "{Question}\n"
-        "Please think about this question as if you were a human pondering deeply. "
-        "Engage in an internal dialogue using expressions such as 'let me think', 'wait', 'Hmm', 'oh, I see', 'let's break it down', etc, or other natural language thought expressions "
-        "It's encouraged to include self-reflection or verification in the reasoning process. "
-        "Provide your detailed reasoning between the <think> </think> tags, and then give your final answer between the <answer> </answer> tags."
-    )
-
-    TYPE_TEMPLATE = {
-        "multiple choice": " Please provide only the single option letter (e.g., A, B, C, D, etc.) within the <answer> </answer> tags.",
-        "numerical": " Please provide the numerical value (e.g., 42 or 3.14) within the <answer> </answer> tags.",
-        "OCR": " Please transcribe text from the image/video clearly and provide your text answer within the <answer> </answer> tags.",
-        "free-form": " Please provide your text answer within the <answer> </answer> tags.",
-        "regression": " Please provide the numerical value (e.g., 42 or 3.14) within the <answer> </answer> tags."
-    }
-
     def make_conversation_image(example):
         
         return {
@@ -251,43 +278,8 @@ def main(script_args, training_args, model_args):
             ],
     }
         
-    def make_conversation_image_and_video(example):
-        if example["problem_type"] == 'multiple choice':
-            question = example['problem'] + "Options:\n"
-            for op in example["options"]:
-                question += op + "\n"
-        else:
-            question = example['problem']
-
-        # video_base_path = os.environ.get('VIDEO_BASE_PATH', '')
-        # # print(f"video_base_path: {video_base_path}")
-        # video_path = example['path']
-        # # import pdb; pdb.set_trace()
-        # if video_path.startswith('/'):
-        #     video_path = video_path[1:]  # Remove leading slash if exists
-        # full_video_path = os.path.join(video_base_path, video_path)
-        msg ={
-            "prompt": 
-               [{
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": example['data_type'],
-                            # example['data_type']: os.getcwd() + "/Video-R1-data" + example['path'][1:]
-                            # example['data_type']: full_video_path
-                        },
-                        {
-                            "type": "text",
-                            "text": QUESTION_TEMPLATE.format(Question=question) + TYPE_TEMPLATE[example['problem_type']]
-                        }
-                        ]
-                }]
-            }
-        
-        return msg
-
-    
-    dataset = dataset.map(make_conversation_image_and_video)
+    if isinstance(dataset, DatasetDict):
+        dataset = dataset.map(make_conversation_image_and_video)
 
     
     trainer_cls = Qwen2VLGRPOTrainer if not training_args.use_vllm else Qwen2VLGRPOVLLMTrainerModified
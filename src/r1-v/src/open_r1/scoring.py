@@ -0,0 +1,191 @@
+"""
+Answer extraction and per-type rewards for whole sets of model outputs.
+
+Used by the GRPO accuracy reward, by CoT generation (`src/generate_cot_vllm.py`) and by evaluation (`src/eval_utils`),
+so the three agree on how an answer is parsed and scored. Answers are parsed once, and the multiple-choice, numerical
+and regression rewards are computed with array operations over all the samples of a type; only the OCR (WER) and
+free-form (ROUGE) rewards remain per-sample.
+"""
+
+import re
+
+import numpy as np
+
+
+ANSWER_PATTERN = re.compile(r'<answer>\s*(.*?)\s*</answer>', re.DOTALL)
+THINK_PATTERN = re.compile(r'<think>\s*(.*?)\s*</think>', re.DOTALL)
+
+# Regression rewards: "mra" is the mean relative accuracy of the evaluation benchmarks, "relative" the clipped
+# `1 - relative error` used for training and CoT filtering
+REGRESSION_METRICS = ("mra", "relative")
+
+
+def extract_answer(text):
+    match = ANSWER_PATTERN.search(text)
+    if match:
+        return match.group(1).strip()
+    return ""
+
+
+def extract_think(text):
+    match = THINK_PATTERN.search(text)
+    if match:
+        return match.group(1).strip()
+    return ""
+
+
+def extract_answers(texts, fallback_to_text=False):
+    """Answers of `texts`. With `fallback_to_text`, a text without `<answer>` tags is its own answer."""
+    answers = [extract_answer(text) for text in texts]
+    if fallback_to_text:
+        answers = [answer if answer != "" else text for answer, text in zip(answers, texts)]
+    return answers
+
+
+def parse_numbers(strings):
+    """`float` of every string with `,` removed, NaN where it does not parse."""
+    numbers = np.full(len(strings), np.nan, dtype=np.float64)
+    for i, string in enumerate(strings):
+        try:
+            numbers[i] = float(string.replace(',', ''))
+        except ValueError:
+            pass
+    return numbers
+
+
+def mean_relative_accuracy(pred, target, start=0.5, end=0.95, interval=0.05):
+    """
+    Mean relative accuracy of each prediction: the fraction of the confidence thresholds in `[start, end]` at which its
+    relative error is below `1 - threshold`. Computed as one `(N, num_thresholds)` comparison, in float32 like the
+    per-sample torch version it replaces. NaN predictions or targets get `0.0`.
+    """
+    pred = np.asarray(pred, dtype=np.float32)
+    target = np.asarray(target, dtype=np.float32)
+
+    epsilon = 1e-8
+    rel_error = np.abs(pred - target) / (np.abs(target) + epsilon)
+
+    thresholds = np.arange(start, end + interval / 2, interval, dtype=np.float32)
+
+    conditions = rel_error[..., None] < (1 - thresholds)
+    return conditions.mean(axis=-1, dtype=np.float32).astype(np.float64)
+
+
+def relative_accuracy(pred, target):
+    """`1 - relative error`, clipped to `[0, 1]`. NaN predictions or targets get `0.0`."""
+    pred = np.asarray(pred, dtype=np.float64)
+    target = np.asarray(target, dtype=np.float64)
+    rel_diff = (np.abs(pred - target) + 1e-9) / (np.abs(target) + 1e-9)
+    reward = 1 - np.clip(rel_diff, 0.0, 1.0)
+    return np.nan_to_num(reward, nan=0.0)
+
+
+def wer(reference, hypothesis):
+    ref_words = reference.split()
+    hyp_words = hypothesis.split()
+    m = len(ref_words)
+    n = len(hyp_words)
+    d = [[0]*(n+1) for _ in range(m+1)]
+    for i in range(m+1):
+        d[i][0] = i
+    for j in range(n+1):
+        d[0][j] = j
+    for i in range(1, m+1):
+        for j in range(1, n+1):
+            if ref_words[i-1] == hyp_words[j-1]:
+                d[i][j] = d[i-1][j-1]
+            else:
+                d[i][j] = 1 + min(d[i-1][j], d[i][j-1], d[i-1][j-1])
+    return d[m][n] / max(1, m)
+
+
+def compute_rouge_score(reference, hypothesis, use_stemmer=True):
+    from rouge_score import rouge_scorer
+
+    scorer = rouge_scorer.RougeScorer(['rouge1', 'rouge2', 'rougeL'], use_stemmer=use_stemmer)
+    scores = scorer.score(reference, hypothesis)
+    average_fmeasure = (scores['rouge1'].fmeasure + scores['rouge2'].fmeasure + scores['rougeL'].fmeasure) / 3
+    return average_fmeasure
+
+
+def _has_decimal(strings):
+    strings = np.asarray(strings, dtype=str)
+    return (np.char.find(strings, ".") >= 0) | (np.char.find(strings, ",") >= 0)
+
+
+def score_answers(output_answers, gt_answers, problem_types, regression_metric="mra", text_metrics=True):
+    """
+    Rewards of already extracted answers, as a float64 array.
+
+    Args:
+        output_answers (`list[str]`):
+            Predicted answers.
+        gt_answers (`list[str]`):
+            Ground truth answers.
+        problem_types (`list[str]`):
+            `"multiple choice"`, `"numerical"`, `"regression"`, `"OCR"` or `"free-form"` for each sample. Other
+            types get `0.0`.
+        regression_metric (`str`, *optional*, defaults to `"mra"`):
+            Reward of regression samples, one of `REGRESSION_METRICS`.
+        text_metrics (`bool`, *optional*, defaults to `True`):
+            Whether to score OCR samples with `1 - WER` and free-form samples with ROUGE. Otherwise they get `0.0`.
+    """
+    if regression_metric not in REGRESSION_METRICS:
+        raise ValueError(f"regression_metric must be one of {REGRESSION_METRICS}, got {regression_metric}")
+
+    output_answers = np.asarray(output_answers, dtype=object)
+    gt_answers = np.asarray(gt_answers, dtype=object)
+    problem_types = np.asarray(problem_types, dtype=object)
+    rewards = np.zeros(len(problem_types), dtype=np.float64)
+
+    mask = problem_types == "multiple choice"
+    if mask.any():
+        out = np.char.strip(output_answers[mask].astype(str))
+        gt = np.char.strip(gt_answers[mask].astype(str))
+        rewards[mask] = out == gt
+
+    mask = problem_types == "numerical"
+    if mask.any():
+        out, gt = output_answers[mask].tolist(), gt_answers[mask].tolist()
+        out_number, gt_number = parse_numbers(out), parse_numbers(gt)
+        same_format = _has_decimal(out) == _has_decimal(gt)
+        # NaN compares unequal, so unparsable answers get 0.0
+        rewards[mask] = same_format & (np.round(out_number, 2) == np.round(gt_number, 2))
+
+    mask = problem_types == "regression"
+    if mask.any():
+        out_number = parse_numbers(output_answers[mask].tolist())
+        gt_number = parse_numbers(gt_answers[mask].tolist())
+        if regression_metric == "mra":
+            rewards[mask] = mean_relative_accuracy(out_number, gt_number)
+        else:
+            rewards[mask] = relative_accuracy(out_number, gt_number)
+
+    if text_metrics:
+        for i in np.flatnonzero(problem_types == "OCR"):
+            rewards[i] = max(0.0, min(1.0, 1 - wer(gt_answers[i], output_answers[i])))
+        for i in np.flatnonzero(problem_types == "free-form"):
+            rewards[i] = max(0.0, min(1.0, compute_rouge_score(gt_answers[i], output_answers[i])))
+
+    return rewards
+
+
+def score(outputs, solutions, problem_types, regression_metric="mra", text_metrics=True, fallback_to_output=False):
+    """
+    Rewards of the raw model `outputs` against the `solutions`, both with `<answer>` tags, as a float64 array. See
+    [`score_answers`] for the arguments; with `fallback_to_output`, an output without `<answer>` tags is its own answer.
+    """
+    output_answers = extract_answers(outputs, fallback_to_text=fallback_to_output)
+    gt_answers = extract_answers(solutions)
+    return score_answers(output_answers, gt_answers, problem_types, regression_metric, text_metrics)
+
+
+def final_accuracy(rewards, problem_types):
+    """`mean_acc` over the non-regression samples and `mean_mra` over the regression ones."""
+    rewards = np.asarray(rewards, dtype=np.float64)
+    is_regression = np.asarray(problem_types, dtype=object) == "regression"
+    final_acc = {'mean_acc': 0.0, 'mean_mra': 0.0}
+    final_acc['mean_acc'] = float(rewards[~is_regression].mean()) if (~is_regression).any() else float("nan")
+    if is_regression.any():
+        final_acc['mean_mra'] = float(rewards[is_regression].mean())
+    return final_acc
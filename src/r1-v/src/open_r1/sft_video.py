@@ -28,6 +28,9 @@ accelerate launch \
 
 import os
 import json
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import random
 import requests
 import torch
@@ -36,7 +39,6 @@ from transformers import (
     AutoModelForVision2Seq,
     AutoProcessor,
     BitsAndBytesConfig,
-    Qwen2VLProcessor,
     Qwen2VLForConditionalGeneration,
     Qwen2_5_VLForConditionalGeneration
 )
@@ -51,6 +53,11 @@ from trl import (
 )
 from accelerate import Accelerator
 from qwen_vl_utils import process_vision_info
+from torch.nn.utils.rnn import pad_sequence
+
+from shards import CompiledDataset, is_compiled_dataset
+from trainer.streaming import JsonlStream, stream_dataloader
+from transformers.trainer_utils import get_last_checkpoint
 
 from datasets import Dataset, DatasetDict
 
@@ -59,6 +66,40 @@ import wandb
 from typing import List, Dict, Any, Optional
 import cv2
 
+@dataclass
+class SFTScriptArguments(ScriptArguments):
+    """
+    Script arguments for the video SFT script.
+
+    Args:
+        video_metadata_cache (`str`):
+            JSON file caching the frame count of every video, keyed by path and checked against mtime and size.
+        packing_max_tokens (`int` or `None`):
+            If set, the examples of a batch are packed into sequences of at most this many tokens, each example only
+            attending to itself. Packing happens within one DataLoader batch, so `per_device_train_batch_size` must be
+            raised to the number of examples a pack should hold (with the micro-batch then being the number of packs).
+            Needs the sdpa or eager attention implementation.
+        streaming (`bool`):
+            Stream a `.jsonl` dataset instead of loading it, each rank reading its own part of the file. Needs
+            `max_steps` and `dataloader_num_workers=0`.
+        shuffle_buffer (`int`):
+            Number of examples the streaming shuffle draws from.
+    """
+
+    video_metadata_cache: str = field(
+        default=os.path.expanduser("~/.cache/open_r1/video_metadata.json"),
+        metadata={"help": "JSON file caching video frame counts across launches, keyed by path, mtime and size"},
+    )
+    packing_max_tokens: Optional[int] = field(
+        default=None,
+        metadata={"help": "Pack the examples of a batch into sequences of at most this many tokens (sdpa/eager only). Packing is within one batch, so raise per_device_train_batch_size to the examples a pack should hold"},
+    )
+    streaming: bool = field(
+        default=False,
+        metadata={"help": "Stream a .jsonl dataset, each rank reading its own part of the file (needs max_steps and dataloader_num_workers 0)"},
+    )
+    shuffle_buffer: int = field(default=1000, metadata={"help": "Number of examples the streaming shuffle draws from"})
+
 def get_current_device():
     """Get the current device. For GPU we return the local process index to enable multiple GPU training."""
     return Accelerator().local_process_index if torch.cuda.is_available() else "cpu"
@@ -82,27 +123,85 @@ def download_video(url: str, folder: str = '/tmp/videos/') -> str:
     except requests.RequestException as e:
         raise Exception(f"Failed to download video: {e}")
 
-def check_video_quality(video_path: str) -> bool:
-    """Check if video has sufficient frames (at least 2 frames)"""
+def probe_video_frame_count(video_path: str) -> int:
+    """Number of frames of a video, or -1 if it cannot be opened."""
     try:
         cap = cv2.VideoCapture(video_path)
         if not cap.isOpened():
             print(f"Warning: Failed to open video file: {video_path}")
-            return False
+            return -1
         
         frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         cap.release()
-        
-        if frame_count < 2:
-            print(f"Warning: Video has insufficient frames ({frame_count}): {video_path}")
-            return False
-            
-        return True
+        return frame_count
     except Exception as e:
         print(f"Error checking video {video_path}: {str(e)}")
+        return -1
+
+def check_video_quality(video_path: str) -> bool:
+    """Check if video has sufficient frames (at least 2 frames)"""
+    frame_count = probe_video_frame_count(video_path)
+    if frame_count < 0:
         return False
+    if frame_count < 2:
+        print(f"Warning: Video has insufficient frames ({frame_count}): {video_path}")
+        return False
+    return True
 
-def prepare_dataset(example: Dict[str, Any]) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+def get_full_video_path(path: str) -> str:
+    """Resolve a dataset path against the VIDEO_BASE_PATH environment variable."""
+    video_base_path = os.environ.get('VIDEO_BASE_PATH', '')
+    if path.startswith('/'):
+         path = path[1:]  # Remove leading slash if exists
+    return os.path.join(video_base_path, path)
+
+def load_video_metadata_cache(cache_path: str) -> Dict[str, list]:
+    """Load the {path: [mtime_ns, size, frame_count]} video metadata cache, empty if it does not exist yet."""
+    if not os.path.isfile(cache_path):
+        return {}
+    with open(cache_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_video_metadata_cache(cache_path: str, cache: Dict[str, list]) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    tmp_path = f"{cache_path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, cache_path)  # Atomic, so concurrent launches never read a partial file
+
+@lru_cache(maxsize=1)
+def _video_metadata_cache_snapshot(cache_path: str) -> Dict[str, list]:
+    # Read once per map worker instead of once per batch
+    return load_video_metadata_cache(cache_path)
+
+def probe_videos(batch: Dict[str, list], cache_path: str) -> Dict[str, list]:
+    """Batched `datasets.map` function adding the frame count of every video, probed only if not cached.
+
+    A cache entry is reused while the file keeps the same mtime and size. Non-video examples get -1 and no stat.
+    """
+    cache = _video_metadata_cache_snapshot(cache_path)
+    frame_counts, cache_entries = [], []
+    for data_type, path in zip(batch["data_type"], batch["path"]):
+        if data_type != 'video':
+            frame_counts.append(-1)
+            cache_entries.append(None)
+            continue
+        full_video_path = get_full_video_path(path)
+        try:
+            stat = os.stat(full_video_path)
+        except OSError:
+            print(f"Warning: Failed to open video file: {full_video_path}")
+            frame_counts.append(-1)
+            cache_entries.append(None)
+            continue
+        entry = cache.get(full_video_path)
+        if entry is None or entry[:2] != [stat.st_mtime_ns, stat.st_size]:
+            entry = [stat.st_mtime_ns, stat.st_size, probe_video_frame_count(full_video_path)]
+        frame_counts.append(entry[2])
+        cache_entries.append(json.dumps([full_video_path, entry]))
+    return {"video_frame_count": frame_counts, "video_cache_entry": cache_entries}
+
+def prepare_dataset(example: Dict[str, Any], check_quality: bool = True) -> Optional[Dict[str, List[Dict[str, Any]]]]:
     """Prepare dataset example for training."""
     
     system_message = "You are a helpful assistant"
@@ -131,14 +230,10 @@ def prepare_dataset(example: Dict[str, Any]) -> Optional[Dict[str, List[Dict[str
         question = example['problem']
 
     # Get video base path from environment variable
-    video_base_path = os.environ.get('VIDEO_BASE_PATH', '')
-    video_path = example['path']
-    if video_path.startswith('/'):
-         video_path = video_path[1:]  # Remove leading slash if exists
-    full_video_path = os.path.join(video_base_path, video_path)
+    full_video_path = get_full_video_path(example['path'])
     
     # Check video quality if it's a video example
-    if example['data_type'] == 'video' and not check_video_quality(full_video_path):
+    if check_quality and example['data_type'] == 'video' and not check_video_quality(full_video_path):
         return None
  
     messages =[
@@ -167,46 +262,233 @@ def prepare_dataset(example: Dict[str, Any]) -> Optional[Dict[str, List[Dict[str
 
     return {"messages": messages}
 
+def remove_none_from_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop the None-valued keys Arrow adds when it unifies the content entries of stored messages."""
+    return [
+        {
+            **message,
+            "content": [{k: v for k, v in entry.items() if v is not None} for entry in message["content"]],
+        }
+        for message in messages
+    ]
+
+def load_example_vision(example: Dict[str, Any]):
+    """Chat template text and decoded images/videos of one example."""
+    messages = remove_none_from_messages(example["messages"])
+    text = processor.apply_chat_template(messages, tokenize=False)
+    image_inputs, video_inputs, video_kwargs = process_vision_info(messages, return_video_kwargs=True)
+    return text, image_inputs or [], video_inputs or []
+
 def collate_fn(examples: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
     """Collate batch of examples for training."""
-    texts = []
-    # video_inputs = []
-    # image_inputs = []
-
-    for i, example in enumerate(examples):
+    # Decoding releases the GIL, so the media of the batch is loaded by one thread per example
+    with ThreadPoolExecutor(max_workers=len(examples)) as executor:
+        futures = [executor.submit(load_example_vision, example) for example in examples]
+    texts, image_inputs, video_inputs = [], [], []
+    for i, future in enumerate(futures):
         try:
-
-            texts.append(processor.apply_chat_template(example["messages"], tokenize=False))
-            image_inputs, video_inputs, video_kwargs = process_vision_info(example["messages"], return_video_kwargs=True)
-            
+            text, images, videos = future.result()
         except Exception as e:
             raise ValueError(f"Failed to process example {i}: {e}")
+        texts.append(text)
+        image_inputs.extend(images)
+        video_inputs.extend(videos)
 
     inputs = processor(
         text=texts,
-        images=image_inputs,
-        videos=video_inputs,
+        images=image_inputs or None,
+        videos=video_inputs or None,
         return_tensors="pt",
         padding=True
     )
 
-    labels = inputs["input_ids"].clone()
-    labels[labels == processor.tokenizer.pad_token_id] = -100
-
-    # Handle visual tokens based on processor type
-    visual_tokens = [151652, 151653, 151656] if isinstance(processor, Qwen2VLProcessor) else [
-        processor.tokenizer.convert_tokens_to_ids(processor.image_token)
-    ]
-
-    for visual_token_id in visual_tokens:
-        labels[labels == visual_token_id] = -100
+    inputs["labels"] = build_labels(inputs["input_ids"])
+    return inputs
 
-    inputs["labels"] = labels
+def build_labels(input_ids: torch.Tensor) -> torch.Tensor:
+    """Copy input ids into labels, keeping the assistant responses only: prompt, padding and visual tokens are -100."""
+    tokenizer = processor.tokenizer
+    im_end_id = tokenizer.convert_tokens_to_ids("<|im_end|>")
+    # A response starts right after "<|im_start|>assistant\n" and runs up to and including its "<|im_end|>"
+    header = torch.tensor(
+        [tokenizer.convert_tokens_to_ids("<|im_start|>")] + tokenizer.encode("assistant\n", add_special_tokens=False)
+    )
+    seq_length = input_ids.size(1)
+    positions = torch.arange(seq_length).expand_as(input_ids)
+    no_event = torch.full_like(input_ids, -1)
+
+    response_starts = no_event.clone()
+    if seq_length > len(header):
+        header_ends = (input_ids.unfold(1, len(header), 1)[:, :-1] == header).all(dim=-1)
+        response_starts[:, len(header):] = torch.where(header_ends, positions[:, len(header):], -1)
+    turn_ends = no_event.clone()
+    turn_ends[:, 1:] = torch.where(input_ids[:, :-1] == im_end_id, positions[:, 1:], -1)
+    # Inside a response iff the last response start is more recent than the last turn end
+    in_response = response_starts.cummax(dim=1).values > turn_ends.cummax(dim=1).values
+
+    ignored_ids = torch.tensor(
+        [tokenizer.pad_token_id]
+        + tokenizer.convert_tokens_to_ids(["<|vision_start|>", "<|vision_end|>", "<|image_pad|>", "<|video_pad|>"])
+    )
+    return input_ids.masked_fill(~in_response | torch.isin(input_ids, ignored_ids), -100)
+
+def collate_compiled_fn(examples: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+    """Collate records of a compiled dataset, which already hold the processor outputs."""
+    input_ids = [example["input_ids"] for example in examples]
+    inputs = {
+        "input_ids": pad_sequence(input_ids, batch_first=True, padding_value=processor.tokenizer.pad_token_id),
+        "attention_mask": pad_sequence([torch.ones_like(ids) for ids in input_ids], batch_first=True, padding_value=0),
+    }
+    for key in ("pixel_values", "image_grid_thw", "pixel_values_videos", "video_grid_thw"):
+        if any(key in example for example in examples):
+            inputs[key] = torch.cat([example[key] for example in examples if key in example])
+    if any(example.get("second_per_grid_ts") is not None for example in examples):  # Qwen2.5-VL videos only
+        inputs["second_per_grid_ts"] = torch.cat(
+            [torch.as_tensor(example["second_per_grid_ts"]) for example in examples if "second_per_grid_ts" in example]
+        )
+
+    inputs["labels"] = build_labels(inputs["input_ids"])
     return inputs
 
+def pack_lengths(lengths: List[int], max_tokens: int) -> List[List[int]]:
+    """First-fit decreasing: groups of indices whose lengths sum to at most `max_tokens`. Longer items get a pack alone."""
+    packs, loads = [], []
+    for index in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        for pack_index, load in enumerate(loads):
+            if load + lengths[index] <= max_tokens:
+                packs[pack_index].append(index)
+                loads[pack_index] += lengths[index]
+                break
+        else:
+            packs.append([index])
+            loads.append(lengths[index])
+    return packs
+
+class RopeIndex:
+    """Picklable stand-in for `model.get_rope_index`, which only reads `self.config`, so DataLoader workers can use it."""
+
+    def __init__(self, model):
+        self.config = model.config
+        self._get_rope_index = type(model).get_rope_index
+
+    def __call__(self, inputs: Dict[str, Any]) -> torch.Tensor:
+        kwargs = {}
+        if inputs.get("second_per_grid_ts") is not None:  # Qwen2.5-VL only
+            kwargs["second_per_grid_ts"] = torch.as_tensor(inputs["second_per_grid_ts"])
+        position_ids, _ = self._get_rope_index(
+            self,
+            input_ids=inputs["input_ids"],
+            image_grid_thw=inputs.get("image_grid_thw"),
+            video_grid_thw=inputs.get("video_grid_thw"),
+            attention_mask=inputs["attention_mask"],
+            **kwargs,
+        )
+        return position_ids
+
+class PackingCollator:
+    """
+    Packs the examples of a batch into sequences of at most `max_tokens` tokens. Only the examples of one DataLoader
+    batch are packed together, so the batch size sets how many examples a pack can draw from.
+
+    The mrope position ids of every example are computed on its own and concatenated, so each packed example sees the
+    same positions (up to a constant offset, which rotary embeddings ignore) as when trained alone. Vision tensors and
+    `*_grid_thw` follow the order of the examples in the packs, which is the order the model fills the placeholder
+    tokens in. Isolation comes from a block-diagonal causal 4D attention mask in the model's additive format, which the
+    sdpa and eager attention paths use as is.
+    """
+
+    def __init__(self, max_tokens: int, rope_index: RopeIndex, dtype: torch.dtype):
+        self.max_tokens = max_tokens
+        self.rope_index = rope_index
+        self.dtype = dtype
+
+    def _process(self, examples: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if "input_ids" in examples[0]:
+            # Records of a compiled dataset already hold the processor outputs
+            samples = [{**example, "attention_mask": torch.ones_like(example["input_ids"])} for example in examples]
+        else:
+            with ThreadPoolExecutor(max_workers=len(examples)) as executor:
+                futures = [executor.submit(load_example_vision, example) for example in examples]
+            samples = []
+            for i, future in enumerate(futures):
+                try:
+                    text, images, videos = future.result()
+                except Exception as e:
+                    raise ValueError(f"Failed to process example {i}: {e}")
+                sample = processor(text=[text], images=images or None, videos=videos or None, return_tensors="pt")
+                samples.append({key: sample[key] for key in sample.keys()})
+            for sample in samples:
+                sample["input_ids"] = sample["input_ids"][0]
+                sample["attention_mask"] = sample["attention_mask"][0]
+
+        for sample in samples:
+            sample["position_ids"] = self.rope_index(
+                {**sample, "input_ids": sample["input_ids"][None], "attention_mask": sample["attention_mask"][None]}
+            )[:, 0]
+            sample["labels"] = build_labels(sample["input_ids"][None])[0]
+        return samples
+
+    def __call__(self, examples: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+        samples = self._process(examples)
+        packs = pack_lengths([len(sample["input_ids"]) for sample in samples], self.max_tokens)
+        pack_length = max(sum(len(samples[i]["input_ids"]) for i in pack) for pack in packs)
+
+        input_ids = torch.full((len(packs), pack_length), processor.tokenizer.pad_token_id, dtype=torch.long)
+        labels = torch.full((len(packs), pack_length), -100, dtype=torch.long)
+        position_ids = torch.zeros((3, len(packs), pack_length), dtype=torch.long)
+        attention_mask = torch.full(
+            (len(packs), 1, pack_length, pack_length), torch.finfo(self.dtype).min, dtype=self.dtype
+        )
+        ordered = []
+        for row, pack in enumerate(packs):
+            offset = 0
+            for index in pack:
+                sample = samples[index]
+                end = offset + len(sample["input_ids"])
+                input_ids[row, offset:end] = sample["input_ids"]
+                labels[row, offset:end] = sample["labels"]
+                position_ids[:, row, offset:end] = sample["position_ids"]
+                causal = torch.ones(end - offset, end - offset, dtype=torch.bool).tril()
+                attention_mask[row, 0, offset:end, offset:end].masked_fill_(causal, 0)
+                offset = end
+                ordered.append(sample)
+
+        inputs = {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "position_ids": position_ids,
+            "labels": labels,
+        }
+        for key in ("pixel_values", "image_grid_thw", "pixel_values_videos", "video_grid_thw"):
+            if any(key in sample for sample in ordered):
+                inputs[key] = torch.cat([sample[key] for sample in ordered if key in sample])
+        if any(sample.get("second_per_grid_ts") is not None for sample in ordered):
+            inputs["second_per_grid_ts"] = torch.cat(
+                [torch.as_tensor(sample["second_per_grid_ts"]) for sample in ordered if "second_per_grid_ts" in sample]
+            )
+        return inputs
+
+class StreamingSFTTrainer(SFTTrainer):
+    """SFTTrainer that reads a `JsonlStream` through its own per-rank DataLoader and resumes it by offset."""
+
+    def get_train_dataloader(self):
+        if isinstance(self.train_dataset, JsonlStream):
+            return stream_dataloader(self.train_dataset, self.args, self.data_collator, self._train_batch_size)
+        return super().get_train_dataloader()
+
+    def train(self, resume_from_checkpoint=None, *args, **kwargs):
+        checkpoint = resume_from_checkpoint
+        if isinstance(checkpoint, bool) and checkpoint:
+            checkpoint = get_last_checkpoint(self.args.output_dir)
+        if isinstance(self.train_dataset, JsonlStream) and checkpoint:
+            self.train_dataset.resume(
+                checkpoint, self.args.per_device_train_batch_size * self.args.gradient_accumulation_steps
+            )
+        return super().train(resume_from_checkpoint, *args, **kwargs)
+
 if __name__ == "__main__":
     # Parse arguments
-    parser = TrlParser((ScriptArguments, SFTConfig, ModelConfig))
+    parser = TrlParser((SFTScriptArguments, SFTConfig, ModelConfig))
     script_args, training_args, model_config = parser.parse_args_and_config()
     
     # Configure training args
@@ -215,7 +497,10 @@ if __name__ == "__main__":
     training_args.dataset_kwargs = {"skip_prepare_dataset": True}
 
     # Load dataset
-    if script_args.dataset_name.endswith('.json') or script_args.dataset_name.endswith('.jsonl'):
+    if is_compiled_dataset(script_args.dataset_name) or script_args.streaming:
+        # Shards written by compile_dataset.py have nothing left to prepare, streams are prepared example by example
+        dataset = None
+    elif script_args.dataset_name.endswith('.json') or script_args.dataset_name.endswith('.jsonl'):
         dataset =  DatasetDict({"train": Dataset.from_json(script_args.dataset_name)})
     else:
         # Load the dataset
@@ -259,33 +544,94 @@ if __name__ == "__main__":
     )
 
     # Prepare dataset
-    prepared_dataset = []
-    skipped_count = 0
-    total_count = len(dataset['train'])
-
-    print(f"Processing {total_count} examples...")
-    for example in dataset['train']:
-        prepared_example = prepare_dataset(example)
-        if prepared_example is not None:
-            prepared_dataset.append(prepared_example)
-        else:
-            skipped_count += 1
-
-    print(f"\nDataset preparation completed:")
-    print(f"Total examples: {total_count}")
-    print(f"Valid examples: {len(prepared_dataset)}")
-    print(f"Skipped examples: {skipped_count}")
+    if script_args.streaming:
+        if not script_args.dataset_name.endswith('.jsonl'):
+            raise ValueError(f"streaming needs a .jsonl dataset, got {script_args.dataset_name}")
+        if training_args.max_steps <= 0:
+            raise ValueError("A stream has no length, please set --max_steps")
+        if training_args.dataloader_num_workers > 0:
+            raise ValueError("A stream is resumed by offset, which only holds when it is read by the main process, "
+                             "please set --dataloader_num_workers 0")
+        prepared_dataset = JsonlStream(
+            script_args.dataset_name,
+            rank=training_args.process_index,
+            world_size=training_args.world_size,
+            shuffle_buffer=script_args.shuffle_buffer,
+            seed=training_args.seed,
+            transform=prepare_dataset,
+        )
+        # The stream skips the consumed examples by offset on resume, instead of the Trainer collating and dropping them
+        training_args.ignore_data_skip = True
+        data_collator = collate_fn
+        print(f"Streaming {script_args.dataset_name}, rank {training_args.process_index} of {training_args.world_size}")
+    elif dataset is None:
+        prepared_dataset = CompiledDataset(script_args.dataset_name)
+        data_collator = collate_compiled_fn
+        print(f"Loaded {len(prepared_dataset)} compiled examples")
+    else:
+        train_dataset = dataset['train']
+        total_count = len(train_dataset)
+        num_proc = training_args.dataset_num_proc
+
+        print(f"Processing {total_count} examples...")
+        with training_args.main_process_first(desc="video quality check"):
+            # Probe frame counts in parallel; the persistent cache makes relaunches skip unchanged videos. The datasets
+            # cache is bypassed on purpose: it would miss files that changed on disk since the last run.
+            probed_dataset = train_dataset.map(
+                probe_videos,
+                batched=True,
+                num_proc=num_proc,
+                fn_kwargs={"cache_path": script_args.video_metadata_cache},
+                load_from_cache_file=False,
+                desc="Probing videos",
+            )
+            if training_args.process_index == 0:
+                cache = load_video_metadata_cache(script_args.video_metadata_cache)
+                cache.update(json.loads(entry) for entry in probed_dataset["video_cache_entry"] if entry is not None)
+                save_video_metadata_cache(script_args.video_metadata_cache, cache)
+
+        valid_dataset = probed_dataset.filter(
+            lambda example: example['data_type'] != 'video' or example['video_frame_count'] >= 2,
+            num_proc=num_proc,
+        )
+        prepared_dataset = valid_dataset.map(
+            prepare_dataset,
+            fn_kwargs={"check_quality": False},
+            num_proc=num_proc,
+            remove_columns=valid_dataset.column_names,
+            desc="Preparing messages",
+        )
+        skipped_count = total_count - len(prepared_dataset)
+
+        print(f"\nDataset preparation completed:")
+        print(f"Total examples: {total_count}")
+        print(f"Valid examples: {len(prepared_dataset)}")
+        print(f"Skipped examples: {skipped_count}")
+        data_collator = collate_fn
+
+    if script_args.packing_max_tokens is not None:
+        if model.config._attn_implementation == "flash_attention_2":
+            raise ValueError(
+                "packing_max_tokens needs a 4D attention mask, which the flash_attention_2 path does not accept. "
+                "Use the sdpa or eager attention implementation."
+            )
+        if training_args.per_device_train_batch_size < 2:
+            raise ValueError(
+                "packing_max_tokens packs the examples of one batch, which does nothing with "
+                "per_device_train_batch_size 1. Raise it to the number of examples a pack should hold."
+            )
+        data_collator = PackingCollator(script_args.packing_max_tokens, RopeIndex(model), model.dtype)
 
     # Initialize wandb if specified
     if training_args.report_to == "wandb":
         wandb.init(project="video-llm-training")
 
     # Initialize trainer
-    trainer = SFTTrainer(
+    trainer = StreamingSFTTrainer(
         model=model,
         args=training_args,
         train_dataset=prepared_dataset,
-        data_collator=collate_fn,
+        data_collator=data_collator,
         peft_config=get_peft_config(model_config),
         # tokenizer=processor.tokenizer
     )
@@ -0,0 +1,236 @@
+"""
+Sharded, memory-mapped storage for pre-tokenized and pre-patchified training records.
+
+A compiled dataset is a directory with a `manifest.json` and one sub-directory per shard:
+
+    manifest.json
+    shard-00000/
+        input_ids.bin   # int32 token ids of all records, back to back
+        pixels.bin      # patchified `pixel_values(_videos)` of all records, as bfloat16 bits or uint8
+        records.jsonl   # one line per record: offsets into the two files, `grid_thw` and the example metadata
+
+Records are written by `compile_dataset.py` and read back by [`CompiledDataset`], which only maps the shard files and
+slices them, so training skips the chat template, the video decoding and the processor entirely.
+"""
+
+import json
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+
+MANIFEST_NAME = "manifest.json"
+FORMAT_VERSION = 1
+PIXEL_DTYPES = ("bfloat16", "uint8")
+
+
+def is_compiled_dataset(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, MANIFEST_NAME))
+
+
+def _channel_stats(manifest: dict) -> tuple[torch.Tensor, torch.Tensor]:
+    """Per-column mean and std of a patch row, which is laid out as (channel, temporal_patch, patch, patch)."""
+    patch_elements = manifest["temporal_patch_size"] * manifest["patch_size"] ** 2
+    mean = torch.tensor(manifest["image_mean"], dtype=torch.float32).repeat_interleave(patch_elements)
+    std = torch.tensor(manifest["image_std"], dtype=torch.float32).repeat_interleave(patch_elements)
+    return mean, std
+
+
+def encode_pixels(pixel_values: torch.Tensor, manifest: dict) -> np.ndarray:
+    """Converts normalized patches to the on-disk `pixel_dtype` of the manifest."""
+    if manifest["pixel_dtype"] == "bfloat16":
+        return pixel_values.to(torch.bfloat16).view(torch.int16).numpy()
+    # Undo the processor normalization: uint8 keeps the original 8-bit pixel values (up to resize rounding)
+    mean, std = _channel_stats(manifest)
+    pixels = (pixel_values.float() * std + mean) / manifest["rescale_factor"]
+    return pixels.round().clamp(0, 255).to(torch.uint8).numpy()
+
+
+def decode_pixels(pixels: np.ndarray, manifest: dict) -> torch.Tensor:
+    """Inverse of `encode_pixels`: returns patches as the processor would have produced them."""
+    pixels = torch.from_numpy(np.array(pixels))
+    if manifest["pixel_dtype"] == "bfloat16":
+        return pixels.view(torch.bfloat16)
+    mean, std = _channel_stats(manifest)
+    return (pixels.float() * manifest["rescale_factor"] - mean) / std
+
+
+class ShardWriter:
+    """
+    Appends records to a compiled dataset, starting a new shard every `shard_size` records.
+
+    Args:
+        output_dir (`str`):
+            Directory of the compiled dataset, created if needed.
+        manifest (`dict`):
+            Dataset-level information: `pixel_dtype`, the processor normalization (`image_mean`, `image_std`,
+            `rescale_factor`, `patch_size`, `temporal_patch_size`, `merge_size`) and the vision token ids.
+        shard_size (`int`, *optional*, defaults to `1024`):
+            Number of records per shard.
+    """
+
+    def __init__(self, output_dir: str, manifest: dict, shard_size: int = 1024):
+        if manifest["pixel_dtype"] not in PIXEL_DTYPES:
+            raise ValueError(f"pixel_dtype must be one of {PIXEL_DTYPES}, got {manifest['pixel_dtype']}")
+        self.output_dir = output_dir
+        self.manifest = {**manifest, "format_version": FORMAT_VERSION, "shards": []}
+        self.shard_size = shard_size
+        self._files = None
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _open_shard(self):
+        name = f"shard-{len(self.manifest['shards']):05d}"
+        shard_dir = os.path.join(self.output_dir, name)
+        os.makedirs(shard_dir, exist_ok=True)
+        self.manifest["shards"].append({"name": name, "num_records": 0})
+        self._files = {
+            "input_ids": open(os.path.join(shard_dir, "input_ids.bin"), "wb"),
+            "pixels": open(os.path.join(shard_dir, "pixels.bin"), "wb"),
+            "records": open(os.path.join(shard_dir, "records.jsonl"), "w", encoding="utf-8"),
+        }
+        self._offsets = {"input_ids": 0, "pixels": 0}
+
+    def _close_shard(self):
+        if self._files is not None:
+            for f in self._files.values():
+                f.close()
+            self._files = None
+
+    def write(
+        self,
+        input_ids: torch.Tensor,
+        pixel_key: str,
+        pixel_values: torch.Tensor,
+        grid_thw: torch.Tensor,
+        metadata: dict,
+        second_per_grid_ts: list = None,
+    ) -> None:
+        if self._files is None or self.manifest["shards"][-1]["num_records"] >= self.shard_size:
+            self._close_shard()
+            self._open_shard()
+
+        input_ids = input_ids.to(torch.int32).numpy()
+        pixels = encode_pixels(pixel_values, self.manifest)
+        self._files["input_ids"].write(input_ids.tobytes())
+        self._files["pixels"].write(pixels.tobytes())
+        record = {
+            "input_ids": [self._offsets["input_ids"], len(input_ids)],
+            "pixels": [self._offsets["pixels"], *pixels.shape],
+            "pixel_key": pixel_key,
+            "grid_thw": grid_thw.tolist(),
+            "metadata": metadata,
+        }
+        if second_per_grid_ts is not None:
+            record["second_per_grid_ts"] = torch.as_tensor(second_per_grid_ts).tolist()
+        self._files["records"].write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._offsets["input_ids"] += len(input_ids)
+        self._offsets["pixels"] += pixels.size
+        self.manifest["shards"][-1]["num_records"] += 1
+
+    def close(self) -> None:
+        self._close_shard()
+        self.manifest["num_records"] = sum(shard["num_records"] for shard in self.manifest["shards"])
+        with open(os.path.join(self.output_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+
+
+class CompiledDataset(Dataset):
+    """
+    Map-style dataset over the records of a compiled dataset.
+
+    Each item is the record metadata (the original example columns, e.g. `prompt`, `problem_id`, `solution`) plus the
+    processor outputs: `input_ids`, `pixel_values` / `image_grid_thw` or `pixel_values_videos` / `video_grid_thw`. The
+    shard files are memory-mapped lazily, once per process, so the dataset can be pickled to DataLoader workers.
+    Indexing with a column name returns that metadata column, like `datasets.Dataset`.
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, MANIFEST_NAME), encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest["format_version"] != FORMAT_VERSION:
+            raise ValueError(
+                f"{path} was compiled with format version {self.manifest['format_version']}, expected {FORMAT_VERSION}"
+            )
+        self.path = path
+        self.records = []
+        self.shard_ids = []
+        for shard_id, shard in enumerate(self.manifest["shards"]):
+            with open(os.path.join(path, shard["name"], "records.jsonl"), encoding="utf-8") as f:
+                shard_records = [json.loads(line) for line in f]
+            self.records.extend(shard_records)
+            self.shard_ids.extend([shard_id] * len(shard_records))
+        self._mmaps = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_mmaps"] = {}
+        return state
+
+    def _shard_arrays(self, shard_id: int) -> tuple[np.memmap, np.memmap]:
+        if shard_id not in self._mmaps:
+            shard_dir = os.path.join(self.path, self.manifest["shards"][shard_id]["name"])
+            pixel_dtype = np.int16 if self.manifest["pixel_dtype"] == "bfloat16" else np.uint8
+            self._mmaps[shard_id] = (
+                np.memmap(os.path.join(shard_dir, "input_ids.bin"), dtype=np.int32, mode="r"),
+                np.memmap(os.path.join(shard_dir, "pixels.bin"), dtype=pixel_dtype, mode="r"),
+            )
+        return self._mmaps[shard_id]
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        if isinstance(index, str):
+            return [record["metadata"].get(index) for record in self.records]
+
+        record = self.records[index]
+        input_ids, pixels = self._shard_arrays(self.shard_ids[index])
+        ids_offset, ids_length = record["input_ids"]
+        pixels_offset, num_patches, patch_dim = record["pixels"]
+        pixel_values = pixels[pixels_offset : pixels_offset + num_patches * patch_dim].reshape(num_patches, patch_dim)
+
+        grid_key = "video_grid_thw" if record["pixel_key"] == "pixel_values_videos" else "image_grid_thw"
+        item = {
+            **record["metadata"],
+            "input_ids": torch.from_numpy(input_ids[ids_offset : ids_offset + ids_length].astype(np.int64)),
+            record["pixel_key"]: decode_pixels(pixel_values, self.manifest),
+            grid_key: torch.tensor(record["grid_thw"], dtype=torch.long),
+        }
+        if "second_per_grid_ts" in record:
+            item["second_per_grid_ts"] = record["second_per_grid_ts"]
+        return item
+
+
+def verify_shards(path: str) -> list[str]:
+    """
+    Checks a compiled dataset without a GPU or a processor: every record must lie inside its shard files, have one
+    patch row per grid cell, and hold as many vision placeholder tokens as its grid produces after merging.
+
+    Returns the list of problems found (empty if the dataset is consistent).
+    """
+    dataset = CompiledDataset(path)
+    manifest = dataset.manifest
+    merge_length = manifest["merge_size"] ** 2
+    errors = []
+    if manifest["num_records"] != len(dataset):
+        errors.append(f"manifest lists {manifest['num_records']} records, shards hold {len(dataset)}")
+
+    for index, record in enumerate(dataset.records):
+        input_ids, pixels = dataset._shard_arrays(dataset.shard_ids[index])
+        ids_offset, ids_length = record["input_ids"]
+        pixels_offset, num_patches, patch_dim = record["pixels"]
+        if ids_offset + ids_length > len(input_ids) or pixels_offset + num_patches * patch_dim > len(pixels):
+            errors.append(f"record {index}: offsets past the end of its shard files")
+            continue
+        grid_cells = sum(t * h * w for t, h, w in record["grid_thw"])
+        if grid_cells != num_patches:
+            errors.append(f"record {index}: {num_patches} patch rows for {grid_cells} grid cells")
+        token_id = (
+            manifest["video_token_id"] if record["pixel_key"] == "pixel_values_videos" else manifest["image_token_id"]
+        )
+        num_tokens = int((input_ids[ids_offset : ids_offset + ids_length] == token_id).sum())
+        if num_tokens * merge_length != grid_cells:
+            errors.append(f"record {index}: {num_tokens} vision tokens for {grid_cells // merge_length} merged patches")
+    return errors
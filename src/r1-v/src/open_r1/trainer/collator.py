@@ -0,0 +1,115 @@
+import copy
+import os
+
+from trl.data_utils import maybe_apply_chat_template
+
+from qwen_vl_utils import process_vision_info
+
+
+# Processor outputs held by a prepared example (see `PromptPrefetchCollator`) or a compiled record. They are model
+# inputs, not dataset columns, so they are not passed on to the reward functions.
+PROMPT_INPUT_KEYS = (
+    "input_ids", "pixel_values", "image_grid_thw", "pixel_values_videos", "video_grid_thw", "second_per_grid_ts"
+)
+
+def remove_none_from_data(data):
+    for entry in data:
+        if "content" in entry and isinstance(entry["content"], list):
+            for sub_entry in entry["content"]:
+                if isinstance(sub_entry, dict):
+                    keys_to_remove = [k for k, v in sub_entry.items() if v is None]
+                    for k in keys_to_remove:
+                        del sub_entry[k]
+    return data
+
+
+def vision_token_budget(processing_class, prompts_text, max_prompt_length):
+    """Visual tokens that still fit in `max_prompt_length` next to the text of the longest prompt."""
+    if max_prompt_length is None:
+        return None
+    # Vision placeholders are single tokens before the processor expands them, so this counts the text only
+    text_ids = processing_class.tokenizer(prompts_text, add_special_tokens=False)["input_ids"]
+    return max(max_prompt_length - max(len(ids) for ids in text_ids), 0)
+
+
+def load_prompt_inputs(inputs, processing_class, max_prompt_length=None):
+    """
+    CPU part of preparing the prompts of a GRPO step: chat template, image/video loading and processor call.
+
+    Only the media of `inputs[0]` is loaded (`per_device_train_batch_size=1`). Returns the prompt texts, the processor
+    outputs (on CPU, not truncated), the loaded images and videos, and the conversation with the media path filled in.
+    """
+    prompts_text = [maybe_apply_chat_template(example, processing_class)["prompt"] for example in inputs]
+
+    input_copy = copy.deepcopy(inputs[0]['prompt'])
+
+    input_copy = remove_none_from_data(input_copy)
+
+    video_base_path = os.environ.get('VIDEO_BASE_PATH', '')
+    video_path = inputs[0]['path']
+    if video_path.startswith('/'):
+        video_path = video_path[1:]  # Remove leading slash if exists
+    full_video_path = os.path.join(video_base_path, video_path)
+
+    if inputs[0]['data_type'] == 'image':
+        # input_copy[0]['content'][0]['image'] = os.getcwd() + "/Video-R1-data" + inputs[0]['path'][1:]
+        input_copy[0]['content'][0]['video'] = full_video_path
+    elif inputs[0]['data_type'] == 'video':
+        # input_copy[0]['content'][0]['video'] = os.getcwd() + "/Video-R1-data" + inputs[0]['path'][1:]
+        input_copy[0]['content'][0]['video'] = full_video_path
+
+    max_vision_tokens = vision_token_budget(processing_class, prompts_text, max_prompt_length)
+    try:
+        image_inputs, video_inputs, video_kwargs = process_vision_info(
+            input_copy, return_video_kwargs=True, max_vision_tokens=max_vision_tokens
+        )
+    except Exception as e:
+        print(f"process_vision_info error, using fixed data, {e}")
+        if inputs[0]['data_type'] == 'image':
+            input_copy[0]['content'][0]['image'] = os.getcwd() + "/Video-R1-data" + '/Math/Multimath-300k/17ff4c7d14c388134de02381b1fc2824.png'
+        elif inputs[0]['data_type'] == 'video':
+            input_copy[0]['content'][0]['video'] = os.getcwd() + "/Video-R1-data" + '/LLaVA-Video-178K/liwei_youtube_videos/videos/youtube_video_2024/ytb_7nRmsEw7nsE.mp4'
+
+        image_inputs, video_inputs, video_kwargs = process_vision_info(
+            input_copy, return_video_kwargs=True, max_vision_tokens=max_vision_tokens
+        )
+
+    prompt_inputs = processing_class(
+        text=copy.deepcopy(prompts_text),
+        images=image_inputs,
+        videos=video_inputs,
+        return_tensors="pt",
+        padding=True,
+        padding_side="left",
+        add_special_tokens=False,
+    )
+    return prompts_text, prompt_inputs, image_inputs, video_inputs, input_copy
+
+
+class PromptPrefetchCollator:
+    """
+    GRPO data collator that loads the media and runs the processor of every example in the DataLoader workers.
+
+    Each example gets the processor outputs (`input_ids`, `pixel_values(_videos)`, `*_grid_thw`) as extra keys, the
+    same layout as a record of a compiled dataset, so `compute_loss` only has to move ready tensors to the GPU while
+    the workers decode the next batches (`dataloader_num_workers`, `dataloader_prefetch_factor`,
+    `dataloader_pin_memory`).
+    """
+
+    def __init__(self, processing_class, max_prompt_length=None):
+        self.processing_class = processing_class
+        self.max_prompt_length = max_prompt_length
+
+    def __call__(self, features):
+        batch = []
+        for example in features:
+            _, prompt_inputs, _, _, _ = load_prompt_inputs([example], self.processing_class, self.max_prompt_length)
+            example = dict(example)
+            example["input_ids"] = prompt_inputs["input_ids"][0][prompt_inputs["attention_mask"][0].bool()]
+            for key in ("pixel_values", "image_grid_thw", "pixel_values_videos", "video_grid_thw"):
+                if key in prompt_inputs:
+                    example[key] = prompt_inputs[key]
+            if "second_per_grid_ts" in prompt_inputs:
+                example["second_per_grid_ts"] = list(prompt_inputs["second_per_grid_ts"])
+            batch.append(example)
+        return batch
@@ -14,7 +14,7 @@
 
 import os
 import textwrap
-from collections import defaultdict
+from collections import defaultdict, deque
 from typing import Any, Callable, Optional, Union
 import random
 
@@ -22,6 +22,7 @@ import torch
 import torch.utils.data
 import transformers
 from datasets import Dataset, IterableDataset
+from accelerate.utils import gather_object
 from packaging import version
 from transformers import (
     AriaForConditionalGeneration,
@@ -45,9 +46,13 @@ from transformers.utils import is_peft_available
 from trl.data_utils import apply_chat_template, is_conversational, maybe_apply_chat_template
 from trl.models import create_reference_model, prepare_deepspeed, unwrap_model_for_generation
 from trl.trainer.grpo_config import GRPOConfig
-from trl.trainer.utils import generate_model_card, get_comet_experiment_url
+from trl.trainer.utils import generate_model_card, get_comet_experiment_url, pad
 
-from qwen_vl_utils import process_vision_info
+
+from .collator import PROMPT_INPUT_KEYS, PromptPrefetchCollator, load_prompt_inputs
+from .mixins import GRPODataMixin
+from .sampler import ProblemRewardHistory
+from .utils import completion_logps, length_buckets, padding_waste, shuffle_video_patches
 
 import copy
 
@@ -64,7 +69,7 @@ if is_wandb_available():
 RewardFunc = Union[str, PreTrainedModel, Callable[[list, list], list[float]]]
 
 
-class Qwen2VLGRPOTrainer(Trainer):
+class Qwen2VLGRPOTrainer(GRPODataMixin, Trainer):
     """
     Trainer for the Group Relative Policy Optimization (GRPO) method. This algorithm was initially proposed in the
     paper [DeepSeekMath: Pushing the Limits of Mathematical Reasoning in Open Language Models](https://huggingface.co/papers/2402.03300).
@@ -280,8 +285,12 @@ class Qwen2VLGRPOTrainer(Trainer):
         self.reward_processing_classes = reward_processing_classes
 
         # Data collator
-        def data_collator(features):  # No data collation is needed in GRPO
-            return features
+        if script_args.prefetch_vision_inputs:
+            # Load the media and run the processor in the DataLoader workers, ahead of `compute_loss`
+            data_collator = PromptPrefetchCollator(processing_class, args.max_prompt_length)
+        else:
+            def data_collator(features):  # No data collation is needed in GRPO
+                return features
 
         # Training arguments
         self.max_prompt_length = args.max_prompt_length
@@ -305,18 +314,33 @@ class Qwen2VLGRPOTrainer(Trainer):
             num_return_sequences=self.shuffled_num_generations,
             pad_token_id=pad_token_id,
         )
-        
-        self.dummy_generation_config = GenerationConfig(
-            max_new_tokens=1,
-            do_sample=True,
-            top_p=0.95,  
-            temperature=1, # HACK
-            num_return_sequences=1,
-            pad_token_id=pad_token_id,
-        )
+
         self.len_control = script_args.len_control
         self.beta = args.beta
 
+        # Dynamic sampling: score partial groups and replace saturated prompts before generating the full group
+        self.dynamic_sampling = script_args.dynamic_sampling
+        self.dynamic_sampling_stages = sorted(
+            {stage for stage in script_args.dynamic_sampling_stages if 0 < stage < self.num_generations}
+        )
+        self.dynamic_sampling_max_resample = script_args.dynamic_sampling_max_resample
+        self._prompt_queue = deque()
+
+        # Split the policy and reference forwards into completion-length buckets to cut padding
+        if script_args.rollout_buckets < 1:
+            raise ValueError(f"rollout_buckets must be at least 1, got {script_args.rollout_buckets}")
+        self.rollout_buckets = script_args.rollout_buckets
+
+        # Difficulty-aware sampling: down-weight prompts that are always or never solved
+        if script_args.difficulty_sampling:
+            self.reward_history = ProblemRewardHistory(
+                train_dataset["problem_id"],
+                history_size=script_args.difficulty_history_size,
+                saturated_weight=script_args.difficulty_saturated_weight,
+            )
+        else:
+            self.reward_history = None
+
         # The trainer estimates the number of FLOPs (floating-point operations) using the number of elements in the
         # input tensor associated with the key "input_ids". However, in GRPO, the sampled data does not include the
         # "input_ids" key. Instead, the available keys is "prompt". As a result, the trainer issues the warning:
@@ -378,6 +402,16 @@ class Qwen2VLGRPOTrainer(Trainer):
             token_log_prob = torch.gather(log_probs, dim=1, index=input_ids_row.unsqueeze(1)).squeeze(1)
             per_token_logps.append(token_log_prob)
         return torch.stack(per_token_logps)
+
+    def _get_completion_logps(self, model, prompt_completion_ids, prompt_length, completion_mask, vision_inputs):
+        """
+        Per-token log probabilities of the completions, one completion-length bucket at a time, see
+        `completion_logps`.
+        """
+        return completion_logps(
+            self._get_per_token_logps, model, prompt_completion_ids, prompt_length, completion_mask, vision_inputs,
+            self.rollout_buckets,
+        )
     
     def remove_none_from_data(self, data):
         for entry in data:
@@ -395,56 +429,45 @@ class Qwen2VLGRPOTrainer(Trainer):
     def _prepare_inputs(self, inputs: dict[str, Union[torch.Tensor, Any]]) -> dict[str, Union[torch.Tensor, Any]]:
         return inputs
 
-    def compute_loss(self, model, inputs, return_outputs=False, num_items_in_batch=None):
-        if return_outputs:
-            raise ValueError("The GRPOTrainer does not support returning outputs")
-    
-        
-
-        prompts = [x["prompt"] for x in inputs]
+    def _prepare_compiled_prompt_inputs(self, inputs):
+        """Same outputs as `_prepare_prompt_inputs`, for examples that already hold the processor outputs: records of a
+        compiled dataset (see `compile_dataset.py`) or examples prepared by `PromptPrefetchCollator`."""
         prompts_text = [maybe_apply_chat_template(example, self.processing_class)["prompt"] for example in inputs]
+        input_ids = [example["input_ids"] for example in inputs]
+        prompt_inputs = {
+            "input_ids": pad(input_ids, padding_value=self.processing_class.tokenizer.pad_token_id, padding_side="left"),
+            "attention_mask": pad([torch.ones_like(ids) for ids in input_ids], padding_value=0, padding_side="left"),
+        }
+        for key in ("pixel_values", "image_grid_thw", "pixel_values_videos", "video_grid_thw"):
+            if key in inputs[0]:
+                prompt_inputs[key] = torch.cat([example[key] for example in inputs])
+        if "second_per_grid_ts" in inputs[0]:
+            prompt_inputs["second_per_grid_ts"] = [ts for example in inputs for ts in example["second_per_grid_ts"]]
+        prompt_inputs = super()._prepare_inputs(prompt_inputs)
 
-                
-        
-        input_copy = copy.deepcopy(inputs[0]['prompt'])
-        
-        input_copy = self.remove_none_from_data(input_copy)
-
-        video_base_path = os.environ.get('VIDEO_BASE_PATH', '')
-        video_path = inputs[0]['path']
-        if video_path.startswith('/'):
-            video_path = video_path[1:]  # Remove leading slash if exists
-        full_video_path = os.path.join(video_base_path, video_path)
-
-        if inputs[0]['data_type'] == 'image':
-            # input_copy[0]['content'][0]['image'] = os.getcwd() + "/Video-R1-data" + inputs[0]['path'][1:] 
-            input_copy[0]['content'][0]['video'] = full_video_path
-        elif inputs[0]['data_type'] == 'video':
-            # input_copy[0]['content'][0]['video'] = os.getcwd() + "/Video-R1-data" + inputs[0]['path'][1:] 
-            input_copy[0]['content'][0]['video'] = full_video_path
-        try:
-            image_inputs, video_inputs, video_kwargs = process_vision_info(input_copy, return_video_kwargs=True)
-        except Exception as e:
-            print(f"process_vision_info error, using fixed data, {e}")
-            if inputs[0]['data_type'] == 'image':
-                input_copy[0]['content'][0]['image'] = os.getcwd() + "/Video-R1-data" + '/Math/Multimath-300k/17ff4c7d14c388134de02381b1fc2824.png'
-            elif inputs[0]['data_type'] == 'video':
-                input_copy[0]['content'][0]['video'] = os.getcwd() + "/Video-R1-data" + '/LLaVA-Video-178K/liwei_youtube_videos/videos/youtube_video_2024/ytb_7nRmsEw7nsE.mp4'
-                
-            image_inputs, video_inputs, video_kwargs = process_vision_info(input_copy, return_video_kwargs=True)
-        
-        
-        prompt_inputs = self.processing_class(
-            text=copy.deepcopy(prompts_text),
-            images=image_inputs,
-            videos=video_inputs,
-            return_tensors="pt",
-            padding=True,
-            padding_side="left",
-            add_special_tokens=False,
+        if self.max_prompt_length is not None:
+            prompt_inputs["input_ids"] = prompt_inputs["input_ids"][:, -self.max_prompt_length :]
+            prompt_inputs["attention_mask"] = prompt_inputs["attention_mask"][:, -self.max_prompt_length :]
+
+        # Only the presence of the decoded media matters from here on, the patches replace them
+        image_inputs = [prompt_inputs["pixel_values"]] if "pixel_values" in prompt_inputs else None
+        video_inputs = [prompt_inputs["pixel_values_videos"]] if "pixel_values_videos" in prompt_inputs else None
+        input_copy = self.remove_none_from_data(copy.deepcopy(inputs[0]['prompt']))
+        input_copy[0]['content'][0][inputs[0]['data_type']] = inputs[0]['path']
+        return prompts_text, prompt_inputs, image_inputs, video_inputs, input_copy
+
+    def _prepare_prompt_inputs(self, inputs):
+        prepared = ["input_ids" in example for example in inputs]
+        if all(prepared):
+            return self._prepare_compiled_prompt_inputs(inputs)
+        if any(prepared):
+            raise ValueError(
+                "The batch mixes examples that hold processor outputs with raw ones, every example of a step must go "
+                "through the same data collator"
+            )
+        prompts_text, prompt_inputs, image_inputs, video_inputs, input_copy = load_prompt_inputs(
+            inputs, self.processing_class, self.max_prompt_length
         )
-        
-        
         prompt_inputs = super()._prepare_inputs(prompt_inputs)
 
 
@@ -453,53 +476,173 @@ class Qwen2VLGRPOTrainer(Trainer):
             prompt_inputs["input_ids"] = prompt_inputs["input_ids"][:, -self.max_prompt_length :]
             prompt_inputs["attention_mask"] = prompt_inputs["attention_mask"][:, -self.max_prompt_length :]
 
-        prompt_ids, prompt_mask = prompt_inputs["input_ids"], prompt_inputs["attention_mask"]
+        return prompts_text, prompt_inputs, image_inputs, video_inputs, input_copy
 
-        
-        if self.max_prompt_length is not None:
-            prompt_ids = prompt_ids[:, -self.max_prompt_length :]
-            prompt_mask = prompt_mask[:, -self.max_prompt_length :]
+    def _compute_rewards_per_func(self, inputs, completion_ids, num_generations):
+        device = self.accelerator.device
+
+        # Decode the generated completions
+        completions = self.processing_class.batch_decode(completion_ids, skip_special_tokens=True)
+        if is_conversational(inputs[0]):
+            completions = [[{"role": "assistant", "content": completion}] for completion in completions]
             
-        if self.temporal and video_inputs:
-            indices = torch.randperm(video_inputs[0].size(0))
-            shuffled_video_inputs = [video_inputs[0][indices]]
-            shuffled_prompt_inputs = self.processing_class(
-                text=copy.deepcopy(prompts_text),
-                images=image_inputs,
-                videos=shuffled_video_inputs,
-                return_tensors="pt",
-                padding=True,
-                padding_side="left",
-                add_special_tokens=False,
+        # Compute the rewards
+        prompts = [x["prompt"] for x in inputs for _ in range(num_generations)]
+        rewards_per_func = torch.zeros(len(prompts), len(self.reward_funcs), device=device)
+        for i, (reward_func, reward_processing_class) in enumerate(
+            zip(self.reward_funcs, self.reward_processing_classes)
+        ):
+            # Repeat all input columns (but "prompt", "completion" and the processor outputs) to match the number of
+            # generations
+            reward_kwargs = {
+                key: [] for key in inputs[0].keys() if key not in ["prompt", "completion", *PROMPT_INPUT_KEYS]
+            }
+            for key in reward_kwargs:
+                for example in inputs:
+                    # Repeat each value in the column for `num_generations` times
+                    reward_kwargs[key].extend([example[key]] * num_generations)
+            output_reward_func = reward_func(prompts=prompts, completions=completions, **reward_kwargs)
+            rewards_per_func[:, i] = torch.tensor(output_reward_func, dtype=torch.float32, device=device)
+        return rewards_per_func
+
+    def _next_queued_prompt(self):
+        # Replacement prompts for dynamic sampling come from a per-rank queue over the training set, refilled with a
+        # fresh random order whenever it runs dry. They go through the data collator like the DataLoader batches, so
+        # with `prefetch_vision_inputs` they hold the processor outputs too.
+        if not self._prompt_queue:
+            generator = torch.Generator().manual_seed(
+                self.args.seed + self.accelerator.process_index + self.state.global_step
             )
-            shuffled_prompt_inputs = super()._prepare_inputs(shuffled_prompt_inputs)
-            shuffled_prompt_ids, shuffled_prompt_mask = shuffled_prompt_inputs["input_ids"], shuffled_prompt_inputs["attention_mask"]
-            if self.max_prompt_length is not None:
-                shuffled_prompt_ids = shuffled_prompt_ids[:, -self.max_prompt_length :]
-                shuffled_prompt_mask = shuffled_prompt_mask[:, -self.max_prompt_length :]
+            self._prompt_queue.extend(torch.randperm(len(self.train_dataset), generator=generator).tolist())
+        return self.data_collator([self.train_dataset[self._prompt_queue.popleft()]])[0]
+
+    def _generate_with_early_stop(self, unwrapped_model, inputs):
+        """
+        Generates the rollout groups in stages and replaces prompts whose partial group is already saturated.
+
+        After each stage in `self.dynamic_sampling_stages`, the partial group of every prompt still being generated is
+        scored. If all the rollouts of a prompt got the same reward, its group is predicted to be all-correct or
+        all-wrong (zero advantage), so its remaining rollouts and its policy/reference forwards are skipped and the
+        prompt is replaced with the next one from the prompt queue; the other prompts of the batch go on. Replacement
+        prompts are generated in the next attempt. The last attempt always completes its prompts to `num_generations`
+        rollouts, so every rank still runs exactly one forward per step.
+
+        Returns the final prompts, their prepared inputs and their completions, grouped by prompt in batch order.
+        """
+        inputs = list(inputs)
+        group_completions = [None] * len(inputs)
+        pending = list(range(len(inputs)))
+        prepared, prepared_slots = None, None
+        skipped_groups = 0
+        saved_rollouts = 0
+        for attempt in range(self.dynamic_sampling_max_resample + 1):
+            stages = self.dynamic_sampling_stages if attempt < self.dynamic_sampling_max_resample else []
+            active = pending
+            completions = {slot: [] for slot in active}
+            num_rollouts = 0
+            for stage in stages + [self.num_generations]:
+                if prepared_slots != active:
+                    prepared = self._prepare_prompt_inputs([inputs[slot] for slot in active])
+                    prepared_slots = active
+                prompt_inputs = prepared[1]
+                prompt_length = prompt_inputs["input_ids"].size(1)
+                num_new = stage - num_rollouts
+                generation_config = copy.deepcopy(self.generation_config)
+                generation_config.num_return_sequences = num_new
+                prompt_completion_ids = unwrapped_model.generate(
+                    **prompt_inputs, generation_config=generation_config, synced_gpus=False
+                )
+                # `generate` returns the sequences of each prompt next to each other
+                new_completion_ids = prompt_completion_ids[:, prompt_length:]
+                for i, slot in enumerate(active):
+                    completions[slot].extend(new_completion_ids[i * num_new : (i + 1) * num_new])
+                num_rollouts = stage
+                if stage == self.num_generations:
+                    break
+
+                partial_completion_ids = pad(
+                    [ids for slot in active for ids in completions[slot]],
+                    padding_value=self.processing_class.pad_token_id,
+                )
+                rewards = self._compute_rewards_per_func(
+                    [inputs[slot] for slot in active], partial_completion_ids, stage
+                ).sum(dim=1).view(len(active), stage)
+                saturated = (rewards == rewards[:, :1]).all(dim=1).tolist()
+                for slot, is_saturated in zip(active, saturated):
+                    if is_saturated:
+                        skipped_groups += 1
+                        saved_rollouts += self.num_generations - stage
+                        inputs[slot] = self._next_queued_prompt()
+                active = [slot for slot, is_saturated in zip(active, saturated) if not is_saturated]
+                if not active:
+                    break
+
+            for slot in active:
+                group_completions[slot] = completions[slot]
+            pending = [slot for slot in pending if group_completions[slot] is None]
+            if not pending:
+                break
+
+        self._metrics["dynamic_sampling/skipped_groups"].append(skipped_groups)
+        self._metrics["dynamic_sampling/saved_rollouts"].append(saved_rollouts)
+
+        if prepared_slots != list(range(len(inputs))):
+            prepared = self._prepare_prompt_inputs(inputs)
+        completion_ids = pad(
+            [ids for completions in group_completions for ids in completions],
+            padding_value=self.processing_class.pad_token_id,
+        )
+        return inputs, prepared, completion_ids
+
+    def compute_loss(self, model, inputs, return_outputs=False, num_items_in_batch=None):
+        if return_outputs:
+            raise ValueError("The GRPOTrainer does not support returning outputs")
+    
+        
+        if not self.dynamic_sampling:
+            prompts_text, prompt_inputs, image_inputs, video_inputs, input_copy = self._prepare_prompt_inputs(inputs)
         
         
         # Generate completions
-        with unwrap_model_for_generation(model, self.accelerator) as unwrapped_model:
-            prompt_completion_ids = unwrapped_model.generate(**prompt_inputs, generation_config=self.generation_config)
+        # The full parameters are gathered on every rank for generation, so `generate` itself issues no collectives
+        # and ranks may run a different number of calls (image-only ranks skip the shuffled branch). `synced_gpus`,
+        # which transformers turns on under ZeRO-3, would all-reduce a "finished" flag at every decoding step and
+        # force image ranks to run a throwaway prefill just to match the shuffled-video call of the other ranks.
+        with unwrap_model_for_generation(
+            model, self.accelerator, gather_deepspeed3_params=True
+        ) as unwrapped_model:
+            if self.dynamic_sampling:
+                # Prompts are prepared inside the loop because saturated ones get replaced while the parameters are
+                # still gathered.
+                inputs, prepared, completion_ids = self._generate_with_early_stop(unwrapped_model, inputs)
+                prompts_text, prompt_inputs, image_inputs, video_inputs, input_copy = prepared
+                prompt_ids, prompt_mask = prompt_inputs["input_ids"], prompt_inputs["attention_mask"]
+                prompt_completion_ids = torch.cat(
+                    [prompt_ids.repeat_interleave(self.num_generations, dim=0), completion_ids], dim=1
+                )
+            else:
+                prompt_ids, prompt_mask = prompt_inputs["input_ids"], prompt_inputs["attention_mask"]
+                prompt_completion_ids = unwrapped_model.generate(
+                    **prompt_inputs, generation_config=self.generation_config, synced_gpus=False
+                )
             prompt_length = prompt_ids.size(1)
             prompt_ids = prompt_completion_ids[:, :prompt_length]
             completion_ids = prompt_completion_ids[:, prompt_length:]
             prompt_mask = prompt_mask.repeat_interleave(self.num_generations, dim=0)
             
-            if self.temporal:
-                
-                if video_inputs:
-            
-                    shuffled_prompt_completion_ids = unwrapped_model.generate(**shuffled_prompt_inputs, generation_config=self.shuffled_generation_config)
-                    shuffled_prompt_length = shuffled_prompt_ids.size(1)
-                    shuffled_prompt_ids = shuffled_prompt_completion_ids[:, :shuffled_prompt_length]
-                    shuffled_completion_ids = shuffled_prompt_completion_ids[:, shuffled_prompt_length:]
-                    shuffled_prompt_mask = prompt_mask.repeat_interleave(self.shuffled_num_generations, dim=0)
-                    
-                else:
-                    
-                    shuffled_prompt_completion_ids = unwrapped_model.generate(**prompt_inputs, generation_config=self.dummy_generation_config)
+            if self.temporal and video_inputs:
+                # The shuffled prompt only differs in the order of the video patches, so permute the already processed
+                # `pixel_values_videos` instead of tokenizing and patchifying the shuffled frames again.
+                shuffled_prompt_inputs = {
+                    **prompt_inputs,
+                    "pixel_values_videos": shuffle_video_patches(
+                        prompt_inputs["pixel_values_videos"], prompt_inputs["video_grid_thw"]
+                    ),
+                }
+                shuffled_prompt_completion_ids = unwrapped_model.generate(
+                    **shuffled_prompt_inputs, generation_config=self.shuffled_generation_config, synced_gpus=False
+                )
+                shuffled_completion_ids = shuffled_prompt_completion_ids[:, prompt_length:]
 
         
         print('path:', input_copy[0]['content'][0][inputs[0]['data_type']])   
@@ -526,45 +669,34 @@ class Qwen2VLGRPOTrainer(Trainer):
         
         prompt_inputs.pop("input_ids")
         prompt_inputs.pop("attention_mask")
-        
-        if inputs[0]['data_type'] == 'image':
-            prompt_inputs["pixel_values"] = prompt_inputs["pixel_values"].repeat(len(prompt_completion_ids), 1)
-            prompt_inputs["image_grid_thw"] = prompt_inputs["image_grid_thw"].repeat(len(prompt_completion_ids), 1)
-        # import pdb; pdb.set_trace()
-        
-
-        if inputs[0]['data_type'] == 'video':
-            prompt_inputs["pixel_values_videos"] = prompt_inputs["pixel_values_videos"].repeat(len(prompt_completion_ids), 1)
-            prompt_inputs["video_grid_thw"] = prompt_inputs["video_grid_thw"].repeat(len(prompt_completion_ids), 1)
-            if 'second_per_grid_ts' in prompt_inputs:
-                del prompt_inputs["second_per_grid_ts"]
-                # prompt_inputs["second_per_grid_ts"] = torch.tensor(prompt_inputs["second_per_grid_ts"]).repeat(len(prompt_completion_ids), 1)
-        
-        
-        
+        if 'second_per_grid_ts' in prompt_inputs:
+            del prompt_inputs["second_per_grid_ts"]
         
         try:
-            per_token_logps = self._get_per_token_logps(model, prompt_completion_ids, **prompt_inputs)
-            per_token_logps = per_token_logps[:, prompt_length - 1 :]
+            per_token_logps = self._get_completion_logps(
+                model, prompt_completion_ids, prompt_length, completion_mask, prompt_inputs
+            )
         except Exception as e:
             print(f"Error computing per_token_logps: {e}. Setting output to zero.")
-            # per_token_logps = torch.tensor(0.0, device=prompt_completion_ids.device, requires_grad=True)
-            per_token_logps = self._get_per_token_logps(model, prompt_completion_ids)
+            per_token_logps = self._get_completion_logps(model, prompt_completion_ids, prompt_length, completion_mask, {})
         
         with torch.inference_mode():
             try:
                 if self.ref_model is not None:
-                    ref_per_token_logps = self._get_per_token_logps(self.ref_model, prompt_completion_ids, **prompt_inputs)
+                    ref_per_token_logps = self._get_completion_logps(
+                        self.ref_model, prompt_completion_ids, prompt_length, completion_mask, prompt_inputs
+                    )
                 else:
                     with self.accelerator.unwrap_model(model).disable_adapter():
-                        ref_per_token_logps = self._get_per_token_logps(model, prompt_completion_ids, **prompt_inputs)
-                ref_per_token_logps = ref_per_token_logps[:, prompt_length - 1 :]
+                        ref_per_token_logps = self._get_completion_logps(
+                            model, prompt_completion_ids, prompt_length, completion_mask, prompt_inputs
+                        )
             except Exception as e:
                 print(f"Error computing ref_per_token_logps: {e}. Setting output to zero.")
-                # ref_per_token_logps = torch.tensor(0.0, device=prompt_completion_ids.device)
                 with self.accelerator.unwrap_model(model).disable_adapter():
-                    ref_per_token_logps = self._get_per_token_logps(model, prompt_completion_ids)
-                ref_per_token_logps = ref_per_token_logps[:, prompt_length - 1 :]
+                    ref_per_token_logps = self._get_completion_logps(
+                        model, prompt_completion_ids, prompt_length, completion_mask, {}
+                    )
 
         # Compute the KL divergence between the model and the reference model
         
@@ -572,45 +704,17 @@ class Qwen2VLGRPOTrainer(Trainer):
         per_token_kl = torch.exp(x_clamped) - x_clamped - 1
         
         if self.temporal and video_inputs:
-            shuffled_completions = self.processing_class.batch_decode(shuffled_completion_ids, skip_special_tokens=True)
-            if is_conversational(inputs[0]):
-                shuffled_completions = [[{"role": "assistant", "content": shuffled_completion}] for shuffled_completion in shuffled_completions]
-                
-            # Compute the rewards
-            shuffled_prompts = [prompt for prompt in prompts for _ in range(self.shuffled_num_generations)]
-            shuffled_rewards_per_func = torch.zeros(len(shuffled_prompts), len(self.reward_funcs), device=device)
-            for i, (reward_func, reward_processing_class) in enumerate(
-                zip(self.reward_funcs, self.reward_processing_classes)
-            ):
-                # Repeat all input columns (but "prompt" and "completion") to match the number of generations
-                shuffled_reward_kwargs = {key: [] for key in inputs[0].keys() if key not in ["prompt", "completion"]}
-                for key in shuffled_reward_kwargs:
-                    for example in inputs:
-                        # Repeat each value in the column for `num_generations` times
-                        shuffled_reward_kwargs[key].extend([example[key]] * self.shuffled_num_generations)
-                shuffled_output_reward_func = reward_func(prompts=shuffled_prompts, completions=shuffled_completions, **shuffled_reward_kwargs)
-                shuffled_rewards_per_func[:, i] = torch.tensor(shuffled_output_reward_func, dtype=torch.float32, device=device)
+            shuffled_rewards_per_func = self._compute_rewards_per_func(
+                inputs, shuffled_completion_ids, self.shuffled_num_generations
+            )
 
-        
-        # Decode the generated completions
-        completions = self.processing_class.batch_decode(completion_ids, skip_special_tokens=True)
-        if is_conversational(inputs[0]):
-            completions = [[{"role": "assistant", "content": completion}] for completion in completions]
-            
-        # Compute the rewards
-        prompts = [prompt for prompt in prompts for _ in range(self.num_generations)]
-        rewards_per_func = torch.zeros(len(prompts), len(self.reward_funcs), device=device)
-        for i, (reward_func, reward_processing_class) in enumerate(
-            zip(self.reward_funcs, self.reward_processing_classes)
-        ):
-            # Repeat all input columns (but "prompt" and "completion") to match the number of generations
-            reward_kwargs = {key: [] for key in inputs[0].keys() if key not in ["prompt", "completion"]}
-            for key in reward_kwargs:
-                for example in inputs:
-                    # Repeat each value in the column for `num_generations` times
-                    reward_kwargs[key].extend([example[key]] * self.num_generations)
-            output_reward_func = reward_func(prompts=prompts, completions=completions, **reward_kwargs)
-            rewards_per_func[:, i] = torch.tensor(output_reward_func, dtype=torch.float32, device=device)
+        rewards_per_func = self._compute_rewards_per_func(inputs, completion_ids, self.num_generations)
+        if self.reward_history is not None:
+            # Gather the group accuracies so the history, hence the sampled prompts, stay identical on all ranks
+            group_accuracy = rewards_per_func[:, 0].view(-1, self.num_generations).mean(dim=1).tolist()
+            self.reward_history.update(
+                gather_object([(example["problem_id"], accuracy) for example, accuracy in zip(inputs, group_accuracy)])
+            )
         
 
         
@@ -721,6 +825,19 @@ class Qwen2VLGRPOTrainer(Trainer):
 
         mean_kl = ((per_token_kl * completion_mask).sum(dim=1) / completion_mask.sum(dim=1)).mean()
         self._metrics["kl"].append(self.accelerator.gather_for_metrics(mean_kl).mean().item())
+        # Share of the completion positions in the forwards that are padding, with one bucket vs. the configured buckets
+        completion_lengths = completion_mask.sum(dim=1)
+        self._metrics["padding/completion_waste"].append(
+            padding_waste(completion_lengths, length_buckets(completion_lengths, 1))
+        )
+        self._metrics["padding/bucketed_waste"].append(
+            padding_waste(completion_lengths, length_buckets(completion_lengths, self.rollout_buckets))
+        )
+        if self.reward_history is not None:
+            sampler_stats = self.reward_history.stats()
+            self._metrics["difficulty_sampler/saturated_problems"].append(sampler_stats["saturated_problems"])
+            self._metrics["difficulty_sampler/seen_problems"].append(sampler_stats["seen_problems"])
+            self._metrics["difficulty_sampler/saved_rollouts"].append(sampler_stats["saved_draws"] * self.num_generations)
         
 
         return loss
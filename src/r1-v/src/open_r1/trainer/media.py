@@ -0,0 +1,97 @@
+import hashlib
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from qwen_vl_utils import fetch_image, fetch_video
+
+
+def media_reference(vision_info: dict, frame_order: torch.Tensor = None) -> dict:
+    """
+    Small, picklable stand-in for a decoded image or video, sent to the vLLM process instead of the pixels.
+
+    `vision_info` is the vision element of the conversation after `plan_vision_token_budget`, so it holds the path and
+    everything that decides the sampled frames and their size: decoding it again gives the same media. `frame_order`
+    is an optional frame permutation (see `video_frame_order`) applied after decoding.
+    """
+    return {
+        "info": vision_info,
+        "frame_order": frame_order.tolist() if frame_order is not None else None,
+    }
+
+
+def media_hash(reference: dict) -> str:
+    """Stable hash of a media reference, equal for references that decode to the same pixels in the same order."""
+    return hashlib.sha256(json.dumps(reference, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class MediaCache:
+    """
+    Decodes media references in the vLLM process, keeping the last `max_entries` decoded items.
+
+    Entries are keyed by the planned vision element, so the normal and the temporally shuffled rollouts of a prompt
+    decode its video once, and media already decoded by the local rank can be handed over with [`~MediaCache.put`].
+    [`~MediaCache.load_many`] decodes the misses of a whole generation batch on `num_workers` threads (the video
+    readers release the GIL), and [`~MediaCache.clear`] drops the decoded pixels once they are no longer needed.
+    """
+
+    def __init__(self, max_entries: int = 8, num_workers: int = 8):
+        self.max_entries = max_entries
+        self.num_workers = num_workers
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(vision_info: dict) -> str:
+        return media_hash({"info": vision_info})
+
+    def put(self, reference: dict, media) -> None:
+        self._entries[self._key(reference["info"])] = media
+        self._entries.move_to_end(self._key(reference["info"]))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    @staticmethod
+    def _decode(info: dict):
+        return fetch_video(info) if "video" in info else fetch_image(info)
+
+    @staticmethod
+    def _reorder(media, reference: dict):
+        if reference["frame_order"] is not None:
+            media = media[torch.tensor(reference["frame_order"])]
+        return media
+
+    def load(self, reference: dict):
+        return self.load_many([reference])[0]
+
+    def load_many(self, references: list) -> list:
+        """
+        Decoded media of every reference, in order. Each distinct vision element that is not cached is decoded once,
+        in parallel with the other misses; lookups served by the cache or by an earlier reference count as hits.
+        """
+        keys = [self._key(reference["info"]) for reference in references]
+        decoded = {}
+        misses = {}
+        for key, reference in zip(keys, references):
+            if key in decoded or key in misses:
+                self.hits += 1
+            elif key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                decoded[key] = self._entries[key]
+            else:
+                self.misses += 1
+                misses[key] = reference
+        if misses:
+            with ThreadPoolExecutor(max_workers=min(self.num_workers, len(misses))) as executor:
+                futures = {key: executor.submit(self._decode, reference["info"]) for key, reference in misses.items()}
+            for key, future in futures.items():
+                decoded[key] = future.result()
+                self.put(misses[key], decoded[key])
+        return [self._reorder(decoded[key], reference) for key, reference in zip(keys, references)]
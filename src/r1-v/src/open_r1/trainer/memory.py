@@ -0,0 +1,58 @@
+import math
+from contextlib import contextmanager
+
+import torch
+
+
+class StepMemoryPlanner:
+    """
+    Reusable buffers and per-phase peak memory for the tensors of a GRPO step.
+
+    The completion ids and the reference log probabilities change shape every step with the longest completion. Each
+    [`~StepMemoryPlanner.buffer`] is allocated once at its maximum shape and then handed out as a view of the current
+    shape, so the caching allocator keeps reusing the same block instead of splitting new ones, which is what the
+    per-step `gc.collect()` / `torch.cuda.empty_cache()` calls used to work around.
+
+    [`~StepMemoryPlanner.phase`] resets the CUDA peak memory statistics on entry and records the peak allocated and
+    reserved memory (in GiB) on exit; [`~StepMemoryPlanner.pop_metrics`] returns them as `memory/<phase>_*` metrics.
+
+    Args:
+        device (`torch.device`):
+            Device the buffers are allocated on.
+    """
+
+    def __init__(self, device: torch.device):
+        self.device = torch.device(device)
+        self.track_memory = self.device.type == "cuda"
+        self._buffers = {}
+        self._metrics = {}
+
+    def buffer(self, name: str, shape: tuple, dtype: torch.dtype, max_shape: tuple = None) -> torch.Tensor:
+        """
+        Uninitialized tensor of `shape`, a view of the `name` buffer. The buffer is allocated at `max_shape` (or
+        `shape`) the first time, and only reallocated if a later request does not fit. The returned view is valid until
+        the next call with the same `name`.
+        """
+        numel = math.prod(shape)
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.dtype != dtype or buffer.numel() < numel:
+            capacity = max(numel, math.prod(max_shape) if max_shape is not None else 0)
+            buffer = torch.empty(capacity, dtype=dtype, device=self.device)
+            self._buffers[name] = buffer
+        return buffer[:numel].view(shape)
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.track_memory:
+            yield
+            return
+        torch.cuda.reset_peak_memory_stats(self.device)
+        try:
+            yield
+        finally:
+            self._metrics[f"memory/{name}_peak_allocated_gb"] = torch.cuda.max_memory_allocated(self.device) / 2**30
+            self._metrics[f"memory/{name}_peak_reserved_gb"] = torch.cuda.max_memory_reserved(self.device) / 2**30
+
+    def pop_metrics(self) -> dict:
+        metrics, self._metrics = self._metrics, {}
+        return metrics
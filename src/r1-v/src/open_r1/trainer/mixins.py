@@ -0,0 +1,46 @@
+import os
+
+from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR, get_last_checkpoint
+
+from .sampler import DifficultyAwareSampler
+from .streaming import JsonlStream, stream_dataloader
+
+
+class GRPODataMixin:
+    """
+    Training-data overrides shared by the GRPO trainers, to be listed before `Trainer` in the bases.
+
+    Draws prompts with a [`DifficultyAwareSampler`] when `self.reward_history` (a [`ProblemRewardHistory`] or `None`)
+    is set, reads a [`JsonlStream`] through its own per-rank DataLoader, saves the reward history with every
+    checkpoint, and restores both the reward history and the stream position when training resumes.
+    """
+
+    def _get_train_sampler(self, *args, **kwargs):
+        if self.reward_history is None:
+            return super()._get_train_sampler(*args, **kwargs)
+        return DifficultyAwareSampler(self.reward_history, num_samples=len(self.train_dataset), seed=self.args.seed)
+
+    def get_train_dataloader(self):
+        if isinstance(self.train_dataset, JsonlStream):
+            return stream_dataloader(self.train_dataset, self.args, self.data_collator, self._train_batch_size)
+        return super().get_train_dataloader()
+
+    def _save_checkpoint(self, model, trial, *args, **kwargs):
+        super()._save_checkpoint(model, trial, *args, **kwargs)
+        if self.reward_history is not None and self.args.should_save:
+            checkpoint_folder = f"{PREFIX_CHECKPOINT_DIR}-{self.state.global_step}"
+            self.reward_history.save(os.path.join(self._get_output_dir(trial=trial), checkpoint_folder))
+
+    def train(self, resume_from_checkpoint=None, *args, **kwargs):
+        # The reward history and the stream position are not part of the Trainer state, so restore them before the
+        # first batch is drawn
+        checkpoint = resume_from_checkpoint
+        if isinstance(checkpoint, bool) and checkpoint:
+            checkpoint = get_last_checkpoint(self.args.output_dir)
+        if self.reward_history is not None and checkpoint:
+            self.reward_history.load(checkpoint)
+        if isinstance(self.train_dataset, JsonlStream) and checkpoint:
+            self.train_dataset.resume(
+                checkpoint, self.args.per_device_train_batch_size * self.args.gradient_accumulation_steps
+            )
+        return super().train(resume_from_checkpoint, *args, **kwargs)
@@ -0,0 +1,141 @@
+import os
+
+import torch
+from torch.utils.data import Sampler
+
+
+class ProblemRewardHistory:
+    """
+    Keeps the last `history_size` group accuracies of every `problem_id` in a single tensor.
+
+    A problem is *saturated* once its history is full and every entry is solved (`>= solved_threshold`) or every entry
+    is unsolved (`<= unsolved_threshold`): its rollout groups are then expected to have zero advantage, so sampling it
+    again mostly wastes rollout compute. The history is kept identical on every rank (updates are gathered first) and is
+    saved with each checkpoint.
+
+    Args:
+        problem_ids (`list`):
+            The `problem_id` column of the training dataset, one entry per dataset index.
+        history_size (`int`, *optional*, defaults to `4`):
+            Number of most recent group accuracies kept per problem.
+        saturated_weight (`float`, *optional*, defaults to `0.1`):
+            Relative sampling weight of saturated problems (non-saturated problems have weight `1.0`).
+    """
+
+    file_name = "reward_history.pt"
+
+    def __init__(
+        self,
+        problem_ids: list,
+        history_size: int = 4,
+        saturated_weight: float = 0.1,
+        solved_threshold: float = 1.0,
+        unsolved_threshold: float = 0.0,
+    ):
+        self.history_size = history_size
+        self.saturated_weight = saturated_weight
+        self.solved_threshold = solved_threshold
+        self.unsolved_threshold = unsolved_threshold
+
+        self.problem_rows = {}
+        rows = [self.problem_rows.setdefault(problem_id, len(self.problem_rows)) for problem_id in problem_ids]
+        self.index_rows = torch.tensor(rows, dtype=torch.long)
+        self.rewards = torch.full((len(self.problem_rows), history_size), float("nan"), dtype=torch.float16)
+        self.num_updates = torch.zeros(len(self.problem_rows), dtype=torch.long)
+        # Expected number of draws that uniform sampling would have spent on saturated problems on top of ours
+        self.saved_draws = 0.0
+
+    def update(self, problem_rewards: list[tuple]) -> None:
+        """Appends `(problem_id, group_accuracy)` pairs, overwriting the oldest entry of each problem."""
+        for problem_id, reward in problem_rewards:
+            row = self.problem_rows.get(problem_id)
+            if row is None:
+                continue
+            self.rewards[row, self.num_updates[row] % self.history_size] = reward
+            self.num_updates[row] += 1
+
+    def saturated(self) -> torch.Tensor:
+        """Boolean mask over problems whose full history is all solved or all unsolved."""
+        full = ~self.rewards.isnan().any(dim=1)
+        solved = (self.rewards >= self.solved_threshold).all(dim=1)
+        unsolved = (self.rewards <= self.unsolved_threshold).all(dim=1)
+        return full & (solved | unsolved)
+
+    def weights(self) -> torch.Tensor:
+        """Sampling weight of every dataset index."""
+        problem_weights = torch.where(self.saturated(), self.saturated_weight, 1.0)
+        weights = problem_weights[self.index_rows]
+        if weights.sum() <= 0:
+            return torch.ones_like(weights)
+        return weights
+
+    def record_draws(self, num_draws: int) -> None:
+        saturated = self.saturated()[self.index_rows].float()
+        weights = self.weights()
+        uniform_fraction = saturated.mean().item()
+        weighted_fraction = ((weights * saturated).sum() / weights.sum()).item()
+        self.saved_draws += num_draws * (uniform_fraction - weighted_fraction)
+
+    def stats(self) -> dict[str, float]:
+        saturated = self.saturated()
+        return {
+            "saturated_problems": saturated.float().mean().item(),
+            "seen_problems": (self.num_updates > 0).float().mean().item(),
+            "saved_draws": self.saved_draws,
+        }
+
+    def state_dict(self) -> dict:
+        return {
+            "problem_ids": list(self.problem_rows),
+            "rewards": self.rewards,
+            "num_updates": self.num_updates,
+            "saved_draws": self.saved_draws,
+        }
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        # Match rows by problem id, so a checkpoint stays usable if the dataset was reordered or filtered
+        for old_row, problem_id in enumerate(state_dict["problem_ids"]):
+            row = self.problem_rows.get(problem_id)
+            if row is not None:
+                self.rewards[row] = state_dict["rewards"][old_row]
+                self.num_updates[row] = state_dict["num_updates"][old_row]
+        self.saved_draws = state_dict["saved_draws"]
+
+    def save(self, output_dir: str) -> None:
+        torch.save(self.state_dict(), os.path.join(output_dir, self.file_name))
+
+    def load(self, checkpoint_dir: str) -> None:
+        path = os.path.join(checkpoint_dir, self.file_name)
+        if os.path.isfile(path):
+            self.load_state_dict(torch.load(path))
+
+
+class DifficultyAwareSampler(Sampler):
+    """
+    Samples dataset indices with replacement, with weights taken from a [`ProblemRewardHistory`].
+
+    Indices are drawn lazily in chunks of `chunk_size`, so the weights follow the reward history during the epoch.
+    Every rank uses the same seed and sees the same history, hence draws the same sequence, which lets accelerate shard
+    it across ranks like any other sampler.
+    """
+
+    def __init__(self, history: ProblemRewardHistory, num_samples: int, seed: int = 0, chunk_size: int = 64):
+        self.history = history
+        self.num_samples = num_samples
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.epoch = 0
+
+    def __iter__(self):
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        self.epoch += 1
+        remaining = self.num_samples
+        while remaining > 0:
+            num_draws = min(self.chunk_size, remaining)
+            indices = torch.multinomial(self.history.weights(), num_draws, replacement=True, generator=generator)
+            self.history.record_draws(num_draws)
+            remaining -= num_draws
+            yield from indices.tolist()
+
+    def __len__(self):
+        return self.num_samples
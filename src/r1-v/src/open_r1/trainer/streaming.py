@@ -0,0 +1,130 @@
+import json
+import os
+import random
+
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+
+
+class JsonlStream(IterableDataset):
+    """
+    Streams the examples of a JSONL file without loading it, so startup time and host memory do not grow with its size.
+
+    The file is split into `world_size` byte ranges and a line belongs to the range its first byte is in, so each rank
+    only ever reads and parses its own share. Within a rank, line offsets go through a shuffle buffer of
+    `shuffle_buffer` entries seeded with `(seed, rank, epoch)`. The stream repeats over epochs until the Trainer reaches
+    `max_steps`.
+
+    Since the per-rank sequence is deterministic, resuming only needs the number of examples the rank already consumed
+    (see [`~JsonlStream.resume`]): those are skipped by offset, without being parsed or collated again. Lines dropped
+    by `transform` count as consumed too, so a resume repeats as many examples as were dropped.
+
+    The stream must be read from the main process (`dataloader_num_workers=0`). With several DataLoader workers, each
+    one fills whole batches from its own share of the sequence, so the examples consumed after `global_step` steps are
+    no longer the first `global_step * examples_per_step` ones and the resume offset would skip the wrong examples.
+
+    Args:
+        path (`str`):
+            Path to the `.jsonl` file.
+        rank (`int`, *optional*, defaults to `0`):
+            Index of the byte range read by this process.
+        world_size (`int`, *optional*, defaults to `1`):
+            Number of byte ranges the file is split into.
+        shuffle_buffer (`int`, *optional*, defaults to `1000`):
+            Number of examples the shuffle draws from. `1` or less keeps the file order.
+        seed (`int`, *optional*, defaults to `42`):
+            Seed of the shuffle.
+        transform (`Callable`, *optional*):
+            Applied to every parsed example. Examples it returns `None` for are dropped.
+    """
+
+    trainer_state_name = "trainer_state.json"
+
+    def __init__(self, path, rank=0, world_size=1, shuffle_buffer=1000, seed=42, transform=None):
+        if not 0 <= rank < world_size:
+            raise ValueError(f"rank must be in [0, {world_size}), got {rank}")
+        self.path = path
+        self.rank = rank
+        self.world_size = world_size
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.transform = transform
+        self.start_index = 0
+
+        size = os.path.getsize(path)
+        self.byte_range = (size * rank // world_size, size * (rank + 1) // world_size)
+
+    def _line_offsets(self):
+        start, end = self.byte_range
+        with open(self.path, "rb") as f:
+            if start > 0:
+                # Skip the line that started in the previous range
+                f.seek(start - 1)
+                f.readline()
+            while f.tell() < end:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                if line.strip():
+                    yield offset
+
+    def _shuffled(self, offsets, rng):
+        if self.shuffle_buffer <= 1:
+            yield from offsets
+            return
+        buffer = []
+        for offset in offsets:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(offset)
+                continue
+            index = rng.randrange(len(buffer))
+            yield buffer[index]
+            buffer[index] = offset
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def __iter__(self):
+        if get_worker_info() is not None:
+            raise RuntimeError("JsonlStream cannot be resumed by offset when split across DataLoader workers, "
+                               "please set --dataloader_num_workers 0")
+
+        index = 0
+        epoch = 0
+        with open(self.path, "rb") as f:
+            while True:
+                rng = random.Random(f"{self.seed}-{self.rank}-{epoch}")
+                num_lines = 0
+                for offset in self._shuffled(self._line_offsets(), rng):
+                    num_lines += 1
+                    index += 1
+                    if index <= self.start_index:
+                        continue
+                    f.seek(offset)
+                    example = json.loads(f.readline())
+                    if self.transform is not None:
+                        example = self.transform(example)
+                    if example is not None:
+                        yield example
+                if num_lines == 0:
+                    return  # Empty range, nothing to repeat
+                epoch += 1
+
+    def resume(self, checkpoint, examples_per_step):
+        """Skips the examples this rank consumed before `checkpoint`, read from its `trainer_state.json`."""
+        with open(os.path.join(checkpoint, self.trainer_state_name), encoding="utf-8") as f:
+            global_step = json.load(f)["global_step"]
+        self.start_index = global_step * examples_per_step
+
+
+def stream_dataloader(dataset, args, data_collator, batch_size):
+    """
+    DataLoader over a [`JsonlStream`]. It is not passed through `accelerator.prepare`, which would wrap the stream in
+    an `IterableDatasetShard` and split the rank's share across the ranks a second time. The stream is read in the
+    main process, see [`JsonlStream`].
+    """
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        collate_fn=data_collator,
+        pin_memory=args.dataloader_pin_memory,
+    )
@@ -0,0 +1,96 @@
+import torch
+
+from qwen_vl_utils.vision_process import FRAME_FACTOR
+
+
+def shuffle_video_frames(video: torch.Tensor, group_size: int = FRAME_FACTOR) -> torch.Tensor:
+    """Shuffle a (T, C, H, W) video in groups of `group_size` consecutive frames.
+
+    Qwen2-VL processors fuse every `FRAME_FACTOR` consecutive frames into one temporal patch, so shuffling whole
+    groups keeps every temporal patch intact, exactly like `shuffle_video_patches` does on patchified inputs.
+    """
+    return video[video_frame_order(video.size(0), group_size)]
+
+
+def video_frame_order(num_frames: int, group_size: int = FRAME_FACTOR) -> torch.Tensor:
+    """Random frame permutation used by `shuffle_video_frames`, so it can be sent instead of the shuffled video."""
+    num_groups = num_frames // group_size
+    order = torch.randperm(num_groups)
+    indices = (order.unsqueeze(1) * group_size + torch.arange(group_size)).flatten()
+    # Trailing frames that do not fill a whole group keep their position
+    tail = torch.arange(num_groups * group_size, num_frames)
+    return torch.cat([indices, tail])
+
+
+def shuffle_video_patches(pixel_values_videos: torch.Tensor, video_grid_thw: torch.Tensor) -> torch.Tensor:
+    """Shuffle the temporal order of videos that were already patchified by the processor.
+
+    `pixel_values_videos` stores every video as `grid_t` consecutive blocks of `grid_h * grid_w` patches, one block
+    per temporal patch of `FRAME_FACTOR` frames. Permuting whole blocks gives the same tensor as running the processor
+    again on group-shuffled frames, and since the number of video tokens does not depend on the frame order the
+    prompt `input_ids` can be reused as they are.
+    """
+    shuffled = torch.empty_like(pixel_values_videos)
+    offset = 0
+    for grid_t, grid_h, grid_w in video_grid_thw.tolist():
+        num_patches = grid_t * grid_h * grid_w
+        video = pixel_values_videos[offset : offset + num_patches].view(grid_t, grid_h * grid_w, -1)
+        order = torch.randperm(grid_t, device=video.device)
+        shuffled[offset : offset + num_patches] = video[order].view(num_patches, -1)
+        offset += num_patches
+    return shuffled
+
+
+VISION_INPUT_KEYS = ("pixel_values", "image_grid_thw", "pixel_values_videos", "video_grid_thw")
+
+
+def repeat_vision_inputs(vision_inputs: dict, num_repeats: int) -> dict:
+    """Repeats the vision tensors of a single prompt for `num_repeats` rollouts of that prompt."""
+    return {
+        key: value.repeat(num_repeats, 1) if key in VISION_INPUT_KEYS else value
+        for key, value in vision_inputs.items()
+    }
+
+
+def length_buckets(lengths: torch.Tensor, num_buckets: int) -> list[torch.Tensor]:
+    """
+    Splits row indices into `min(num_buckets, len(lengths))` buckets of rows with similar lengths, longest first.
+
+    The number of buckets only depends on the number of rows, never on the lengths themselves, so ranks that hold the
+    same number of rollouts run the same number of forwards, as ZeRO-3 requires.
+    """
+    order = torch.argsort(lengths, descending=True)
+    return list(order.tensor_split(min(num_buckets, len(order))))
+
+
+def padding_waste(lengths: torch.Tensor, buckets: list[torch.Tensor]) -> float:
+    """Fraction of the computed positions that are padding when every bucket is padded to its longest row."""
+    computed = sum(len(rows) * lengths[rows].max().item() for rows in buckets)
+    return 1 - lengths.sum().item() / max(computed, 1)
+
+
+def completion_logps(
+    per_token_logps_fn, model, prompt_completion_ids, prompt_length, completion_mask, vision_inputs, num_buckets,
+    out=None,
+):
+    """
+    Per-token log probabilities of the completions, computed one completion-length bucket at a time.
+
+    Every bucket (see [`length_buckets`]) is cut to its own longest completion, so a single long rollout no longer
+    makes the forward pay for padding on all the others. All rows share the same prompt, hence `vision_inputs` are the
+    (not repeated) vision tensors of that prompt. `per_token_logps_fn(model, input_ids, **vision_inputs)` is the
+    trainer's forward, returning the log probabilities of `input_ids[:, 1:]`. If given, `out` receives the result
+    instead of a new tensor.
+    """
+    completion_lengths = completion_mask.sum(dim=1)
+    per_token_logps = out.zero_() if out is not None else None
+    for rows in length_buckets(completion_lengths, num_buckets):
+        width = prompt_length + int(completion_lengths[rows].max())
+        logps = per_token_logps_fn(
+            model, prompt_completion_ids[rows, :width], **repeat_vision_inputs(vision_inputs, len(rows))
+        )
+        if per_token_logps is None:
+            per_token_logps = logps.new_zeros(completion_mask.shape)
+        # Get rid of the prompt (-1 because of the shift done in get_per_token_logps)
+        per_token_logps[rows, : width - prompt_length] = logps[:, prompt_length - 1 :]
+    return per_token_logps
@@ -67,20 +67,27 @@ if is_peft_available():
 
 if is_vllm_available():
     from vllm import LLM, SamplingParams
+    from vllm.utils import Device
 
 if is_wandb_available():
     import wandb
 import torch.nn as nn
 from torch.utils.data import Sampler
-import gc
-from qwen_vl_utils import process_vision_info
+from qwen_vl_utils import extract_vision_info, plan_vision_token_budget, process_vision_info
+
+from .collator import PROMPT_INPUT_KEYS, vision_token_budget
+from .media import MediaCache, media_hash, media_reference
+from .memory import StepMemoryPlanner
+from .mixins import GRPODataMixin
+from .sampler import ProblemRewardHistory
+from .utils import completion_logps, length_buckets, padding_waste, video_frame_order
 
 # What we call a reward function is a callable that takes a list of prompts and completions and returns a list of
 # rewards. When it's a string, it's a model ID, so it's loaded as a pretrained model.
 RewardFunc = Union[str, PreTrainedModel, Callable[[list, list], list[float]]]
 
 
-class Qwen2VLGRPOVLLMTrainerModified(Trainer):
+class Qwen2VLGRPOVLLMTrainerModified(GRPODataMixin, Trainer):
     def __init__(
         self,
         model: Union[str, PreTrainedModel],
@@ -286,6 +293,31 @@ class Qwen2VLGRPOVLLMTrainerModified(Trainer):
         )
         self.len_control = script_args.len_control
         self.beta = args.beta
+        if script_args.dynamic_sampling:
+            raise ValueError(
+                "GRPOVLLMTrainerModified does not support dynamic sampling, please set --use_vllm False"
+            )
+
+        # Split the policy and reference forwards into completion-length buckets to cut padding
+        if script_args.rollout_buckets < 1:
+            raise ValueError(f"rollout_buckets must be at least 1, got {script_args.rollout_buckets}")
+        self.rollout_buckets = script_args.rollout_buckets
+        # Ranks send media references to the main process, which decodes them for vLLM with its own cache, in
+        # parallel, and drops them once the step's rollouts are generated
+        self.media_cache = MediaCache(
+            max_entries=self.accelerator.num_processes, num_workers=max(self.accelerator.num_processes, 1)
+        )
+        self.memory_planner = StepMemoryPlanner(self.accelerator.device)
+
+        # Difficulty-aware sampling: down-weight prompts that are always or never solved
+        if script_args.difficulty_sampling:
+            self.reward_history = ProblemRewardHistory(
+                train_dataset["problem_id"],
+                history_size=script_args.difficulty_history_size,
+                saturated_weight=script_args.difficulty_saturated_weight,
+            )
+        else:
+            self.reward_history = None
 
         # The trainer estimates the number of FLOPs (floating-point operations) using the number of elements in the
         # input tensor associated with the key "input_ids". However, in GRPO, the sampled data does not include the
@@ -423,11 +455,88 @@ class Qwen2VLGRPOVLLMTrainerModified(Trainer):
         # Compute the log probabilities for the input tokens. Use a loop to reduce memory peak.
         per_token_logps = []
         for logits_row, input_ids_row in zip(logits, input_ids):
-            log_probs = logits_row.log_softmax(dim=-1)
-            token_log_prob = torch.gather(log_probs, dim=1, index=input_ids_row.unsqueeze(1)).squeeze(1)
-            per_token_logps.append(token_log_prob)
+            # log_softmax at the input tokens only, so the backward does not keep a (L, V) log-probability tensor per row
+            token_logits = torch.gather(logits_row, dim=1, index=input_ids_row.unsqueeze(1)).squeeze(1)
+            per_token_logps.append(token_logits - torch.logsumexp(logits_row, dim=-1))
         return torch.stack(per_token_logps)
 
+    def _get_completion_logps(
+        self, model, prompt_completion_ids, prompt_length, completion_mask, vision_inputs, out=None
+    ):
+        """
+        Per-token log probabilities of the completions, one completion-length bucket at a time, see
+        `completion_logps`. If given, `out` receives the result instead of a new tensor.
+        """
+        return completion_logps(
+            self._get_per_token_logps, model, prompt_completion_ids, prompt_length, completion_mask, vision_inputs,
+            self.rollout_buckets, out=out,
+        )
+
+    def _build_prompt_completion_ids(self, prompt_ids, completion_ids):
+        """Repeats the prompt in front of every right-padded completion, in the step's reusable planner buffer."""
+        num_completions, prompt_length = len(completion_ids), prompt_ids.size(1)
+        completion_length = max(len(ids) for ids in completion_ids)
+        max_prompt_length = self.max_prompt_length if self.max_prompt_length is not None else prompt_length
+        prompt_completion_ids = self.memory_planner.buffer(
+            "prompt_completion_ids",
+            (num_completions, prompt_length + completion_length),
+            torch.long,
+            max_shape=(num_completions, max_prompt_length + self.max_completion_length),
+        )
+        # Completions are grouped by prompt: [prompt1_gen1, ..., prompt1_genN, prompt2_gen1, ...]
+        prompt_completion_ids[:, :prompt_length] = prompt_ids.repeat_interleave(self.num_generations, dim=0)
+        prompt_completion_ids[:, prompt_length:] = pad(
+            [torch.tensor(ids, dtype=torch.long, device=prompt_completion_ids.device) for ids in completion_ids],
+            padding_value=self.processing_class.pad_token_id,
+        )
+        return prompt_completion_ids
+
+    def _generate_rollouts(self, requests):
+        """
+        Generates the completions of `(prompt, data_type, media_reference, n)` requests in a single vLLM call.
+
+        Requests with the same prompt and the same media hash (e.g. a prompt drawn on several ranks) are merged into one
+        request with the sum of their `n`, whose completions are split back in order, so each distinct prompt is
+        prefilled once and its vision encoder inputs are decoded once. The hash is only a key on this side: the vLLM
+        0.7.2 V0 engine takes no media hash with a request, and the prefix cache is reset on every weight load, so
+        there is no reuse to get across steps, only within this call. The media missing from the cache are decoded in
+        parallel, and the cache is cleared after generation so decoded videos do not outlive the step. Returns one list
+        of `n` token id sequences per request.
+        """
+        groups = {}
+        for index, (prompt, data_type, reference, n) in enumerate(requests):
+            groups.setdefault((prompt, data_type, media_hash(reference)), []).append(index)
+
+        media_hits, media_misses = self.media_cache.hits, self.media_cache.misses
+        media = self.media_cache.load_many([requests[indices[0]][2] for indices in groups.values()])
+        vllm_inputs, sampling_params = [], []
+        for ((prompt, data_type, _), indices), group_media in zip(groups.items(), media):
+            vllm_inputs.append({"prompt": prompt, "multi_modal_data": {data_type: [group_media]}})
+            params = copy.deepcopy(self.sampling_params)
+            params.n = sum(requests[index][3] for index in indices)
+            sampling_params.append(params)
+        outputs = self.llm.generate(vllm_inputs, sampling_params=sampling_params, use_tqdm=False)
+        del media, vllm_inputs
+        self.media_cache.clear()
+
+        completion_ids = [None] * len(requests)
+        for indices, output in zip(groups.values(), outputs):
+            token_ids = [out.token_ids for out in output.outputs]
+            offset = 0
+            for index in indices:
+                completion_ids[index] = token_ids[offset : offset + requests[index][3]]
+                offset += requests[index][3]
+
+        # Only the main process generates, so these are logged from there
+        self._metrics["rollout/deduplicated_requests"].append(len(requests) - len(groups))
+        media_lookups = self.media_cache.hits + self.media_cache.misses - media_hits - media_misses
+        self._metrics["rollout/media_cache_hit_rate"].append((self.media_cache.hits - media_hits) / max(media_lookups, 1))
+        schedulers = getattr(self.llm.llm_engine, "scheduler", None)
+        if schedulers:
+            # Running hit rate of the V0 block manager since the last prefix cache reset
+            self._metrics["rollout/prefix_cache_hit_rate"].append(schedulers[0].get_prefix_cache_hit_rate(Device.GPU))
+        return completion_ids
+
     # Trainer "prepares" the inputs before calling `compute_loss`. It converts to tensor and move to device.
     # Since we preprocess the data in `compute_loss`, we need to override this method to skip this step.
     def _prepare_inputs(
@@ -475,7 +584,13 @@ class Qwen2VLGRPOVLLMTrainerModified(Trainer):
             input_copy[0]['content'][0]['video'] = os.getcwd() + "/Video-R1-data" + inputs[0]['path'][1:] 
         
         
-        image_inputs, video_inputs, video_kwargs = process_vision_info(input_copy, return_video_kwargs=True)
+        max_vision_tokens = vision_token_budget(self.processing_class, prompts_text, self.max_prompt_length)
+        image_inputs, video_inputs, video_kwargs = process_vision_info(
+            input_copy, return_video_kwargs=True, max_vision_tokens=max_vision_tokens
+        )
+        vision_info = extract_vision_info(input_copy)[0]
+        if max_vision_tokens is not None:
+            vision_info = plan_vision_token_budget([vision_info], max_vision_tokens)[0]
         
         
         prompt_inputs = self.processing_class(
@@ -488,7 +603,8 @@ class Qwen2VLGRPOVLLMTrainerModified(Trainer):
             add_special_tokens=False,
         )
         
-        mm_data = [[data_type, image_inputs if image_inputs else video_inputs]]
+        mm_reference = media_reference(vision_info)
+        mm_data = [[data_type, mm_reference]]
         prompt_inputs = super()._prepare_inputs(prompt_inputs)
         prompt_ids, prompt_mask = prompt_inputs["input_ids"], prompt_inputs["attention_mask"]
         
@@ -499,23 +615,10 @@ class Qwen2VLGRPOVLLMTrainerModified(Trainer):
             
         if self.temporal:
             if video_inputs:
-                indices = torch.randperm(video_inputs[0].size(0))
-                shuffled_video_inputs = [video_inputs[0][indices]]
-                shuffled_prompt_inputs = self.processing_class(
-                    text=copy.deepcopy(prompts_text),
-                    images=image_inputs,
-                    videos=shuffled_video_inputs,
-                    return_tensors="pt",
-                    padding=True,
-                    padding_side="left",
-                    add_special_tokens=False,
-                )
-                shuffled_mm_data = [[self.accelerator.process_index, data_type, image_inputs if image_inputs else video_inputs]]
-                shuffled_prompt_inputs = super()._prepare_inputs(shuffled_prompt_inputs)
-                shuffled_prompt_ids, shuffled_prompt_mask = shuffled_prompt_inputs["input_ids"], shuffled_prompt_inputs["attention_mask"]
-                if self.max_prompt_length is not None:
-                    shuffled_prompt_ids = shuffled_prompt_ids[:, -self.max_prompt_length :]
-                    shuffled_prompt_mask = shuffled_prompt_mask[:, -self.max_prompt_length :]
+                # vLLM patchifies the frames itself and the prompt tokens do not depend on the frame order, so the
+                # shuffled branch only needs the frame order, applied to the same decoded video.
+                frame_order = video_frame_order(video_inputs[0].size(0))
+                shuffled_mm_data = [[self.accelerator.process_index, data_type, media_reference(vision_info, frame_order)]]
             else:
                 shuffled_mm_data = [None]
                     
@@ -524,7 +627,7 @@ class Qwen2VLGRPOVLLMTrainerModified(Trainer):
         if self.args.use_vllm:
             # First, have main process load weights if needed
             if self.state.global_step != self._last_loaded_step:
-                with unwrap_model_for_generation(
+                with self.memory_planner.phase("weight_sync"), unwrap_model_for_generation(
                     self.model,
                     self.accelerator,
                     gather_deepspeed3_params=True,  # TODO: fix this, self.args.ds3_gather_for_generation,
@@ -540,63 +643,42 @@ class Qwen2VLGRPOVLLMTrainerModified(Trainer):
                     # import pdb
                     # pdb.set_trace()
                     llm_model.load_weights(state_dict.items())
+                    # Cached KV blocks were computed with the previous weights
+                    self.llm.reset_prefix_cache()
                 self._last_loaded_step = self.state.global_step
 
-            # Generate completions using vLLM: gather all prompts and use them in a single call in the main process
+            # Generate completions using vLLM: gather all prompts and use them in a single call in the main process.
+            # Only media references are gathered, the main process decodes them itself (its own media is cached as is).
             all_prompts_text = gather_object(prompts_text)
             all_mm_data = gather_object(mm_data)
-            # group into pairs
-            all_multimodal_inputs = []
-
-            if self.temporal: 
+            if self.accelerator.is_main_process:
+                self.media_cache.put(mm_reference, (image_inputs or video_inputs)[0])
+            if self.temporal:
                 shuffled_all_mm_data_none = gather_object(shuffled_mm_data)
                 shuffled_all_mm_data = [x for x in shuffled_all_mm_data_none if x]
-                shuffled_all_multimodal_inputs = []
 
-            # 2. Refer to TobiasLee's implementation suggestions
-            # this is a better implementation for vLLM sampling.
-            for prompt, mm_item in zip(all_prompts_text, all_mm_data):
-                all_multimodal_inputs.append({"prompt": prompt, "multi_modal_data": {mm_item[0]: mm_item[1]}})
-            
-            if self.temporal and shuffled_all_mm_data!=[]: 
-                for mm_item in shuffled_all_mm_data:    
-                    shuffled_all_multimodal_inputs.append({"prompt": all_prompts_text[mm_item[0]], "multi_modal_data": {mm_item[1]: mm_item[2]}})
-            
-            # Create sampling params with num_generations
             if self.accelerator.is_main_process:
-                # Clone to avoid modifying original params
-                sampling_params = copy.deepcopy(self.sampling_params)
-                sampling_params.n = self.num_generations
-                # Single generate call with all prompts
-                if self.accelerator.is_main_process:
-                    outputs = self.llm.generate(
-                        all_multimodal_inputs,
-                        sampling_params=sampling_params,
-                        use_tqdm=False,
-                    )
+                # One request per prompt with n=num_generations, then one per shuffled video with n=num_generations//2,
+                # all submitted together
+                rollout_requests = [
+                    (prompt, mm_item[0], mm_item[1], self.num_generations)
+                    for prompt, mm_item in zip(all_prompts_text, all_mm_data)
+                ]
+                if self.temporal:
+                    rollout_requests += [
+                        (all_prompts_text[mm_item[0]], mm_item[1], mm_item[2], self.num_generations // 2)
+                        for mm_item in shuffled_all_mm_data
+                    ]
+                rollout_completion_ids = self._generate_rollouts(rollout_requests)
                 # Flatten outputs: [prompt1_gen1, prompt1_gen2, ..., prompt2_gen1, prompt2_gen2, ...]
-                completion_ids = [out.token_ids for completion in outputs for out in completion.outputs]                
-                
+                completion_ids = [ids for request_ids in rollout_completion_ids[: len(all_prompts_text)] for ids in request_ids]
                 if self.temporal and shuffled_all_mm_data!=[]:
-                    # Clone to avoid modifying original params
-                    shuffled_sampling_params = copy.deepcopy(self.sampling_params)
-                    shuffled_sampling_params.n = self.num_generations // 2
-                    # Single generate call with all prompts
-                    if self.accelerator.is_main_process:
-                        shuffled_outputs = self.llm.generate(
-                            shuffled_all_multimodal_inputs,
-                            sampling_params=shuffled_sampling_params,
-                            use_tqdm=False,
-                        )
-                    # Flatten outputs: [prompt1_gen1, prompt1_gen2, ..., prompt2_gen1, prompt2_gen2, ...]
-                    shuffled_completion_ids = [out.token_ids for completion in shuffled_outputs for out in completion.outputs]
-                
-                
+                    shuffled_completion_ids = [ids for request_ids in rollout_completion_ids[len(all_prompts_text) :] for ids in request_ids]
             else:
-                completion_ids = [None] * len(all_multimodal_inputs) * self.num_generations
+                completion_ids = [None] * len(all_prompts_text) * self.num_generations
                 
                 if self.temporal and shuffled_all_mm_data!=[]:
-                    shuffled_completion_ids = [None] * len(shuffled_all_multimodal_inputs) * (self.num_generations // 2)
+                    shuffled_completion_ids = [None] * len(shuffled_all_mm_data) * (self.num_generations // 2)
                     
             
             # broadcast and slice
@@ -608,12 +690,7 @@ class Qwen2VLGRPOVLLMTrainerModified(Trainer):
             completion_ids = completion_ids[process_slice]
 
             # Pad the completions, and concatenate them with the prompts
-            completion_ids = [torch.tensor(ids, device=device) for ids in completion_ids]
-            completion_ids = pad(
-                completion_ids, padding_value=self.processing_class.pad_token_id
-            )
-            prompt_ids = prompt_ids.repeat_interleave(self.num_generations, dim=0)
-            prompt_completion_ids = torch.cat([prompt_ids, completion_ids], dim=1)
+            prompt_completion_ids = self._build_prompt_completion_ids(prompt_ids, completion_ids)
 
             prompt_length = prompt_ids.size(1)
             
@@ -661,44 +738,36 @@ class Qwen2VLGRPOVLLMTrainerModified(Trainer):
         
         prompt_inputs.pop("input_ids")
         prompt_inputs.pop("attention_mask")
-        
-        if data_type == 'image':
-            prompt_inputs["pixel_values"] = prompt_inputs["pixel_values"].repeat(len(prompt_completion_ids), 1)
-            prompt_inputs["image_grid_thw"] = prompt_inputs["image_grid_thw"].repeat(len(prompt_completion_ids), 1)
-        # import pdb; pdb.set_trace()
-        
+        if 'second_per_grid_ts' in prompt_inputs:
+            del prompt_inputs["second_per_grid_ts"]
 
-        if data_type == 'video':
-            prompt_inputs["pixel_values_videos"] = prompt_inputs["pixel_values_videos"].repeat(len(prompt_completion_ids), 1)
-            prompt_inputs["video_grid_thw"] = prompt_inputs["video_grid_thw"].repeat(len(prompt_completion_ids), 1)
-            if 'second_per_grid_ts' in prompt_inputs:
-                del prompt_inputs["second_per_grid_ts"]
-                
-        # import pdb
-        # pdb.set_trace()
-                
-        # per_token_logps = self._get_per_token_logps(model, prompt_completion_ids, attention_mask, pixel_values, image_grid_thw)
-        per_token_logps = self._get_per_token_logps(model, prompt_completion_ids, **prompt_inputs)
-        # Get rid of the prompt (-1 because of the shift done in get_per_token_logps)
-        per_token_logps = per_token_logps[:, prompt_length - 1 :]
-        
-        gc.collect()
-        torch.cuda.empty_cache()
-                
-        with torch.inference_mode():
+        with self.memory_planner.phase("policy_forward"):
+            per_token_logps = self._get_completion_logps(
+                model, prompt_completion_ids, prompt_length, completion_mask, prompt_inputs
+            )
+
+        ref_per_token_logps = self.memory_planner.buffer(
+            "ref_per_token_logps",
+            completion_mask.shape,
+            per_token_logps.dtype,
+            max_shape=(completion_mask.size(0), self.max_completion_length),
+        )
+        with self.memory_planner.phase("ref_forward"), torch.inference_mode():
             if self.ref_model is not None:
-                ref_per_token_logps = self._get_per_token_logps(self.ref_model, prompt_completion_ids, **prompt_inputs)
+                self._get_completion_logps(
+                    self.ref_model, prompt_completion_ids, prompt_length, completion_mask, prompt_inputs,
+                    out=ref_per_token_logps,
+                )
             else:
                 with self.accelerator.unwrap_model(model).disable_adapter():
-                    ref_per_token_logps = self._get_per_token_logps(model, prompt_completion_ids, **prompt_inputs)
-        ref_per_token_logps = ref_per_token_logps[:, prompt_length - 1 :]
+                    self._get_completion_logps(
+                        model, prompt_completion_ids, prompt_length, completion_mask, prompt_inputs,
+                        out=ref_per_token_logps,
+                    )
         
         x_clamped = torch.clamp(ref_per_token_logps - per_token_logps, min=-10, max=10)  # 限制 x 的范围
         per_token_kl = torch.exp(x_clamped) - x_clamped - 1
 
-        gc.collect()
-        torch.cuda.empty_cache()
-
         if self.temporal and video_inputs:
             
             shuffled_completions = self.processing_class.batch_decode(shuffled_completion_ids, skip_special_tokens=True)
@@ -711,8 +780,11 @@ class Qwen2VLGRPOVLLMTrainerModified(Trainer):
             for i, (reward_func, reward_processing_class) in enumerate(
                 zip(self.reward_funcs, self.reward_processing_classes)
             ):
-                # Repeat all input columns (but "prompt" and "completion") to match the number of generations
-                shuffled_reward_kwargs = {key: [] for key in inputs[0].keys() if key not in ["prompt", "completion"]}
+                # Repeat all input columns (but "prompt", "completion" and the processor outputs) to match the number
+                # of generations
+                shuffled_reward_kwargs = {
+                    key: [] for key in inputs[0].keys() if key not in ["prompt", "completion", *PROMPT_INPUT_KEYS]
+                }
                 for key in shuffled_reward_kwargs:
                     for example in inputs:
                         # Repeat each value in the column for `num_generations` times
@@ -743,7 +815,7 @@ class Qwen2VLGRPOVLLMTrainerModified(Trainer):
             reward_kwargs = {
                 key: []
                 for key in inputs[0].keys()
-                if key not in ["prompt", "completion"]
+                if key not in ["prompt", "completion", *PROMPT_INPUT_KEYS]
             }
             for key in reward_kwargs:
                 for example in inputs:
@@ -755,6 +827,13 @@ class Qwen2VLGRPOVLLMTrainerModified(Trainer):
             rewards_per_func[:, i] = torch.tensor(
                 output_reward_func, dtype=torch.float32, device=device
             )
+
+        if self.reward_history is not None:
+            # Gather the group accuracies so the history, hence the sampled prompts, stay identical on all ranks
+            group_accuracy = rewards_per_func[:, 0].view(-1, self.num_generations).mean(dim=1).tolist()
+            self.reward_history.update(
+                gather_object([(example["problem_id"], accuracy) for example, accuracy in zip(inputs, group_accuracy)])
+            )
             
             
         # rewards_per_func = gather(rewards_per_func)
@@ -871,7 +950,21 @@ class Qwen2VLGRPOVLLMTrainerModified(Trainer):
 
         mean_kl = ((per_token_kl * completion_mask).sum(dim=1) / completion_mask.sum(dim=1)).mean()
         self._metrics["kl"].append(self.accelerator.gather_for_metrics(mean_kl).mean().item())
-        
+        # Share of the completion positions in the forwards that are padding, with one bucket vs. the configured buckets
+        completion_lengths = completion_mask.sum(dim=1)
+        self._metrics["padding/completion_waste"].append(
+            padding_waste(completion_lengths, length_buckets(completion_lengths, 1))
+        )
+        self._metrics["padding/bucketed_waste"].append(
+            padding_waste(completion_lengths, length_buckets(completion_lengths, self.rollout_buckets))
+        )
+        if self.reward_history is not None:
+            sampler_stats = self.reward_history.stats()
+            self._metrics["difficulty_sampler/saturated_problems"].append(sampler_stats["saturated_problems"])
+            self._metrics["difficulty_sampler/seen_problems"].append(sampler_stats["seen_problems"])
+            self._metrics["difficulty_sampler/saved_rollouts"].append(sampler_stats["saved_draws"] * self.num_generations)
+        for key, value in self.memory_planner.pop_metrics().items():
+            self._metrics[key].append(value)
 
         return loss
     
@@ -0,0 +1,5 @@
+from eval_utils.rescore import main
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@ cd src/r1-v
 export DEBUG_MODE="true" # Enable Debug if you want to see the rollout of model during RL
 export LOG_PATH="./debug_log_2b.txt"
 
+# To pack several examples per sequence, add e.g. `--packing_max_tokens 16384 --per_device_train_batch_size 8` and use
+# `--attn_implementation sdpa`: packing only combines the examples of one batch, so batch size 1 packs nothing.
 
 CUDA_VISIBLE_DEVICES=0,1,2,3 torchrun --nproc_per_node="4" \
     --nnodes="1" \
@@ -0,0 +1,9 @@
+import os
+import sys
+
+
+# The eval scripts run with `src/` on the path, the training scripts with their own directory (they import their
+# siblings, e.g. `shards`, top-level); `open_r1` itself comes from the installed `src/r1-v` package
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, os.path.join(SRC_DIR, "r1-v", "src", "open_r1"))
@@ -0,0 +1,116 @@
+import re
+
+import torch
+
+import compile_dataset
+import sft_video
+from shards import CompiledDataset, ShardWriter
+
+
+PATCH_DIM = 3 * 2 * 14 * 14  # channels * temporal_patch_size * patch_size**2
+FPS = 2.0
+
+
+class FakeTokenizer:
+    """Splits special tokens, words, whitespace and punctuation; ids are assigned on first use."""
+
+    pad_token_id = 0
+
+    def __init__(self):
+        self.vocab = {"<|endoftext|>": 0}
+
+    def convert_tokens_to_ids(self, tokens):
+        if isinstance(tokens, list):
+            return [self.convert_tokens_to_ids(token) for token in tokens]
+        return self.vocab.setdefault(tokens, len(self.vocab))
+
+    def encode(self, text, add_special_tokens=False):
+        return self.convert_tokens_to_ids(re.findall(r"<\|[a-z_]+\|>|\w+|\s|[^\w\s]", text))
+
+
+class FakeQwen25VLProcessor:
+    """
+    The outputs of the Qwen2.5-VL processor for videos, down to the key names and types: every `<|video_pad|>` is
+    expanded to one token per merged patch, and `second_per_grid_ts` is a list of floats.
+    """
+
+    def __init__(self):
+        self.tokenizer = FakeTokenizer()
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=False):
+        text = ""
+        for message in messages:
+            content = "".join(
+                "<|vision_start|><|video_pad|><|vision_end|>" if part["type"] == "video" else part["text"]
+                for part in message["content"]
+            )
+            text += f"<|im_start|>{message['role']}\n{content}<|im_end|>\n"
+        return text
+
+    def __call__(self, text, images=None, videos=None, return_tensors="pt", padding=False, **kwargs):
+        grids = [torch.tensor([video.size(0) // 2, video.size(2) // 14, video.size(3) // 14]) for video in videos]
+        ids = []
+        for prompt in text:
+            for grid in grids:
+                prompt = prompt.replace("<|video_pad|>", "<|placeholder|>" * (int(grid.prod()) // 4), 1)
+            ids.append(self.tokenizer.encode(prompt.replace("<|placeholder|>", "<|video_pad|>")))
+        length = max(len(sequence) for sequence in ids)
+        input_ids = torch.tensor([[self.tokenizer.pad_token_id] * (length - len(seq)) + seq for seq in ids])
+        attention_mask = torch.tensor([[0] * (length - len(seq)) + [1] * len(seq) for seq in ids])
+        # Multiples of 1/4 below 64 are exact in bfloat16, the on-disk patch format
+        pixel_values_videos = torch.cat(
+            [(torch.arange(int(grid.prod()) * PATCH_DIM) % 256 / 4).view(-1, PATCH_DIM) for grid in grids]
+        )
+        return {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "pixel_values_videos": pixel_values_videos,
+            "video_grid_thw": torch.stack(grids),
+            "second_per_grid_ts": [2 / FPS] * len(grids),
+        }
+
+
+def fake_process_vision_info(messages, return_video_kwargs=False, **kwargs):
+    videos = [torch.zeros(4, 3, 28, 28) for message in messages for part in message["content"]
+              if isinstance(part, dict) and part.get("type") == "video"]
+    return None, videos, {"fps": [FPS] * len(videos)}
+
+
+def test_compiled_video_example_collates_like_raw_one(tmp_path, monkeypatch):
+    processor = FakeQwen25VLProcessor()
+    monkeypatch.setattr(sft_video, "processor", processor, raising=False)
+    monkeypatch.setattr(sft_video, "process_vision_info", fake_process_vision_info)
+    monkeypatch.setattr(sft_video, "check_video_quality", lambda path: True)
+    monkeypatch.setattr(compile_dataset, "process_vision_info", fake_process_vision_info)
+
+    example = {
+        "problem_id": 0,
+        "problem": "How many cups are moved?",
+        "problem_type": "numerical",
+        "data_type": "video",
+        "path": "videos/cups.mp4",
+        "process": "<think>Two cups.</think>",
+        "solution": "<answer>2</answer>",
+    }
+
+    raw = sft_video.collate_fn([sft_video.prepare_dataset(example)])
+
+    inputs, metadata = compile_dataset.compile_sft_example(example, processor)
+    writer = ShardWriter(str(tmp_path), {"pixel_dtype": "bfloat16"})
+    writer.write(
+        inputs["input_ids"][0],
+        "pixel_values_videos",
+        inputs["pixel_values_videos"],
+        inputs["video_grid_thw"],
+        metadata,
+        second_per_grid_ts=inputs["second_per_grid_ts"],
+    )
+    writer.close()
+    compiled = sft_video.collate_compiled_fn([CompiledDataset(str(tmp_path))[0]])
+
+    assert set(compiled) == set(raw)
+    for key in ("input_ids", "attention_mask", "labels", "video_grid_thw"):
+        assert torch.equal(compiled[key], raw[key]), key
+    assert torch.equal(compiled["pixel_values_videos"].float(), raw["pixel_values_videos"])
+    assert torch.equal(compiled["second_per_grid_ts"], torch.as_tensor(raw["second_per_grid_ts"]))
+    assert (raw["labels"] != -100).any()
@@ -0,0 +1,70 @@
+import json
+
+from PIL import Image
+
+from eval_utils import Benchmark, merge_shards
+from eval_utils.backends import MockBackend, PlainChatTemplate
+from eval_utils.runner import evaluate
+
+
+NUM_SAMPLES = 20
+
+
+def make_benchmark(tmp_path, num_shards=1, shard_id=0):
+    return Benchmark(
+        name="mock",
+        prompt_path=str(tmp_path / "eval_mock.json"),
+        output_path=str(tmp_path / "eval_mock_output.json"),
+        media_root=str(tmp_path),
+        shard_id=shard_id,
+        num_shards=num_shards,
+    )
+
+
+def write_samples(tmp_path):
+    # A few images shared by several samples, and a mix of the problem types scored by evaluation
+    for i in range(4):
+        Image.new("RGB", (56, 56), color=(60 * i, 0, 0)).save(tmp_path / f"image{i}.png")
+    samples = []
+    for idx in range(NUM_SAMPLES):
+        sample = {"data_type": "image", "path": f"image{idx % 4}.png", "problem": f"Question {idx}?"}
+        if idx % 3 == 0:
+            sample.update(problem_type="multiple choice", options=["A. a", "B. b", "C. c", "D. d"],
+                          solution=f"<answer>{'ABCD'[idx % 4]}</answer>")
+        elif idx % 3 == 1:
+            sample.update(problem_type="numerical", solution=f"<answer>{idx % 10}</answer>")
+        else:
+            sample.update(problem_type="regression", solution=f"<answer>{idx % 7 + 1}</answer>")
+        samples.append(sample)
+    with open(tmp_path / "eval_mock.json", "w", encoding="utf-8") as f:
+        json.dump(samples, f)
+
+
+def load_results(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return {record["index"]: record for record in map(json.loads, f)}
+
+
+def test_sharded_evaluation_matches_single_run(tmp_path):
+    single_dir, sharded_dir = tmp_path / "single", tmp_path / "sharded"
+    single_dir.mkdir()
+    sharded_dir.mkdir()
+    for directory in (single_dir, sharded_dir):
+        write_samples(directory)
+
+    backend, processor = MockBackend(num_tokens=16), PlainChatTemplate()
+    single = evaluate([make_benchmark(single_dir)], backend, processor, batch_size=4)["mock"]
+
+    benchmark = make_benchmark(sharded_dir, num_shards=3)
+    for shard in benchmark.shards():
+        evaluate([shard], backend, processor, batch_size=4)
+    merged = merge_shards(benchmark)
+
+    assert merged["num_samples"] == single["num_samples"] == NUM_SAMPLES
+    assert merged["missing_samples"] == 0
+    assert merged["final_acc"] == single["final_acc"]
+    single_results = load_results(make_benchmark(single_dir).results_path)
+    merged_results = load_results(benchmark.unsharded().results_path)
+    assert {idx: r["reward"] for idx, r in merged_results.items()} == {
+        idx: r["reward"] for idx, r in single_results.items()
+    }